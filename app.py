@@ -6,8 +6,9 @@ from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
 import ee
 from services.ee.ee_client import init_ee
+from services.ee.ee_batch import start_roundtrip_counter, ROUNDTRIPS_HEADER
 from config import BASE_OUTPUT_DIR
-from services.db import init_db
+from services.db import init_db, close_connections
 from routes.measurements import router as measurements_router
 from routes.compute import router as compute_router
 from routes.auth import router as auth_router
@@ -17,6 +18,9 @@ from routes.kml import router as kml_router
 from routes.time_series import router as time_series_router
 from routes.dates import router as dates_router
 from routes.heatmap import router as heatmap_router
+from routes.jobs import router as jobs_router
+from services.jobs import resume_jobs
+from services.write_behind import db_writer
 
 # that pull them from `app` keep working. This centralizes helper logic.
 from utils_pkg import (
@@ -35,7 +39,16 @@ from utils_pkg import (
 load_dotenv()
 
 app = FastAPI(title="GEE FastAPI")
-app.add_middleware(CORSMiddleware, allow_origins=["*"], allow_methods=["*"], allow_headers=["*"])
+app.add_middleware(CORSMiddleware, allow_origins=["*"], allow_methods=["*"], allow_headers=["*"], expose_headers=[ROUNDTRIPS_HEADER])
+
+
+@app.middleware("http")
+async def _count_ee_roundtrips(request, call_next):
+    # Reportar cuántas llamadas bloqueantes a EE hizo cada petición
+    counter = start_roundtrip_counter()
+    response = await call_next(request)
+    response.headers[ROUNDTRIPS_HEADER] = str(counter['count'])
+    return response
 
 
 @app.on_event("startup")
@@ -50,6 +63,19 @@ def _startup():
         init_db()
     except Exception as e:
         print(f"Warning: no se pudo inicializar la DB: {e}")
+    db_writer.start()
+    # Re-encolar jobs que quedaron a medias en un reinicio
+    try:
+        resume_jobs()
+    except Exception as e:
+        print(f"Warning: no se pudieron reanudar los jobs: {e}")
+
+
+@app.on_event("shutdown")
+def _shutdown():
+    # Escribir lo pendiente en la cola write-behind antes de cerrar conexiones
+    db_writer.stop()
+    close_connections()
 
 
 # Registrar routers (las rutas están en /routes)
@@ -61,4 +87,5 @@ app.include_router(assets_router)
 app.include_router(kml_router)
 app.include_router(time_series_router)
 app.include_router(dates_router)
-app.include_router(heatmap_router)
+app.include_router(heatmap_router)
+app.include_router(jobs_router)
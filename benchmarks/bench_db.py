@@ -0,0 +1,143 @@
+"""Benchmark de services/db.py: conexión por consulta (antiguo) vs conexiones por hilo.
+
+Simula varios hilos del threadpool de FastAPI insertando mediciones y
+consultándolas a la vez sobre una base SQLite temporal.
+
+Uso:
+    python benchmarks/bench_db.py [--threads 8] [--inserts 500] [--queries 200]
+"""
+import argparse
+import datetime
+import os
+import shutil
+import sqlite3
+import sys
+import tempfile
+import threading
+import time
+from pathlib import Path
+
+# BASE_OUTPUT_DIR debe fijarse antes de importar config/services.db
+_tmp = tempfile.mkdtemp(prefix='terra_bench_')
+os.environ['BASE_OUTPUT_DIR'] = _tmp
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from services import db  # noqa: E402
+
+
+# --- Acceso antiguo: abrir, ejecutar, commit y cerrar en cada llamada ---
+
+def _legacy_connect(path):
+    path.parent.mkdir(parents=True, exist_ok=True)
+    conn = sqlite3.connect(str(path), timeout=30)
+    conn.row_factory = sqlite3.Row
+    return conn
+
+
+def legacy_insert_measurement(path, **kw):
+    conn = _legacy_connect(path)
+    try:
+        cur = conn.cursor()
+        cur.execute('''
+        INSERT INTO measurements(metric_id, tenant_id, plot_id, ts, metric_type, value, quality)
+        VALUES (?, ?, ?, ?, ?, ?, ?)
+        ''', (kw.get('metric_id'), kw.get('tenant_id'), kw.get('plot_id'), kw.get('ts'), kw.get('metric_type'), kw.get('value'), kw.get('quality')))
+        conn.commit()
+        return cur.lastrowid
+    finally:
+        conn.close()
+
+
+def legacy_list_measurements(path, plot_id=None, limit=100):
+    conn = _legacy_connect(path)
+    try:
+        cur = conn.cursor()
+        cur.execute('SELECT * FROM measurements WHERE plot_id = ? ORDER BY ts DESC LIMIT ?', (plot_id, limit))
+        return [dict(r) for r in cur.fetchall()]
+    finally:
+        conn.close()
+
+
+def _create_schema(path):
+    conn = sqlite3.connect(str(path))
+    try:
+        conn.execute('''
+        CREATE TABLE IF NOT EXISTS measurements (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            metric_id TEXT, tenant_id TEXT, plot_id TEXT, ts TEXT,
+            metric_type TEXT, value REAL, quality TEXT
+        )''')
+        conn.commit()
+    finally:
+        conn.close()
+
+
+def _run_threads(n_threads, target):
+    threads = [threading.Thread(target=target, args=(t,)) for t in range(n_threads)]
+    t0 = time.perf_counter()
+    for th in threads:
+        th.start()
+    for th in threads:
+        th.join()
+    return time.perf_counter() - t0
+
+
+def _count_rows(path):
+    conn = sqlite3.connect(str(path))
+    try:
+        return conn.execute('SELECT COUNT(*) FROM measurements').fetchone()[0]
+    finally:
+        conn.close()
+
+
+_T0 = datetime.datetime(2024, 1, 1)
+
+
+def _workload(insert_fn, list_fn, n_threads, n_inserts, n_queries):
+    def do_inserts(t):
+        for i in range(n_inserts):
+            # (plot_id, metric_type, ts) único por insert: con el upsert por clave natural
+            # un ts repetido actualizaría filas y las consultas medirían una tabla menor
+            ts = (_T0 + datetime.timedelta(seconds=t * n_inserts + i)).strftime('%Y-%m-%dT%H:%M:%SZ')
+            insert_fn(metric_id=f'm{t}_{i}', plot_id=f'plot{t % 4}', ts=ts,
+                      metric_type='ndvi', value=i * 0.001, quality='ok')
+
+    def do_queries(t):
+        for _ in range(n_queries):
+            list_fn(plot_id=f'plot{t % 4}', limit=100)
+
+    insert_s = _run_threads(n_threads, do_inserts)
+    query_s = _run_threads(n_threads, do_queries)
+    return n_threads * n_inserts / insert_s, n_threads * n_queries / query_s
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--threads', type=int, default=8)
+    parser.add_argument('--inserts', type=int, default=500, help='inserts por hilo')
+    parser.add_argument('--queries', type=int, default=200, help='consultas por hilo')
+    args = parser.parse_args()
+
+    legacy_path = Path(_tmp) / 'legacy.db'
+    _create_schema(legacy_path)
+    legacy = _workload(
+        lambda **kw: legacy_insert_measurement(legacy_path, **kw),
+        lambda **kw: legacy_list_measurements(legacy_path, **kw),
+        args.threads, args.inserts, args.queries,
+    )
+
+    db.init_db()
+    pooled = _workload(db.insert_measurement, db.list_measurements, args.threads, args.inserts, args.queries)
+    db.close_connections()
+    legacy_rows, pooled_rows = _count_rows(legacy_path), _count_rows(db.DB_PATH)
+
+    print(f"threads={args.threads} inserts/hilo={args.inserts} consultas/hilo={args.queries}")
+    print(f"{'':10}{'inserts/s':>12}{'consultas/s':>14}{'filas':>10}")
+    print(f"{'antiguo':10}{legacy[0]:12.0f}{legacy[1]:14.0f}{legacy_rows:10d}")
+    print(f"{'pool+WAL':10}{pooled[0]:12.0f}{pooled[1]:14.0f}{pooled_rows:10d}")
+    print(f"{'mejora':10}{pooled[0] / legacy[0]:11.1f}x{pooled[1] / legacy[1]:13.1f}x")
+    shutil.rmtree(_tmp, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    main()
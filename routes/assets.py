@@ -1,25 +1,112 @@
 from fastapi import APIRouter, HTTPException, Depends
-from services.db import list_assets, get_asset
+from fastapi.responses import StreamingResponse
+from services.db import list_assets, get_asset, iter_assets, search_assets, search_plots, next_page_cursor, check_page_cursor, ASSETS_PAGE_KEYS
+from services.write_behind import db_writer
 from auth import get_current_user
+from pydantic import BaseModel
+from typing import Literal, Optional
+
+import json
 
 router = APIRouter()
 
+DEFAULT_PAGE_SIZE = 100
+
 
 @router.get('/assets')
-def get_assets(tenant_id: str = None, plot_id: str = None, limit: int = 100, current_user: dict = Depends(get_current_user)):
+def get_assets(tenant_id: str = None, plot_id: str = None, limit: int = None, cursor: str = None, stream: bool = False, current_user: dict = Depends(get_current_user)):
+    """Assets más recientes primero, paginados con `cursor` (usar `next_cursor` de la respuesta).
+
+    Con stream=true responde NDJSON (un asset por línea) leyendo por lotes desde la BD.
+    """
     try:
-        results = list_assets(tenant_id=tenant_id, plot_id=plot_id, limit=limit)
+        check_page_cursor(cursor, ASSETS_PAGE_KEYS)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    try:
+        # Incluir los assets aún en la cola write-behind
+        db_writer.flush()
+        if stream:
+            rows = iter_assets(tenant_id=tenant_id, plot_id=plot_id, limit=limit, cursor=cursor)
+            return StreamingResponse((json.dumps(r) + '\n' for r in rows), media_type='application/x-ndjson')
+        limit = limit or DEFAULT_PAGE_SIZE
+        results = list_assets(tenant_id=tenant_id, plot_id=plot_id, limit=limit, cursor=cursor)
         return {
             'count': len(results),
-            'assets': results
+            'assets': results,
+            'next_cursor': next_page_cursor(results, limit, ASSETS_PAGE_KEYS)
         }
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 
+class AssetSearchRequest(BaseModel):
+    geometry: dict  # GeoJSON (Polygon, MultiPolygon, Feature...)
+    relation: Literal['intersects', 'covers'] = 'intersects'
+    product: Optional[str] = None
+    tenant_id: Optional[str] = None
+    plot_id: Optional[str] = None
+    limit: int = 100
+
+
+def _parse_bbox(bbox: str):
+    try:
+        values = [float(v) for v in bbox.split(',')]
+    except Exception:
+        values = []
+    if len(values) != 4 or values[0] > values[2] or values[1] > values[3]:
+        raise HTTPException(status_code=400, detail='bbox debe ser west,south,east,north')
+    return values
+
+
+@router.get('/assets/search')
+def search_assets_bbox(bbox: str, relation: Literal['intersects', 'covers'] = 'intersects', product: str = None,
+                       tenant_id: str = None, plot_id: str = None, limit: int = 100):
+    """Assets cuya extensión intersecta (o cubre, relation=covers) el bbox west,south,east,north."""
+    values = _parse_bbox(bbox)
+    try:
+        db_writer.flush()
+        results = search_assets(bbox=values, relation=relation, product=product, tenant_id=tenant_id, plot_id=plot_id, limit=limit)
+        return {'count': len(results), 'assets': results}
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+
+@router.get('/search')
+def search_bbox(bbox: str, kind: Literal['all', 'plots', 'assets'] = 'all', relation: Literal['intersects', 'covers'] = 'intersects',
+                limit: int = 100):
+    """Parcelas registradas y/o assets cuya extensión intersecta (o cubre) el bbox west,south,east,north."""
+    values = _parse_bbox(bbox)
+    try:
+        out = {}
+        if kind in ('all', 'plots'):
+            out['plots'] = search_plots(values, relation=relation, limit=limit)
+        if kind in ('all', 'assets'):
+            db_writer.flush()
+            out['assets'] = search_assets(bbox=values, relation=relation, limit=limit)
+        return out
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+
+@router.post('/assets/search')
+def search_assets_geometry(req: AssetSearchRequest):
+    """Assets que intersectan (o cubren, p.ej. "¿ya hay un export de esta parcela?") una geometría."""
+    try:
+        db_writer.flush()
+        results = search_assets(geometry=req.geometry, relation=req.relation, product=req.product,
+                                tenant_id=req.tenant_id, plot_id=req.plot_id, limit=req.limit)
+        return {'count': len(results), 'assets': results}
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+
 @router.get('/assets/{asset_id}')
 def get_asset_meta(asset_id: str):
     try:
+        db_writer.flush()
         a = get_asset(asset_id)
         if not a:
             raise HTTPException(status_code=404, detail='asset not found')
@@ -1,15 +1,25 @@
 from fastapi import APIRouter, HTTPException
-from fastapi.responses import FileResponse
+from fastapi.responses import FileResponse, JSONResponse
 from schemas.models import ComputeRequest, ComputeResponse
-from services.ee.ee_client import compute_sentinel2_index, get_sentinel2_time_series
+from services.ee.ee_client import compute_sentinel2_index
+from services.series import incremental_time_series
+from services.ee.ee_composite import get_composite
+from services.ee.ee_indices import classify_breaks
+from services.ee.ee_batch import EEBundle, get_map_id
+from services.ee.ee_executor import EECall, run_parallel
+from services.ee.ee_zonal import zonal_stats
+from utils_pkg.singleflight import ee_flights
+from services.jobs import submit_job, register_job_handler
 from config import BASE_OUTPUT_DIR
 from utils_pkg import ensure_outputs_dir, timestamped_base
-import json
 import ee
 from pathlib import Path
 import requests
 import time
-from services.db import insert_asset, insert_measurement
+from services.write_behind import db_writer
+from services.plots import get_plot
+from utils_pkg.stats_plan import plan_stats
+from services.progressive import progressive_plans, reduce_stats, submit_refine_job
 import traceback
 import os
 
@@ -19,22 +29,208 @@ ERROR_LOG_DIR.mkdir(parents=True, exist_ok=True)
 router = APIRouter()
 
 
+def _prepare_heatmap_layer(img, band, vis):
+    """Capa del modo heatmap para un índice: banda(s) reproyectadas, clasificación discreta
+    si la vis la pide, imagen para tiles y parámetros de getMapId. No evalúa nada en EE."""
+    try:
+        layer = img.select(band)
+    except Exception as e:
+        # Log detailed info and re-raise as 500 so caller sees the failure
+        import traceback
+        tb = traceback.format_exc()
+        print(f"compute: failed to select band '{band}' from image: {e}\n{tb}")
+        raise HTTPException(status_code=500, detail=f"Error selecting band '{band}': {e}")
+
+    # Reproyectar y aplicar resampling bicúbico para mejor calidad visual
+    # Usar escala de 10m (nativa de Sentinel-2) con resampling bicúbico
+    layer = layer.reproject(crs='EPSG:3857', scale=10).resample('bicubic')
+    # Banda objetivo de las estadísticas (si layer tiene varias, la primera)
+    target_band = band[0] if isinstance(band, (list, tuple)) else band
+
+    # Prepare visualization parameters. If the vis requests a discrete (classified) palette,
+    # build a classified image and create a vis_map that maps classes 0..N to the palette.
+    vis_map = None
+    # If vis is a dict, copy it (we'll override for discrete)
+    try:
+        vis_map = dict(vis) if isinstance(vis, dict) else None
+    except Exception:
+        vis_map = None
+
+    # If the vis requests a discrete (classified) palette, build a classified image
+    try:
+        if isinstance(vis, dict) and vis.get('discrete'):
+            breaks = vis.get('breaks') or []
+            if breaks:
+                # Una sola operación: número de breaks que supera cada píxel
+                # (0 si <= primer break, len(breaks) por encima del último)
+                classified = classify_breaks(layer, breaks)
+                # Replace layer with a single-band classified image for visualization
+                layer = classified
+                target_band = 'class'
+                # Build vis_map for classes 0..n
+                num_classes = len(breaks) + 1
+                palette = list(vis.get('palette') or [])
+                # Ensure palette length equals num_classes; pad by repeating last color if needed
+                if len(palette) < num_classes:
+                    if palette:
+                        while len(palette) < num_classes:
+                            palette.append(palette[-1])
+                    else:
+                        palette = ['#000000'] * num_classes
+                elif len(palette) > num_classes:
+                    palette = palette[:num_classes]
+                # classes are 0..num_classes-1
+                vis_map = {'min': 0, 'max': num_classes - 1, 'palette': palette}
+    except Exception as e:
+        print('compute: failed building discrete classified image', e)
+
+    # Build a visualization image so tiles are already colored on server side.
+    try:
+        # If vis_map has a palette and the layer is single-band (not RGB), use visualize()
+        is_rgb_band = isinstance(band, (list, tuple))
+    except Exception:
+        is_rgb_band = False
+
+    vis_image = layer
+    visualized_on_server = False
+    # Prefer palette from vis_map (created for discrete), otherwise from vis
+    palette_to_use = None
+    palette_min = None
+    palette_max = None
+    try:
+        if isinstance(vis_map, dict) and vis_map.get('palette'):
+            palette_to_use = list(vis_map.get('palette'))
+            palette_min = vis_map.get('min')
+            palette_max = vis_map.get('max')
+        elif isinstance(vis, dict) and vis.get('palette'):
+            palette_to_use = list(vis.get('palette'))
+            palette_min = vis.get('min')
+            palette_max = vis.get('max')
+        # Fallback: if palette missing, but min/max present, we can still call getMapId with those
+    except Exception:
+        palette_to_use = None
+
+    # If single-band and we have a palette, try to bake colors server-side using visualize()
+    try:
+        if palette_to_use and (not is_rgb_band):
+            # Ensure palette entries are strings and non-empty
+            palette_to_use = [str(p) for p in palette_to_use if p]
+            if not palette_to_use:
+                palette_to_use = ['#000000', '#ffffff']
+            # Ensure min/max defaults
+            if palette_min is None:
+                palette_min = 0
+            if palette_max is None:
+                palette_max = 1
+            try:
+                vis_image = layer.visualize(min=palette_min, max=palette_max, palette=palette_to_use)
+                # Ensure the visualized image is an 8-bit RGB image
+                try:
+                    vis_image = vis_image.toUint8()
+                except Exception:
+                    pass
+                visualized_on_server = True
+                print('compute: successfully visualized image on server')
+            except Exception as e:
+                # visualize() may fail for classified images depending on types; fallback to raw layer
+                print('compute: visualize() failed, will rely on getMapId with vis params', e)
+                vis_image = layer
+        else:
+            # No palette or RGB bands: keep the raw layer and rely on getMapId with vis_map/vis
+            vis_image = layer
+    except Exception as e:
+        print('compute: error while preparing vis_image', e)
+        vis_image = layer
+
+    # Aplicar resampling bicúbico a la imagen visualizada para suavizar
+    vis_image = vis_image.resample('bicubic')
+
+    # Debug: log visualization decision & maps
+    print(f"compute: vis_map={vis_map}, visualized_on_server={visualized_on_server}")
+
+    # For visualized RGB images, pass an empty vis dict to getMapId because colors are baked in.
+    if visualized_on_server:
+        getmap_params = {}
+    elif palette_to_use and (not is_rgb_band):
+        # We did not visualize; if we detected a palette earlier, pass it to getMapId so EE colors tiles
+        getmap_params = {'min': (palette_min if palette_min is not None else 0), 'max': (palette_max if palette_max is not None else 1), 'palette': palette_to_use}
+    else:
+        getmap_params = vis_map if vis_map else (vis if isinstance(vis, dict) else {})
+
+    # Prepare vis metadata for response. If we baked colors on server, indicate that and include palette for legend.
+    if visualized_on_server:
+        vis_return = {'baked': True, 'palette': vis_map.get('palette') if isinstance(vis_map, dict) else None, 'min': vis_map.get('min') if isinstance(vis_map, dict) else None, 'max': vis_map.get('max') if isinstance(vis_map, dict) else None}
+    else:
+        vis_return = vis if isinstance(vis, dict) else vis_map
+
+    return {'layer': layer, 'target_band': target_band, 'vis_map': vis_map, 'vis_image': vis_image, 'getmap_params': getmap_params, 'vis_return': vis_return}
+
+
+def _master_visualization(img, band, vis):
+    """Imagen del mosaico maestro del modo split y sus parámetros de getMapId.
+
+    Con paleta y una sola banda la imagen se visualiza en el servidor (parámetros
+    vacíos); si no, se usa la vis del índice. No evalúa nada en EE.
+    """
+    try:
+        layer = img.select(band)
+    except Exception:
+        layer = img
+    # Reproyectar y aplicar resampling bicúbico para mejor calidad visual
+    layer = layer.reproject(crs='EPSG:3857', scale=10).resample('bicubic')
+
+    vis_map = dict(vis) if isinstance(vis, dict) else None
+    palette = list(vis_map.get('palette') or []) if vis_map else []
+    if palette and not isinstance(band, (list, tuple)):
+        palette = [str(p) for p in palette if p] or ['#000000', '#ffffff']
+        pmin = vis_map.get('min') if vis_map.get('min') is not None else 0
+        pmax = vis_map.get('max') if vis_map.get('max') is not None else 1
+        try:
+            vis_image = layer.visualize(min=pmin, max=pmax, palette=palette)
+            try:
+                vis_image = vis_image.toUint8()
+            except Exception:
+                pass
+            return vis_image.resample('bicubic'), {}
+        except Exception:
+            return layer.resample('bicubic'), {'min': pmin, 'max': pmax, 'palette': palette}
+    return layer.resample('bicubic'), (vis_map or {})
+
+
+def _stat_values(stats_info, name):
+    """(min, max, mean, stddev) de la banda `name` en el resultado de reduceRegion, como floats."""
+    values = []
+    for stat in ('min', 'max', 'mean', 'stdDev'):
+        # keys could be like '<band>_mean' or 'mean' depending on EE; comprobar varias
+        v = stats_info.get(f"{name}_{stat}") if isinstance(stats_info, dict) else None
+        if v is None and isinstance(stats_info, dict):
+            v = stats_info.get(stat)
+        # Coerce to floats when possible
+        try:
+            v = float(v) if v is not None else None
+        except Exception:
+            v = None
+        values.append(v)
+    return tuple(values)
+
+
 @router.post('/compute', response_model=ComputeResponse)
 def compute(req: ComputeRequest):
     # Manejo explícito de errores: re-lanzar HTTPException para que FastAPI devuelva el código correcto
     try:
+        # Exports largos (png/geotiff) pueden ir a un job en segundo plano
+        if getattr(req, 'async_job', False) and req.mode == 'heatmap' and not getattr(req, 'split_kml', False) and getattr(req, 'export_format', None) in ('png', 'geotiff'):
+            from utils_pkg import resolve_roi
+            _, roi_bounds, roi_geojson = resolve_roi(req)
+            job_id = submit_job('compute_export', req.model_dump())
+            return {'mode': req.mode, 'index': req.index, 'roi': roi_geojson, 'roi_bounds': roi_bounds, 'job_id': job_id}
+
         # Si se solicitó procesar por feature (split_kml), usamos un patrón "master composite + recortes"
         if getattr(req, 'split_kml', False):
             fc = None
-            # 1) kml_id apunta a un geojson guardado
+            # 1) kml_id apunta a una parcela registrada
             if getattr(req, 'kml_id', None):
-                geojson_path = Path(BASE_OUTPUT_DIR) / 'kml_uploads' / f"{req.kml_id}.geojson"
-                if geojson_path.exists():
-                    with open(geojson_path, 'r', encoding='utf-8') as fh:
-                        try:
-                            fc = json.load(fh)
-                        except Exception:
-                            fc = None
+                fc = _registered_feature_collection(req.kml_id)
             # 2) geometry es una FeatureCollection
             if not fc and getattr(req, 'geometry', None) and isinstance(req.geometry, dict) and req.geometry.get('type') == 'FeatureCollection':
                 fc = req.geometry
@@ -75,135 +271,54 @@ def compute(req: ComputeRequest):
             master_roi = ee.Geometry.Rectangle(master_bbox)
 
             # Build master composite once (avoid recomposition per feature)
-            from utils_pkg import index_band_and_vis, make_cache_key, load_mapid, save_mapid, split_feature_collection
+            from utils_pkg import index_band_and_vis, request_fingerprint, bounds_to_polygon, get_or_create_mapid, split_feature_collection, prepared_ee_geometry
             band, vis = index_band_and_vis(req.index, satellite='sentinel2')
 
             # Cache key uses index, date range, cloud_pct and master bbox extent
-            cache_params = {'index': req.index, 'start': req.start, 'end': req.end, 'cloud_pct': getattr(req, 'cloud_pct', 30), 'bbox': master_bbox}
-            cache_key = make_cache_key(cache_params)
-            cache_key = make_cache_key(cache_params)
-            cached = load_mapid(cache_key)
-
-            master_tile = None
-            vis_image = None
-            visualized_on_server = False
-            palette_to_use = None
-            palette_min = None
-            palette_max = None
-
-            # If cached tile template exists, reuse it (no recomposition)
-            if cached and isinstance(cached, dict) and cached.get('tile_url_template'):
-                master_tile = cached.get('tile_url_template')
-
-            # If we don't have a cached tile, build the master composite and visualized image
-            if not master_tile:
-                img = compute_sentinel2_index(master_roi, req.start, req.end, req.index, getattr(req, 'cloud_pct', 30))
+            cache_key = request_fingerprint(bounds_to_polygon(master_bbox), kind='split_master', index=req.index, start=req.start, end=req.end, cloud_pct=getattr(req, 'cloud_pct', 30))
+
+            def _master_image():
+                img = compute_sentinel2_index(master_roi, req.start, req.end, req.index, getattr(req, 'cloud_pct', 30), roi_geojson=bounds_to_polygon(master_bbox))
                 if img is None:
                     raise HTTPException(status_code=404, detail='No images for master composition')
-                try:
-                    layer = img.select(band)
-                except Exception:
-                    layer = img
-                
-                # Reproyectar y aplicar resampling bicúbico para mejor calidad visual
-                layer = layer.reproject(crs='EPSG:3857', scale=10).resample('bicubic')
-
-                # Prepare vis_map/palette
-                vis_map = None
-                try:
-                    vis_map = dict(vis) if isinstance(vis, dict) else None
-                except Exception:
-                    vis_map = None
-
-                try:
-                    if isinstance(vis_map, dict) and vis_map.get('palette'):
-                        palette_to_use = list(vis_map.get('palette'))
-                        palette_min = vis_map.get('min')
-                        palette_max = vis_map.get('max')
-                    elif isinstance(vis, dict) and vis.get('palette'):
-                        palette_to_use = list(vis.get('palette'))
-                        palette_min = vis.get('min')
-                        palette_max = vis.get('max')
-                except Exception:
-                    palette_to_use = None
-
-                try:
-                    is_rgb_band = isinstance(band, (list, tuple))
-                except Exception:
-                    is_rgb_band = False
+                return _master_visualization(img, band, vis)
 
-                # Try server-side visualize if palette available
+            def _create_master_mapid():
+                # Refresco del caché: reconstruye la imagen a partir de los parámetros de la
+                # petición y solo retorna la plantilla (no toca el estado de la petición)
+                vis_image, getmap_params = _master_image()
                 try:
-                    if palette_to_use and (not is_rgb_band):
-                        palette_to_use = [str(p) for p in palette_to_use if p]
-                        if not palette_to_use:
-                            palette_to_use = ['#000000', '#ffffff']
-                        if palette_min is None:
-                            palette_min = 0
-                        if palette_max is None:
-                            palette_max = 1
-                        try:
-                            vis_image = layer.visualize(min=palette_min, max=palette_max, palette=palette_to_use)
-                            try:
-                                vis_image = vis_image.toUint8()
-                            except Exception:
-                                pass
-                            visualized_on_server = True
-                        except Exception:
-                            vis_image = layer
-                    else:
-                        vis_image = layer
-                except Exception:
-                    vis_image = layer
-                
-                # Aplicar resampling bicúbico a la imagen visualizada
-                vis_image = vis_image.resample('bicubic')
-
-                # Generate master mapid and cache the tile template
-                try:
-                    if visualized_on_server:
-                        m = vis_image.getMapId({})
-                    else:
-                        if palette_to_use and (not is_rgb_band):
-                            gm = {'min': (palette_min if palette_min is not None else 0), 'max': (palette_max if palette_max is not None else 1), 'palette': palette_to_use}
-                            m = vis_image.getMapId(gm)
-                        else:
-                            getmap_params = vis_map if vis_map else (vis if isinstance(vis, dict) else {})
-                            m = vis_image.getMapId(getmap_params)
-                    master_tile = m['tile_fetcher'].url_format
-                    save_mapid(cache_key, {'tile_url_template': master_tile})
+                    m = get_map_id(vis_image, getmap_params)
+                    return {'tile_url_template': m['tile_fetcher'].url_format}
                 except Exception as e:
                     print('compute: failed to getMapId for master image', e)
                     raise HTTPException(status_code=500, detail=f'Error generating master tiles: {e}')
 
-            # Now build per-feature results: prefer per-feature clipped mapids (cheap) but if master_tile exists reuse it
+            # Reuse the cached tile template when available (no recomposition); stale entries are
+            # served immediately and renewed in the background.
+            master_tile = get_or_create_mapid(cache_key, _create_master_mapid).get('tile_url_template')
+
+            # Per-feature tiles are clipped from the master visualization; if it cannot be
+            # built, every feature falls back to the master tile template
+            try:
+                vis_image, getmap_params = _master_image()
+            except Exception as e:
+                print('compute: master image unavailable for per-feature tiles', e)
+                vis_image, getmap_params = None, None
             feats = split_feature_collection(fc)
             features_results = []
             for f in feats:
                 try:
                     geom = f.get('geometry')
                     feature_result = {'feature_id': f.get('id'), 'feature_name': f.get('name'), 'area_m2': f.get('area_m2')}
-                    # If we have the vis_image in memory we can clip and call getMapId for per-feature tiles
                     if vis_image is not None:
                         try:
-                            clipped = vis_image.clip(ee.Geometry(geom))
-                            # use same params as master: if visualized_on_server, empty params
-                            if visualized_on_server:
-                                mm = clipped.getMapId({})
-                            else:
-                                if palette_to_use and (not is_rgb_band):
-                                    gm = {'min': (palette_min if palette_min is not None else 0), 'max': (palette_max if palette_max is not None else 1), 'palette': palette_to_use}
-                                    mm = clipped.getMapId(gm)
-                                else:
-                                    getmap_params = vis_map if vis_map else (vis if isinstance(vis, dict) else {})
-                                    mm = clipped.getMapId(getmap_params)
-                            tile_url = mm['tile_fetcher'].url_format
-                            feature_result['tileUrlTemplate'] = tile_url
+                            mm = get_map_id(vis_image.clip(prepared_ee_geometry(geom)), getmap_params)
+                            feature_result['tileUrlTemplate'] = mm['tile_fetcher'].url_format
                         except Exception:
                             # fallback: return master_tile so client can still request tiles for the feature extent
                             feature_result['tileUrlTemplate'] = master_tile
                     else:
-                        # No vis_image in memory (we used cached master); return master tile template
                         feature_result['tileUrlTemplate'] = master_tile
 
                     features_results.append(feature_result)
@@ -213,8 +328,11 @@ def compute(req: ComputeRequest):
             return {'mode': req.mode, 'index': req.index, 'features': features_results, 'master_tile': master_tile}
 
         # ROI selection logic (kml_id, geometry, lon/lat)
-        from utils_pkg import get_roi_from_request
-        roi, roi_bounds = get_roi_from_request(req)
+        from utils_pkg import resolve_roi, bounds_to_polygon
+        roi, roi_bounds, roi_geojson = resolve_roi(req)
+        # bbox/footprint para los assets ya se conocen del lado cliente
+        bbox = bounds_to_polygon(roi_bounds)
+        footprint = roi_geojson
 
         band, vis = None, None
         # Determine band/vis
@@ -222,212 +340,99 @@ def compute(req: ComputeRequest):
         band, vis = index_band_and_vis(req.index, satellite='sentinel2')
 
         if req.mode == 'heatmap':
-            img = compute_sentinel2_index(roi, req.start, req.end, req.index, getattr(req, 'cloud_pct', 30))
-            if img is None:
-                print(f"compute: compute_sentinel2_index returned None for index={req.index}")
-                raise HTTPException(status_code=404, detail='No images')
-            # Try to inspect the image bands for debugging
-            try:
-                band_names = img.bandNames().getInfo()
-                print(f"compute: compute_sentinel2_index returned image with bands={band_names}")
-            except Exception as e:
-                print(f"compute: could not read bandNames from image: {e}")
-                band_names = None
-
-            try:
-                layer = img.select(band)
-            except Exception as e:
-                # Log detailed info and re-raise as 500 so caller sees the failure
-                import traceback
-                tb = traceback.format_exc()
-                print(f"compute: failed to select band '{band}' from image: {e}\n{tb}")
-                raise HTTPException(status_code=500, detail=f"Error selecting band '{band}': {e}")
-            
-            # Reproyectar y aplicar resampling bicúbico para mejor calidad visual
-            # Usar escala de 10m (nativa de Sentinel-2) con resampling bicúbico
-            layer = layer.reproject(crs='EPSG:3857', scale=10).resample('bicubic')
-
-            # Prepare visualization parameters. If the vis requests a discrete (classified) palette,
-            # build a classified image and create a vis_map that maps classes 0..N to the palette.
-            vis_map = None
-            # If vis is a dict, copy it (we'll override for discrete)
+            cloud_pct = getattr(req, 'cloud_pct', 30)
+            exporting = getattr(req, 'export_format', None) in ('png', 'geotiff')
+            # Índice principal + adicionales (solo tiles): todos salen del mismo composite.
+            # La imagen se construye sin evaluar; el número de imágenes se trae junto a las estadísticas
+            indices = [req.index] if exporting else list(dict.fromkeys([req.index] + list(getattr(req, 'indices', None) or [])))
+            composite = get_composite(roi, req.start, req.end, cloud_pct, roi_geojson=roi_geojson)
+            image_count = composite.image_count
+            prepared = {}
+            for idx in indices:
+                idx_band, idx_vis = (band, vis) if idx == req.index else index_band_and_vis(idx, satellite='sentinel2')
+                prepared[idx] = _prepare_heatmap_layer(composite.index(idx), idx_band, idx_vis)
+            primary = prepared[req.index]
+            layer, vis_map, vis_image = primary['layer'], primary['vis_map'], primary['vis_image']
+
+            # Calcular estadísticas sobre el ROI: mean, min, max, stddev (y píxeles usados), de
+            # todos los índices en un único reduceRegion (una banda por índice, renombrada como
+            # el índice; clase para las vis discretas), sobre el índice sin reproyectar y a la
+            # escala que planifica el presupuesto de píxeles para esta ROI.
+            # Con `progressive` se reduce primero a escala gruesa y el refinado va a un job.
+            # Número de imágenes y estadísticas se evalúan juntos en un único getInfo
+            # (lanzado más abajo en paralelo con getMapId).
+            if getattr(req, 'progressive', False) and not exporting:
+                plan, refine_plan = progressive_plans(roi_geojson, getattr(req, 'stats_quality', None))
+            else:
+                plan, refine_plan = plan_stats(roi_geojson, getattr(req, 'stats_quality', None)), None
+            rr = reduce_stats(composite, indices, roi, plan, classify=True)
+            bundle = EEBundle()
+            bundle.add('image_count', image_count)
+            # Evitar reducir un composite vacío (fallaría la evaluación conjunta)
+            bundle.add('stats', ee.Algorithms.If(image_count.gt(0), rr, None))
+
+            def _create_map_id(p):
+                print(f"compute: calling getMapId with params={p['getmap_params']}")
+                m = get_map_id(p['vis_image'], p['getmap_params'])
+                # Extract tile URL robustly and log the getMapId response on unexpected shapes
+                try:
+                    return {'tile_url_template': m['tile_fetcher'].url_format, 'mapid': m.get('mapid')}
+                except Exception:
+                    try:
+                        # If m is a dict-like with different keys, print full repr for debugging
+                        print(f"compute: unexpected getMapId response: {repr(m)}")
+                    except Exception:
+                        print("compute: unexpected getMapId response and failed to repr(m)")
+                    raise
+
+            # Map IDs caducan: se cachean por ROI/índice/ventana con TTL y renovación en segundo plano
+            from utils_pkg import request_fingerprint, get_or_create_mapid
+            # Estadísticas y map IDs no dependen entre sí: lanzarlos en paralelo. Los map IDs
+            # solo hacen falta sin export y son opcionales aquí para poder responder 404 si el
+            # composite está vacío (en ese caso getMapId también fallaría).
+            calls = {'bundle': EECall(bundle.evaluate)}
+            if not exporting:
+                for idx, p in prepared.items():
+                    mapid_key = request_fingerprint(roi_geojson, kind='compute_heatmap', index=idx, start=req.start, end=req.end, cloud_pct=cloud_pct)
+                    name = 'map_id' if idx == req.index else f'map_id:{idx}'
+                    calls[name] = EECall(get_or_create_mapid, mapid_key, lambda p=p: _create_map_id(p), optional=True)
+            # Peticiones idénticas concurrentes comparten la misma evaluación en EE
+            flight_key = request_fingerprint(roi_geojson, kind='compute_heatmap_eval', index=req.index, indices=indices, start=req.start, end=req.end, cloud_pct=cloud_pct, exporting=exporting, scale=plan['scale_m'], progressive=refine_plan is not None)
+            fanout, errors = ee_flights.do(flight_key, lambda: run_parallel(calls))
+            results = fanout['bundle']
+            min_val = max_val = mean_val = stddev_val = None
+            layer_stats = {}
             try:
-                vis_map = dict(vis) if isinstance(vis, dict) else None
+                size = int(results.get('image_count') or 0)
             except Exception:
-                vis_map = None
-
-            # If the vis requests a discrete (classified) palette, build a classified image
-            try:
-                if isinstance(vis, dict) and vis.get('discrete'):
-                    breaks = vis.get('breaks') or []
-                    if breaks:
-                        # Build an expression that assigns class indexes based on breaks
-                        expr = None
-                        # Using ee.Image.gt/lt to create masks per interval
-                        base = layer
-                        classes = []
-                        # below first break
-                        prev = None
-                        for i, b in enumerate(breaks):
-                            if prev is None:
-                                mask = base.lte(float(b))
-                            else:
-                                mask = base.gt(float(prev)).And(base.lte(float(b)))
-                            classes.append(mask.multiply(i))
-                            prev = b
-                        # above last break
-                        classes.append(base.gt(float(prev)).multiply(len(breaks)))
-                        classified = ee.Image(classes[0])
-                        for c in classes[1:]:
-                            classified = classified.add(c)
-                        # Replace layer with a single-band classified image for visualization
-                        layer = classified.rename('class')
-                        # Build vis_map for classes 0..n
-                        num_classes = len(breaks) + 1
-                        palette = list(vis.get('palette') or [])
-                        # Ensure palette length equals num_classes; pad by repeating last color if needed
-                        if len(palette) < num_classes:
-                            if palette:
-                                while len(palette) < num_classes:
-                                    palette.append(palette[-1])
-                            else:
-                                palette = ['#000000'] * num_classes
-                        elif len(palette) > num_classes:
-                            palette = palette[:num_classes]
-                        # classes are 0..num_classes-1
-                        vis_map = {'min': 0, 'max': num_classes - 1, 'palette': palette}
-            except Exception as e:
-                print('compute: failed building discrete classified image', e)
-
-            # Calcular estadísticas sobre el ROI: mean, min, max, stddev
-            min_val = max_val = mean_val = stddev_val = None
+                size = 0
+            # El conteo queda cacheado para la misma ventana (otros índices, /heatmap)
+            composite.remember_count(size)
+            print(f"Sentinel-2 Heatmap: Found {size} images for composition (cloud_pct<{getattr(req, 'cloud_pct', 30)})")
+            if size == 0:
+                print(f"compute: no images for index={req.index}")
+                raise HTTPException(status_code=404, detail='No images')
             try:
-                # Determinar banda objetivo (si layer tiene varias, tomar la primera)
-                band_names = layer.bandNames().getInfo()
-                target_band = band_names[0] if band_names else None
-                if target_band:
-                    reducer = ee.Reducer.mean().combine(ee.Reducer.min(), None, True).combine(ee.Reducer.max(), None, True).combine(ee.Reducer.stdDev(), None, True)
-                    rr = layer.select([target_band]).reduceRegion(reducer, geometry=roi, scale=10, maxPixels=1e9, bestEffort=True)
-                    stats_info = rr.getInfo()
+                stats_info = results.get('stats') or {}
+                if stats_info:
                     # Guardar el objeto raw de estadísticas para depuración
                     try:
                         from utils_pkg import save_compute_stats
-                        stats_file = save_compute_stats(stats_info, base if 'base' in locals() else None)
+                        # Aún no hay base de export (se calcula más abajo): nombre por fecha
+                        stats_file = save_compute_stats(stats_info, None)
                     except Exception:
                         stats_file = None
-                    # keys could be like '<band>_mean' or 'mean' depending on EE; comprobar varias
-                    mean_val = stats_info.get(f"{target_band}_mean") if isinstance(stats_info, dict) else None
-                    if mean_val is None:
-                        mean_val = stats_info.get('mean') or stats_info.get(target_band)
-                    min_val = stats_info.get(f"{target_band}_min") if isinstance(stats_info, dict) else None
-                    if min_val is None:
-                        min_val = stats_info.get('min')
-                    max_val = stats_info.get(f"{target_band}_max") if isinstance(stats_info, dict) else None
-                    if max_val is None:
-                        max_val = stats_info.get('max')
-                    stddev_val = stats_info.get(f"{target_band}_stdDev") if isinstance(stats_info, dict) else None
-                    if stddev_val is None:
-                        stddev_val = stats_info.get('stdDev')
-                    # Coerce to floats when possible
-                    try:
-                        mean_val = float(mean_val) if mean_val is not None else None
-                    except Exception:
-                        mean_val = None
-                    try:
-                        min_val = float(min_val) if min_val is not None else None
-                    except Exception:
-                        min_val = None
-                    try:
-                        max_val = float(max_val) if max_val is not None else None
-                    except Exception:
-                        max_val = None
-                    try:
-                        stddev_val = float(stddev_val) if stddev_val is not None else None
-                    except Exception:
-                        stddev_val = None
+                    layer_stats = {idx: _stat_values(stats_info, idx) for idx in prepared}
+                    min_val, max_val, mean_val, stddev_val = layer_stats[req.index]
+                    plan['pixel_count'] = stats_info.get(f"{req.index}_count")
             except Exception:
                 min_val = max_val = mean_val = stddev_val = None
+                layer_stats = {}
+            # Estadísticas a escala nativa en segundo plano (ver /jobs/{job_id} y /jobs/{job_id}/events)
+            refine_job = None
+            if refine_plan is not None:
+                refine_job = submit_refine_job(roi_geojson, req.start, req.end, cloud_pct, indices, refine_plan, kml_id=getattr(req, 'kml_id', None), classify=True)
 
-            # Build a visualization image so tiles are already colored on server side.
-            try:
-                # If vis_map has a palette and the layer is single-band (not RGB), use visualize()
-                is_rgb_band = isinstance(band, (list, tuple))
-            except Exception:
-                is_rgb_band = False
-
-            vis_image = layer
-            visualized_on_server = False
-            # Prefer palette from vis_map (created for discrete), otherwise from vis
-            palette_to_use = None
-            palette_min = None
-            palette_max = None
-            try:
-                if isinstance(vis_map, dict) and vis_map.get('palette'):
-                    palette_to_use = list(vis_map.get('palette'))
-                    palette_min = vis_map.get('min')
-                    palette_max = vis_map.get('max')
-                elif isinstance(vis, dict) and vis.get('palette'):
-                    palette_to_use = list(vis.get('palette'))
-                    palette_min = vis.get('min')
-                    palette_max = vis.get('max')
-                # Fallback: if palette missing, but min/max present, we can still call getMapId with those
-            except Exception:
-                palette_to_use = None
-
-            # If single-band and we have a palette, try to bake colors server-side using visualize()
-            try:
-                if palette_to_use and (not is_rgb_band):
-                    # Ensure palette entries are strings and non-empty
-                    palette_to_use = [str(p) for p in palette_to_use if p]
-                    if not palette_to_use:
-                        palette_to_use = ['#000000', '#ffffff']
-                    # Ensure min/max defaults
-                    if palette_min is None:
-                        palette_min = 0
-                    if palette_max is None:
-                        palette_max = 1
-                    try:
-                        vis_image = layer.visualize(min=palette_min, max=palette_max, palette=palette_to_use)
-                        # Ensure the visualized image is an 8-bit RGB image
-                        try:
-                            vis_image = vis_image.toUint8()
-                        except Exception:
-                            pass
-                        visualized_on_server = True
-                        print('compute: successfully visualized image on server')
-                    except Exception as e:
-                        # visualize() may fail for classified images depending on types; fallback to raw layer
-                        print('compute: visualize() failed, will rely on getMapId with vis params', e)
-                        vis_image = layer
-                else:
-                    # No palette or RGB bands: keep the raw layer and rely on getMapId with vis_map/vis
-                    vis_image = layer
-            except Exception as e:
-                print('compute: error while preparing vis_image', e)
-                vis_image = layer
-            
-            # Aplicar resampling bicúbico a la imagen visualizada para suavizar
-            vis_image = vis_image.resample('bicubic')
-            
-            # Debug: log visualization decision & maps
-            try:
-                print(f"compute: vis_map={vis_map}, visualized_on_server={visualized_on_server}")
-                try:
-                    bn = vis_image.bandNames().getInfo()
-                    print(f"compute: vis_image bandNames={bn}")
-                except Exception:
-                    print("compute: could not get bandNames for vis_image")
-            except Exception:
-                pass
-            try:
-                # Try to log a small sample value to confirm image contains color bands
-                try:
-                    sample = vis_image.reduceRegion(ee.Reducer.first(), geometry=roi, scale=10, maxPixels=1e9).getInfo()
-                    print(f"compute: vis_image sample values={sample}")
-                except Exception:
-                    pass
-            except Exception:
-                pass
 
             # If export requested
             if getattr(req, 'export_format', None) in ('png', 'geotiff'):
@@ -445,15 +450,7 @@ def compute(req: ComputeRequest):
                                 fh.write(chunk)
                     saved['geotiff'] = str(geotiff_path)
                     # insert asset
-                    try:
-                        bbox = roi.bounds().getInfo() if hasattr(roi, 'bounds') else None
-                    except Exception:
-                        bbox = None
-                    try:
-                        footprint = roi.getInfo()
-                    except Exception:
-                        footprint = None
-                    insert_asset(asset_id=base + '.tif', product=req.index, sensor='sentinel-2', url_s3=str(geotiff_path), epsg=4326, resolution_m=10, acquired_ts=None, ingested_ts=time.strftime('%Y-%m-%dT%H:%M:%SZ'), footprint=footprint, bbox=bbox, min_val=min_val, max_val=max_val, mean_val=mean_val, stddev_val=stddev_val, cog_ok=True, tenant_id=None, plot_id=(req.kml_id if getattr(req, 'kml_id', None) else None))
+                    db_writer.add_asset(asset_id=base + '.tif', product=req.index, sensor='sentinel-2', url_s3=str(geotiff_path), epsg=4326, resolution_m=10, acquired_ts=None, ingested_ts=time.strftime('%Y-%m-%dT%H:%M:%SZ'), footprint=footprint, bbox=bbox, min_val=min_val, max_val=max_val, mean_val=mean_val, stddev_val=stddev_val, cog_ok=True, tenant_id=None, plot_id=(req.kml_id if getattr(req, 'kml_id', None) else None))
                 elif req.export_format == 'png':
                     png_path = Path(BASE_OUTPUT_DIR) / f"{base}.png"
                     try:
@@ -473,15 +470,7 @@ def compute(req: ComputeRequest):
                             if chunk:
                                 fh.write(chunk)
                     saved['png'] = str(png_path)
-                    try:
-                        bbox = roi.bounds().getInfo() if hasattr(roi, 'bounds') else None
-                    except Exception:
-                        bbox = None
-                    try:
-                        footprint = roi.getInfo()
-                    except Exception:
-                        footprint = None
-                    insert_asset(asset_id=base + '.png', product=req.index, sensor='sentinel-2', url_s3=str(png_path), epsg=4326, resolution_m=10, acquired_ts=None, ingested_ts=time.strftime('%Y-%m-%dT%H:%M:%SZ'), footprint=footprint, bbox=bbox, min_val=min_val, max_val=max_val, mean_val=mean_val, stddev_val=stddev_val, cog_ok=True, tenant_id=None, plot_id=(req.kml_id if getattr(req, 'kml_id', None) else None))
+                    db_writer.add_asset(asset_id=base + '.png', product=req.index, sensor='sentinel-2', url_s3=str(png_path), epsg=4326, resolution_m=10, acquired_ts=None, ingested_ts=time.strftime('%Y-%m-%dT%H:%M:%SZ'), footprint=footprint, bbox=bbox, min_val=min_val, max_val=max_val, mean_val=mean_val, stddev_val=stddev_val, cog_ok=True, tenant_id=None, plot_id=(req.kml_id if getattr(req, 'kml_id', None) else None))
 
                 # Antes de devolver, redondear las estadísticas a dos cifras significativas
                 try:
@@ -492,59 +481,41 @@ def compute(req: ComputeRequest):
                     std_r = round_sig(stddev_val, sig=2)
                 except Exception:
                     min_r, max_r, mean_r, std_r = min_val, max_val, mean_val, stddev_val
-                return {'mode': req.mode, 'index': req.index, 'roi': roi.getInfo(), 'roi_bounds': roi_bounds, 'saved_files': saved, 'min_val': min_r, 'max_val': max_r, 'mean_val': mean_r, 'stddev_val': std_r, 'stats_file': stats_file if 'stats_file' in locals() else None}
+                return {'mode': req.mode, 'index': req.index, 'roi': roi_geojson, 'roi_bounds': roi_bounds, 'saved_files': saved, 'min_val': min_r, 'max_val': max_r, 'mean_val': mean_r, 'stddev_val': std_r, 'stats_file': stats_file if 'stats_file' in locals() else None, 'stats_plan': plan}
 
             # Otherwise return tiles and insert metadata for tiles
-            # For visualized RGB images, pass an empty vis dict to getMapId because colors are baked in.
-            try:
-                # If we already visualized on server, call getMapId with empty params (image is RGB)
-                if visualized_on_server:
-                    print("compute: image was visualized on server; calling getMapId with empty params")
-                    m = vis_image.getMapId({})
-                else:
-                    # We did not visualize; if we detected a palette earlier, pass it to getMapId so EE colors tiles
-                    if 'palette_to_use' in locals() and palette_to_use and (not is_rgb_band):
-                        gm = {'min': (palette_min if palette_min is not None else 0), 'max': (palette_max if palette_max is not None else 1), 'palette': palette_to_use}
-                        print(f"compute: calling getMapId with palette params={gm}")
-                        m = vis_image.getMapId(gm)
-                    else:
-                        getmap_params = vis_map if vis_map else (vis if isinstance(vis, dict) else {})
-                        print(f"compute: calling getMapId with params={getmap_params}")
-                        m = vis_image.getMapId(getmap_params)
-            except Exception as e:
+            cached_map = fanout.get('map_id')
+            if cached_map is None:
+                e = errors.get('map_id')
                 print('compute: getMapId failed', e)
                 raise HTTPException(status_code=500, detail=f'Error generating tiles: {e}')
-            # Extract tile URL robustly and log the getMapId response on unexpected shapes
-            try:
-                tile_url = m['tile_fetcher'].url_format
-            except Exception as e:
-                try:
-                    # If m is a dict-like with different keys, print full repr for debugging
-                    print(f"compute: unexpected getMapId response: {repr(m)}")
-                except Exception:
-                    print("compute: unexpected getMapId response and failed to repr(m)")
-                raise HTTPException(status_code=500, detail=f"Error generating tiles: unexpected getMapId response ({e})")
-            try:
-                bbox = roi.bounds().getInfo() if hasattr(roi, 'bounds') else None
-            except Exception:
-                bbox = None
-            try:
-                footprint = roi.getInfo()
-            except Exception:
-                footprint = None
-            insert_asset(asset_id=f"{req.index}_{int(time.time())}_tiles", product=req.index, sensor='sentinel-2', url_s3=tile_url, epsg=4326, resolution_m=10, acquired_ts=None, ingested_ts=time.strftime('%Y-%m-%dT%H:%M:%SZ'), footprint=footprint, bbox=bbox, min_val=min_val, max_val=max_val, mean_val=mean_val, stddev_val=stddev_val, cog_ok=False, tenant_id=None, plot_id=(req.kml_id if getattr(req, 'kml_id', None) else None))
-            # Prepare vis metadata for response. If we baked colors on server, indicate that and include palette for legend.
-            if visualized_on_server:
-                vis_return = {'baked': True, 'palette': vis_map.get('palette') if isinstance(vis_map, dict) else None, 'min': vis_map.get('min') if isinstance(vis_map, dict) else None, 'max': vis_map.get('max') if isinstance(vis_map, dict) else None}
-            else:
-                vis_return = vis if isinstance(vis, dict) else vis_map
-
-            return {'mode': req.mode, 'index': req.index, 'roi': roi.getInfo(), 'roi_bounds': roi_bounds, 'tileUrlTemplate': tile_url, 'vis': vis_return, 'min_val': min_val, 'max_val': max_val, 'mean_val': mean_val, 'stddev_val': stddev_val, 'stats_file': stats_file if 'stats_file' in locals() else None}
+            tile_url = cached_map['tile_url_template']
+            db_writer.add_asset(asset_id=f"{req.index}_{int(time.time())}_tiles", product=req.index, sensor='sentinel-2', url_s3=tile_url, epsg=4326, resolution_m=10, acquired_ts=None, ingested_ts=time.strftime('%Y-%m-%dT%H:%M:%SZ'), footprint=footprint, bbox=bbox, min_val=min_val, max_val=max_val, mean_val=mean_val, stddev_val=stddev_val, cog_ok=False, tenant_id=None, plot_id=(req.kml_id if getattr(req, 'kml_id', None) else None))
+
+            # Con varios índices, una capa (tiles + vis + estadísticas) por índice
+            layers = None
+            if len(prepared) > 1:
+                layers = []
+                for idx, p in prepared.items():
+                    m = fanout.get('map_id' if idx == req.index else f'map_id:{idx}')
+                    l_min, l_max, l_mean, l_std = layer_stats.get(idx) or (None, None, None, None)
+                    layer_out = {'index': idx, 'tileUrlTemplate': m['tile_url_template'] if m else None, 'vis': p['vis_return'], 'min_val': l_min, 'max_val': l_max, 'mean_val': l_mean, 'stddev_val': l_std}
+                    if not m:
+                        layer_out['error'] = str(errors.get(f'map_id:{idx}'))
+                    elif idx != req.index:
+                        db_writer.add_asset(asset_id=f"{idx}_{int(time.time())}_tiles", product=idx, sensor='sentinel-2', url_s3=m['tile_url_template'], epsg=4326, resolution_m=10, acquired_ts=None, ingested_ts=time.strftime('%Y-%m-%dT%H:%M:%SZ'), footprint=footprint, bbox=bbox, min_val=l_min, max_val=l_max, mean_val=l_mean, stddev_val=l_std, cog_ok=False, tenant_id=None, plot_id=(req.kml_id if getattr(req, 'kml_id', None) else None))
+                    layers.append(layer_out)
+
+            return {'mode': req.mode, 'index': req.index, 'roi': roi_geojson, 'roi_bounds': roi_bounds, 'tileUrlTemplate': tile_url, 'vis': primary['vis_return'], 'min_val': min_val, 'max_val': max_val, 'mean_val': mean_val, 'stddev_val': stddev_val, 'stats_file': stats_file if 'stats_file' in locals() else None, 'layers': layers, 'stats_plan': plan, 'refine_job': refine_job}
 
         elif req.mode == 'series':
-            # Obtener serie temporal optimizada desde ee_client
+            # Serie temporal incremental: solo las pasadas no guardadas se calculan en EE
             try:
-                series = get_sentinel2_time_series(roi, req.start, req.end, req.index, getattr(req, 'cloud_pct', 70))
+                from utils_pkg import request_fingerprint
+                # Escala de la reducción por pasada según el área de la ROI y la calidad pedida
+                series_plan = plan_stats(roi_geojson, getattr(req, 'stats_quality', None), series=True)
+                flight_key = request_fingerprint(roi_geojson, kind='series', index=req.index, start=req.start, end=req.end, cloud_pct=getattr(req, 'cloud_pct', 70), scale=series_plan['scale_m'])
+                series = ee_flights.do(flight_key, lambda: incremental_time_series(roi, roi_geojson, req.start, req.end, req.index, getattr(req, 'cloud_pct', 70), plan=series_plan))
             except HTTPException:
                 # Re-lanzar HTTPException tal cual
                 raise
@@ -560,7 +531,7 @@ def compute(req: ComputeRequest):
                     value = None
                     # Priorizar mean si existe
                     if 'mean' in p and p['mean'] is not None:
-                        # ya redondeado en get_sentinel2_time_series, pero asegurar float
+                        # ya redondeado en incremental_time_series, pero asegurar float
                         try:
                             value = float(p['mean'])
                         except Exception:
@@ -591,7 +562,7 @@ def compute(req: ComputeRequest):
 
                 # Además opcionalmente generar un PNG de la mediana para referencia visual
                 try:
-                    img = compute_sentinel2_index(roi, req.start, req.end, req.index, getattr(req, 'cloud_pct', 70))
+                    img = compute_sentinel2_index(roi, req.start, req.end, req.index, getattr(req, 'cloud_pct', 70), roi_geojson=roi_geojson)
                     if img is not None:
                         layer = img.select(band)
                         png_path = Path(BASE_OUTPUT_DIR) / f"{base}_series.png"
@@ -618,35 +589,28 @@ def compute(req: ComputeRequest):
                 except Exception:
                     pass
 
-            # Guardar cada punto de la serie en la tabla measurement (fecha de pasada)
+            # Encolar los puntos de la serie para la tabla measurement (fecha de pasada); se escriben en lote.
+            # Sin kml_id la parcela es la huella de la ROI (la misma que geometry_id en /dates),
+            # para que ROIs distintas con el mismo índice y fecha no se pisen.
             try:
-                for pt in pts:
-                    try:
-                        if not pt.get('date'):
-                            continue
-                        insert_measurement(metric_id=None, tenant_id=None, plot_id=(req.kml_id if getattr(req, 'kml_id', None) else None), ts=pt.get('date'), metric_type=req.index, value=pt.get('value'), quality=None)
-                    except Exception:
-                        continue
+                from utils_pkg import geometry_fingerprint
+                plot_id = req.kml_id if getattr(req, 'kml_id', None) else (geometry_fingerprint(roi_geojson) if roi_geojson else None)
+                db_writer.add_measurements([
+                    {'plot_id': plot_id, 'ts': pt.get('date'), 'metric_type': req.index, 'value': pt.get('value')}
+                    for pt in pts if pt.get('date')
+                ])
             except Exception:
                 # No bloquear por fallos en inserción de medidas
                 pass
 
-            # Insertar metadata básica en la DB (serie generada)
+            # Encolar metadata básica para la DB (serie generada)
             try:
-                try:
-                    bbox = roi.bounds().getInfo() if hasattr(roi, 'bounds') else None
-                except Exception:
-                    bbox = None
-                try:
-                    footprint = roi.getInfo()
-                except Exception:
-                    footprint = None
-                insert_asset(asset_id=f"{req.index}_{int(time.time())}_series", product=req.index, sensor='sentinel-2', url_s3=(saved.get('csv') if saved else None), epsg=4326, resolution_m=10, acquired_ts=None, ingested_ts=time.strftime('%Y-%m-%dT%H:%M:%SZ'), footprint=footprint, bbox=bbox, cog_ok=False, tenant_id=None, plot_id=(req.kml_id if getattr(req, 'kml_id', None) else None))
+                db_writer.add_asset(asset_id=f"{req.index}_{int(time.time())}_series", product=req.index, sensor='sentinel-2', url_s3=(saved.get('csv') if saved else None), epsg=4326, resolution_m=10, acquired_ts=None, ingested_ts=time.strftime('%Y-%m-%dT%H:%M:%SZ'), footprint=footprint, bbox=bbox, cog_ok=False, tenant_id=None, plot_id=(req.kml_id if getattr(req, 'kml_id', None) else None))
             except Exception:
                 # No bloquear la respuesta si falla el insert en la DB
                 pass
 
-            return {'mode': req.mode, 'index': req.index, 'roi': roi.getInfo(), 'roi_bounds': roi_bounds, 'series': pts, 'saved_files': saved}
+            return {'mode': req.mode, 'index': req.index, 'roi': roi_geojson, 'roi_bounds': roi_bounds, 'series': pts, 'saved_files': saved, 'stats_plan': series_plan}
 
         else:
             raise HTTPException(status_code=400, detail='mode inválido')
@@ -672,166 +636,134 @@ def compute(req: ComputeRequest):
         raise HTTPException(status_code=500, detail=msg)
 
 
-@router.post('/stats/kml')
-def stats_from_kml(req: ComputeRequest):
-    """Genera estadísticas descriptivas (min/max/mean/stddev) de varios índices para cada feature
-    en un KML (o FeatureCollection) y devuelve un archivo .txt con los resultados.
-    """
+def _registered_feature_collection(kml_id):
     try:
-        # 1) localizar FeatureCollection: kml_id, geometry FeatureCollection o kml raw
-        fc = None
-        if getattr(req, 'kml_id', None):
-            geojson_path = Path(BASE_OUTPUT_DIR) / 'kml_uploads' / f"{req.kml_id}.geojson"
-            if geojson_path.exists():
-                with open(geojson_path, 'r', encoding='utf-8') as fh:
-                    try:
-                        fc = json.load(fh)
-                    except Exception:
-                        fc = None
-        if not fc and getattr(req, 'geometry', None) and isinstance(req.geometry, dict) and req.geometry.get('type') == 'FeatureCollection':
-            fc = req.geometry
-        if not fc and getattr(req, 'kml', None):
-            try:
-                from services.ee.ee_client import parse_kml_to_geojson
-                res = parse_kml_to_geojson(req.kml)
-                if res and res.get('success'):
-                    fc = {'type': 'FeatureCollection', 'features': res.get('features', [])}
-            except Exception:
-                fc = None
-
-        if not fc:
-            raise HTTPException(status_code=400, detail='No se encontró FeatureCollection (enviar kml_id, geometry FeatureCollection o kml raw)')
+        plot = get_plot(kml_id)
+    except Exception:
+        return None
+    return plot['feature_collection'] if plot else None
+
+
+def _load_kml_feature_collection(req: ComputeRequest):
+    # localizar FeatureCollection: kml_id, geometry FeatureCollection o kml raw
+    fc = None
+    if getattr(req, 'kml_id', None):
+        fc = _registered_feature_collection(req.kml_id)
+    if not fc and getattr(req, 'geometry', None) and isinstance(req.geometry, dict) and req.geometry.get('type') == 'FeatureCollection':
+        fc = req.geometry
+    if not fc and getattr(req, 'kml', None):
+        try:
+            from services.ee.ee_client import parse_kml_to_geojson
+            res = parse_kml_to_geojson(req.kml)
+            if res and res.get('success'):
+                fc = {'type': 'FeatureCollection', 'features': res.get('features', [])}
+        except Exception:
+            fc = None
 
-        from utils_pkg import split_feature_collection, ensure_outputs_dir, round_sig, index_band_and_vis
+    if not fc:
+        raise HTTPException(status_code=400, detail='No se encontró FeatureCollection (enviar kml_id, geometry FeatureCollection o kml raw)')
+    return fc
 
-        feats = split_feature_collection(fc)
-        if not feats:
-            raise HTTPException(status_code=400, detail='FeatureCollection sin features válidas')
 
-        indices = ['ndvi','ndwi','ndmi','ndre','evi','savi','lai','gci','vegetation_health','water_detection','urban_index','soil_moisture','change_detection','soil_ph']
+def _write_kml_stats_report(req: ComputeRequest, fc: dict, progress=None):
+    """Escribe el .txt de estadísticas por feature e índice; retorna (ruta, nombre)."""
+    from utils_pkg import split_feature_collection, ensure_outputs_dir, round_sig
 
-        # construir contenido del txt
-        lines = []
-        now_ts = time.strftime('%Y%m%dT%H%M%SZ')
-        header = f"Estadísticas descriptivas por feature - {now_ts}\n"
-        header += f"Periodo: {req.start} -> {req.end}\n\n"
-        lines.append(header)
+    feats = split_feature_collection(fc)
+    if not feats:
+        raise HTTPException(status_code=400, detail='FeatureCollection sin features válidas')
 
-        for f in feats:
-            fid = f.get('id')
-            fname = f.get('name') or ''
-            area = f.get('area_m2')
-            lines.append(f"Feature: {fid} - {fname} - area_m2: {area}\n")
-            roi = None
-            try:
-                roi = ee.Geometry(f.get('geometry'))
-            except Exception:
-                lines.append('  ERROR: geometría inválida\n')
-                continue
+    indices = ['ndvi','ndwi','ndmi','ndre','evi','savi','lai','gci','vegetation_health','water_detection','urban_index','soil_moisture','change_detection','soil_ph']
 
-            for idx in indices:
-                try:
-                    img = compute_sentinel2_index(roi, req.start, req.end, idx, getattr(req, 'cloud_pct', 30))
-                    if img is None:
-                        lines.append(f"  {idx}: NO_DATA\n")
-                        continue
-                    # determinar banda objetivo
-                    try:
-                        band_name, _ = index_band_and_vis(idx, satellite='sentinel2')
-                        if isinstance(band_name, (list, tuple)):
-                            band_name = band_name[0]
-                    except Exception:
-                        band_name = None
+    # construir contenido del txt
+    lines = []
+    now_ts = time.strftime('%Y%m%dT%H%M%SZ')
+    header = f"Estadísticas descriptivas por feature - {now_ts}\n"
+    header += f"Periodo: {req.start} -> {req.end}\n\n"
+    lines.append(header)
 
-                    if band_name:
-                        try:
-                            reducer = ee.Reducer.mean().combine(ee.Reducer.min(), None, True).combine(ee.Reducer.max(), None, True).combine(ee.Reducer.stdDev(), None, True)
-                            rr = img.select([band_name]).reduceRegion(reducer, geometry=roi, scale=10, maxPixels=1e9, bestEffort=True)
-                            stats_info = rr.getInfo() if rr else None
-                        except Exception:
-                            stats_info = None
-                    else:
-                        stats_info = None
+    # Un solo composite multibanda (una banda por índice) reducido sobre todas las
+    # features con reduceRegions, en vez de un composite + reduceRegion por par
+    matrix = zonal_stats(feats, req.start, req.end, indices, getattr(req, 'cloud_pct', 30), progress=progress)
 
-                    if not stats_info:
-                        lines.append(f"  {idx}: STATS_UNAVAILABLE\n")
-                        continue
+    for pos, f in enumerate(feats):
+        fid = f.get('id')
+        fname = f.get('name') or ''
+        area = f.get('area_m2')
+        lines.append(f"Feature: {fid} - {fname} - area_m2: {area}\n")
 
-                    # extraer valores con robustez
-                    mean_val = None
-                    min_val = None
-                    max_val = None
-                    stddev_val = None
-                    try:
-                        mean_val = stats_info.get(f"{band_name}_mean") if isinstance(stats_info, dict) else None
-                    except Exception:
-                        mean_val = None
-                    if mean_val is None:
-                        mean_val = stats_info.get('mean') or stats_info.get(band_name)
-                    try:
-                        min_val = stats_info.get(f"{band_name}_min") if isinstance(stats_info, dict) else None
-                    except Exception:
-                        min_val = None
-                    if min_val is None:
-                        min_val = stats_info.get('min')
-                    try:
-                        max_val = stats_info.get(f"{band_name}_max") if isinstance(stats_info, dict) else None
-                    except Exception:
-                        max_val = None
-                    if max_val is None:
-                        max_val = stats_info.get('max')
-                    try:
-                        stddev_val = stats_info.get(f"{band_name}_stdDev") if isinstance(stats_info, dict) else None
-                    except Exception:
-                        stddev_val = None
-                    if stddev_val is None:
-                        stddev_val = stats_info.get('stdDev')
+        per_index = matrix[pos] if matrix is not None else None
+        for idx in indices:
+            if matrix is None:
+                lines.append(f"  {idx}: NO_DATA\n")
+                continue
+            stats_info = per_index.get(idx) if per_index else None
+            if not stats_info:
+                lines.append(f"  {idx}: STATS_UNAVAILABLE\n")
+                continue
+            try:
+                mean_r, min_r, max_r, std_r = (
+                    round_sig(stats_info[k], sig=3) if stats_info.get(k) is not None else None
+                    for k in ('mean', 'min', 'max', 'stdDev')
+                )
+                lines.append(f"  {idx}: mean={mean_r}, min={min_r}, max={max_r}, stddev={std_r}\n")
+            except Exception as e:
+                lines.append(f"  {idx}: ERROR: {str(e)}\n")
 
-                    # coerción a float y redondeo
-                    try:
-                        mean_f = float(mean_val) if mean_val is not None else None
-                    except Exception:
-                        mean_f = None
-                    try:
-                        min_f = float(min_val) if min_val is not None else None
-                    except Exception:
-                        min_f = None
-                    try:
-                        max_f = float(max_val) if max_val is not None else None
-                    except Exception:
-                        max_f = None
-                    try:
-                        std_f = float(stddev_val) if stddev_val is not None else None
-                    except Exception:
-                        std_f = None
+        lines.append('\n')
 
-                    try:
-                        mean_r = round_sig(mean_f, sig=3) if mean_f is not None else None
-                        min_r = round_sig(min_f, sig=3) if min_f is not None else None
-                        max_r = round_sig(max_f, sig=3) if max_f is not None else None
-                        std_r = round_sig(std_f, sig=3) if std_f is not None else None
-                    except Exception:
-                        mean_r, min_r, max_r, std_r = mean_f, min_f, max_f, std_f
+    # Guardar archivo en outputs
+    ensure_outputs_dir()
+    fname = f"compute_stats_all_indices_{(req.kml_id if getattr(req, 'kml_id', None) else now_ts)}.txt"
+    out_path = Path(BASE_OUTPUT_DIR) / fname
+    try:
+        with open(out_path, 'w', encoding='utf-8') as fh:
+            fh.writelines(lines)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f'Error guardando archivo: {e}')
+    return out_path, fname
 
-                    lines.append(f"  {idx}: mean={mean_r}, min={min_r}, max={max_r}, stddev={std_r}\n")
-                except Exception as e:
-                    lines.append(f"  {idx}: ERROR: {str(e)}\n")
 
-            lines.append('\n')
+@router.post('/stats/kml')
+def stats_from_kml(req: ComputeRequest):
+    """Genera estadísticas descriptivas (min/max/mean/stddev) de varios índices para cada feature
+    en un KML (o FeatureCollection) y devuelve un archivo .txt con los resultados.
 
-        # Guardar archivo en outputs
-        ensure_outputs_dir()
-        fname = f"compute_stats_all_indices_{(req.kml_id if getattr(req, 'kml_id', None) else now_ts)}.txt"
-        out_path = Path(BASE_OUTPUT_DIR) / fname
-        try:
-            with open(out_path, 'w', encoding='utf-8') as fh:
-                fh.writelines(lines)
-        except Exception as e:
-            raise HTTPException(status_code=500, detail=f'Error guardando archivo: {e}')
+    Con async_job=true se encola como job y responde 202 con el job_id; el .txt se
+    descarga luego en /jobs/{job_id}/result.
+    """
+    try:
+        fc = _load_kml_feature_collection(req)
+        if getattr(req, 'async_job', False):
+            job_id = submit_job('stats_kml', req.model_dump())
+            return JSONResponse(status_code=202, content={'job_id': job_id, 'status_url': f'/jobs/{job_id}', 'result_url': f'/jobs/{job_id}/result'})
 
+        out_path, fname = _write_kml_stats_report(req, fc)
         return FileResponse(str(out_path), media_type='text/plain', filename=fname)
     except HTTPException:
         raise
     except Exception as ex:
         print('stats_from_kml error', ex)
         raise HTTPException(status_code=500, detail=str(ex))
+
+
+def _stats_kml_job(payload, progress):
+    req = ComputeRequest(**payload)
+    fc = _load_kml_feature_collection(req)
+    out_path, _ = _write_kml_stats_report(req, fc, progress=progress)
+    return {'files': {'txt': str(out_path)}}
+
+
+def _compute_export_job(payload, progress):
+    req = ComputeRequest(**dict(payload, async_job=False))
+    progress(0, 1, f'exportando {req.export_format}')
+    result = compute(req)
+    progress(1, 1)
+    return {
+        'files': result.get('saved_files') or {},
+        'stats': {k: result.get(k) for k in ('min_val', 'max_val', 'mean_val', 'stddev_val')},
+    }
+
+
+register_job_handler('stats_kml', _stats_kml_job)
+register_job_handler('compute_export', _compute_export_job)
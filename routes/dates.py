@@ -1,13 +1,15 @@
 from fastapi import APIRouter, HTTPException, Query
+from fastapi.responses import StreamingResponse
 from schemas.dates_models import DatesRequest, DatesResponse, ImageDate
-from services.ee.ee_client import get_sentinel2_dates as ee_get_sentinel2_dates
-from services.db import insert_sentinel2_date, get_sentinel2_dates as db_get_sentinel2_dates
+from services.ee.ee_client import iter_sentinel2_dates, get_sentinel2_dates_ranges
+from services.db import insert_sentinel2_dates, get_sentinel2_dates as db_get_sentinel2_dates, iter_sentinel2_dates as iter_db_sentinel2_dates
+from services.db import next_page_cursor, check_page_cursor, sentinel2_dates_in_range, DATES_PAGE_KEYS
+from services.coverage import coverage_segments, record_coverage, SENTINEL2_DATES
 from typing import Optional
 import ee
-import hashlib
 import json
-from pathlib import Path
-from config import BASE_OUTPUT_DIR
+from services.plots import get_plot
+from utils_pkg import geometry_fingerprint, normalize_date, normalize_cloud_pct, prepared_ee_geometry
 
 router = APIRouter()
 
@@ -23,35 +25,25 @@ def get_dates(req: DatesRequest):
     - O bien: lat, lon (y opcionalmente width_m, height_m para crear bbox)
     
     Retorna lista de fechas con metadata (cloud_cover, tile_id) y las guarda en BD.
+    Con stream=true la respuesta es NDJSON y se emite tramo a tramo.
     """
     try:
         roi = None
         roi_geojson = None
         
-        # Opción 1: kml_id - cargar desde archivo
+        # Opción 1: kml_id - registro de parcelas
         if req.kml_id:
-            geojson_path = Path(BASE_OUTPUT_DIR) / 'kml_uploads' / f"{req.kml_id}.geojson"
-            if not geojson_path.exists():
+            plot = get_plot(req.kml_id)
+            if not plot:
                 raise ValueError(f"KML con id '{req.kml_id}' no encontrado")
             
-            with open(geojson_path, 'r', encoding='utf-8') as f:
-                fc = json.load(f)
-            
-            # Si es FeatureCollection, tomar el primer feature
-            if fc.get('type') == 'FeatureCollection' and fc.get('features'):
-                geom = fc['features'][0]['geometry']
-            else:
-                geom = fc
-            
-            # Convertir a ee.Geometry
+            # Primer feature del registro, con sus bounds ya calculados
+            geom = plot['geometry']
             roi_geojson = geom
             if geom['type'] == 'Polygon':
-                coords = geom['coordinates'][0]
-                lons = [c[0] for c in coords]
-                lats = [c[1] for c in coords]
-                roi = ee.Geometry.Rectangle([min(lons), min(lats), max(lons), max(lats)])
+                roi = ee.Geometry.Rectangle(list(plot['bounds']))
             else:
-                roi = ee.Geometry(geom)
+                roi = ee.Geometry(plot['simplified'])
         
         # Opción 2: geometry GeoJSON
         elif req.geometry:
@@ -62,7 +54,7 @@ def get_dates(req: DatesRequest):
                 lats = [c[1] for c in coords]
                 roi = ee.Geometry.Rectangle([min(lons), min(lats), max(lons), max(lats)])
             else:
-                roi = ee.Geometry(req.geometry)
+                roi = prepared_ee_geometry(req.geometry)
         
         # Opción 3: lat/lon con bbox
         elif req.lon is not None and req.lat is not None:
@@ -89,48 +81,28 @@ def get_dates(req: DatesRequest):
         else:
             raise ValueError("Debe proporcionar kml_id, geometry o lon/lat")
         
-        # Llamar a EE para obtener fechas
-        dates_list = ee_get_sentinel2_dates(
-            roi=roi,
-            start=req.start,
-            end=req.end,
-            cloud_pct=req.cloud_pct
-        )
-        
-        # Generar un geometry_id único basado en la geometría (hash de las coordenadas)
-        geometry_hash = hashlib.sha256(
-            json.dumps(roi_geojson, sort_keys=True).encode()
-        ).hexdigest()[:16]
-        
-        # Guardar cada fecha en la BD
-        user_id = None  # Sin autenticación
-        
-        for date_data in dates_list:
-            try:
-                insert_sentinel2_date(
-                    geometry_id=geometry_hash,
-                    user_id=user_id,
-                    date=date_data['date'],
-                    system_time_start=date_data['system_time_start'],
-                    cloud_cover=date_data.get('cloud_cover'),
-                    tile_id=date_data.get('tile_id'),
-                    roi_geojson=roi_geojson
-                )
-            except Exception as e:
-                # Log pero no fallar la petición completa si una inserción falla
-                print(f"Warning: no se pudo insertar fecha {date_data['date']}: {e}")
-                continue
-        
-        # Construir respuesta
-        image_dates = [
-            ImageDate(
-                date=d['date'],
-                system_time_start=d['system_time_start'],
-                cloud_cover=d.get('cloud_cover'),
-                tile_id=d.get('tile_id')
+        # geometry_id estable: la misma parcela con otro orden/sentido/precisión de vértices da el mismo id
+        geometry_hash = geometry_fingerprint(roi_geojson)
+
+        # Tramos ya consultados (con igual o más permisivo cloud_pct) se sirven desde la BD
+        start, end = normalize_date(req.start), normalize_date(req.end)
+        cloud_pct = normalize_cloud_pct(req.cloud_pct if req.cloud_pct is not None else 100)
+        segments = coverage_segments(SENTINEL2_DATES, geometry_hash, start, end, min_param=cloud_pct)
+
+        if req.stream:
+            return StreamingResponse(
+                _stream_dates(roi, roi_geojson, geometry_hash, segments, cloud_pct),
+                media_type='application/x-ndjson'
             )
-            for d in dates_list
-        ]
+
+        try:
+            dates_list = [d for chunk in _segment_dates(roi, roi_geojson, geometry_hash, segments, cloud_pct) for d in chunk]
+        except Exception as e:
+            print(f"ERROR obteniendo fechas de Sentinel-2: {e}")
+            raise RuntimeError(str(e))
+
+        # Construir respuesta
+        image_dates = [ImageDate(**d) for d in dates_list]
         
         return DatesResponse(
             success=True,
@@ -153,12 +125,82 @@ def get_dates(req: DatesRequest):
         raise HTTPException(status_code=500, detail="Error al obtener fechas de Sentinel-2")
 
 
+def _store_dates(dates_list, geometry_hash, roi_geojson):
+    """Guarda las fechas en la BD (una transacción) sin fallar la petición si falla.
+
+    Retorna True si quedaron guardadas.
+    """
+    user_id = None  # Sin autenticación
+
+    try:
+        insert_sentinel2_dates(geometry_hash, dates_list, user_id=user_id, roi_geojson=roi_geojson)
+        return True
+    except Exception as e:
+        # Log pero no fallar la petición completa si la inserción falla
+        print(f"Warning: no se pudieron insertar {len(dates_list)} fechas: {e}")
+        return False
+
+
+def _image_date(d):
+    return {
+        'date': d['date'],
+        'system_time_start': d['system_time_start'],
+        'cloud_cover': d.get('cloud_cover'),
+        'tile_id': d.get('tile_id'),
+    }
+
+
+def _segment_dates(roi, roi_geojson, geometry_hash, segments, cloud_pct, stream=False):
+    """Genera las fechas en orden, una lista por tramo: desde la BD para los tramos
+    cubiertos y desde EE (guardándolas y registrando la cobertura) para los huecos.
+
+    Sin stream todos los huecos se piden a EE juntos en un único getInfo; con
+    stream cada hueco se pide por tramos de DATES_CHUNK_DAYS para empezar a
+    responder antes de tener el rango completo.
+    """
+    gaps = [(start, end) for start, end, covered in segments if not covered]
+    fetched = {}
+    if gaps and not stream:
+        dates = get_sentinel2_dates_ranges(roi, gaps, cloud_pct)
+        # Los límites de los tramos son días UTC: comparar la fecha basta para repartirlas
+        fetched = {gap: [d for d in dates if gap[0] <= d['date'] < gap[1]] for gap in gaps}
+    for start, end, covered in segments:
+        if covered:
+            yield [_image_date(d) for d in sentinel2_dates_in_range(geometry_hash, start, end, max_cloud=cloud_pct)]
+            continue
+        chunks = iter_sentinel2_dates(roi, start, end, cloud_pct) if stream else [fetched[(start, end)]]
+        stored = True
+        for chunk in chunks:
+            stored = _store_dates(chunk, geometry_hash, roi_geojson) and stored
+            yield [_image_date(d) for d in chunk]
+        if stored:
+            record_coverage(SENTINEL2_DATES, geometry_hash, start, end, param=cloud_pct)
+    print(f"/dates {geometry_hash}: {len(segments) - len(gaps)} tramo(s) desde BD, {len(gaps)} consultado(s) en EE")
+
+
+def _stream_dates(roi, roi_geojson, geometry_hash, segments, cloud_pct):
+    """Genera NDJSON: una línea por fecha y una línea final de resumen."""
+    total = 0
+    try:
+        for chunk in _segment_dates(roi, roi_geojson, geometry_hash, segments, cloud_pct, stream=True):
+            for d in chunk:
+                total += 1
+                yield json.dumps(ImageDate(**d).model_dump()) + '\n'
+    except Exception as e:
+        print(f"ERROR streaming fechas de Sentinel-2: {e}")
+        yield json.dumps({"success": False, "message": "Error al consultar Earth Engine", "total_images": total}) + '\n'
+        return
+    yield json.dumps({"success": True, "geometry_id": geometry_hash, "total_images": total}) + '\n'
+
+
 @router.get('/dates')
 def list_dates(
     geometry_id: Optional[str] = Query(None, description="ID de geometría para filtrar"),
     start_date: Optional[str] = Query(None, description="Fecha inicial (YYYY-MM-DD)"),
     end_date: Optional[str] = Query(None, description="Fecha final (YYYY-MM-DD)"),
-    limit: Optional[int] = Query(500, description="Máximo número de resultados")
+    limit: Optional[int] = Query(None, description="Máximo número de resultados (default 500; sin límite en stream)"),
+    cursor: Optional[str] = Query(None, description="Cursor de la página siguiente (next_cursor)"),
+    stream: Optional[bool] = Query(False, description="Responder NDJSON, una fecha por línea")
 ):
     """
     Obtiene las fechas de Sentinel-2 almacenadas en la base de datos.
@@ -168,21 +210,29 @@ def list_dates(
     - start_date: fecha inicial (YYYY-MM-DD)
     - end_date: fecha final (YYYY-MM-DD)
     - limit: máximo número de resultados (default 500)
+    - cursor: continuar desde la página anterior (campo next_cursor)
+    - stream: NDJSON leído por lotes desde la BD, para exportar sin cargar todo en memoria
     
     Retorna lista de fechas con toda la metadata guardada.
     """
     try:
-        dates = db_get_sentinel2_dates(
-            geometry_id=geometry_id,
-            start_date=start_date,
-            end_date=end_date,
-            limit=limit
-        )
+        check_page_cursor(cursor, DATES_PAGE_KEYS)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    try:
+        filters = dict(geometry_id=geometry_id, start_date=start_date, end_date=end_date)
+        if stream:
+            rows = iter_db_sentinel2_dates(limit=limit, cursor=cursor, **filters)
+            return StreamingResponse((json.dumps(r) + '\n' for r in rows), media_type='application/x-ndjson')
+
+        limit = limit or 500
+        dates = db_get_sentinel2_dates(limit=limit, cursor=cursor, **filters)
         
         return {
             "success": True,
             "total": len(dates),
-            "dates": dates
+            "dates": dates,
+            "next_cursor": next_page_cursor(dates, limit, DATES_PAGE_KEYS)
         }
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error al consultar base de datos: {str(e)}")
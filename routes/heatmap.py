@@ -1,11 +1,15 @@
 from fastapi import APIRouter, HTTPException
 from schemas.heatmap_models import HeatmapRequest, HeatmapResponse
-from services.ee.ee_client import compute_sentinel2_index, get_sentinel2_time_series
-from utils_pkg import index_band_and_vis
+from services.ee.ee_client import get_sentinel2_time_series
+from services.ee.ee_composite import get_composite
+from services.ee.ee_batch import get_info, get_map_id
+from services.ee.ee_executor import EECall, run_parallel
+from utils_pkg import index_band_and_vis, geojson_bounds, request_fingerprint, get_or_create_mapid, prepared_ee_geometry
+from utils_pkg.singleflight import ee_flights
+from utils_pkg.stats_plan import plan_stats
+from services.progressive import progressive_plans, reduce_stats, stat_dict, submit_refine_job
+from services.plots import get_plot
 import ee
-import json
-from pathlib import Path
-from config import BASE_OUTPUT_DIR
 from datetime import datetime, timedelta
 
 router = APIRouter()
@@ -31,31 +35,22 @@ def get_heatmap(req: HeatmapRequest):
         roi = None
         roi_geojson = None
         
-        # Opción 1: kml_id - cargar desde archivo
+        # Opción 1: kml_id - registro de parcelas
         if req.kml_id:
-            geojson_path = Path(BASE_OUTPUT_DIR) / 'kml_uploads' / f"{req.kml_id}.geojson"
-            if not geojson_path.exists():
+            plot = get_plot(req.kml_id)
+            if not plot:
                 raise ValueError(f"KML con id '{req.kml_id}' no encontrado")
             
-            with open(geojson_path, 'r', encoding='utf-8') as f:
-                fc = json.load(f)
-            
-            # Si es FeatureCollection, tomar el primer feature
-            if fc.get('type') == 'FeatureCollection' and fc.get('features'):
-                geom = fc['features'][0]['geometry']
-            else:
-                geom = fc
-            
-            # Convertir a ee.Geometry
-            roi_geojson = geom
+            # Primer feature del registro; a EE se envía su versión simplificada
+            roi_geojson = plot['geometry']
             # Usar el polígono exacto, no un rectángulo
-            roi = ee.Geometry(geom)
+            roi = ee.Geometry(plot['simplified'])
         
         # Opción 2: geometry GeoJSON
         elif req.geometry:
             roi_geojson = req.geometry
-            # Usar el polígono exacto, no un rectángulo
-            roi = ee.Geometry(req.geometry)
+            # Usar el polígono (simplificado a la escala del píxel), no un rectángulo
+            roi = prepared_ee_geometry(req.geometry)
         
         # Opción 3: lat/lon con bbox
         elif req.lon is not None and req.lat is not None:
@@ -100,130 +95,175 @@ def get_heatmap(req: HeatmapRequest):
         
         print(f"Buscando imágenes entre {start_date} y {end_date} con cloud_pct < {req.cloud_pct}")
         
-        # Obtener banda y visualización para el índice
-        band, vis = index_band_and_vis(req.index, satellite='sentinel2')
-        
-        # Computar el índice usando Earth Engine
-        img = compute_sentinel2_index(
-            roi=roi,
-            start=start_date,
-            end=end_date,
-            index=req.index,
-            cloud_pct=req.cloud_pct or 30
-        )
-        
-        if img is None:
-            # Intentar con un buffer más amplio (7 días)
-            print(f"No se encontraron imágenes, intentando con ±7 días")
-            start_date = (target_date - timedelta(days=7)).strftime("%Y-%m-%d")
-            end_date = (target_date + timedelta(days=7)).strftime("%Y-%m-%d")
-            
-            img = compute_sentinel2_index(
-                roi=roi,
-                start=start_date,
-                end=end_date,
-                index=req.index,
-                cloud_pct=req.cloud_pct or 30
-            )
-            
-            if img is None:
-                raise HTTPException(
-                    status_code=404,
-                    detail=f"No se encontraron imágenes cercanas a {req.date} con <{req.cloud_pct}% nubes (intentado ±7 días)"
-                )
-        
-        # Seleccionar banda(s) para visualización
-        if isinstance(band, list):
-            # RGB composite
-            layer = img.select(band)
+        cloud_pct = req.cloud_pct or 30
+        # Índice principal + adicionales: todos salen del mismo composite
+        indices = list(dict.fromkeys([req.index] + list(req.indices or [])))
+        # Escala de estadísticas y serie según el área de la ROI y la calidad pedida. Con
+        # `progressive` las estadísticas salen primero de un plan grueso y se refinan en un job
+        if req.progressive:
+            plan, refine_plan = progressive_plans(roi_geojson, req.stats_quality)
         else:
-            # Single band
-            layer = img.select([band])
-        
-        # Calcular estadísticas
-        stats = None
-        try:
-            # Reducir a una sola banda si es single band
-            stats_layer = layer.select([band]) if isinstance(band, str) else layer.select([band[0]])
-            
-            stats_result = stats_layer.reduceRegion(
-                reducer=ee.Reducer.minMax().combine(
-                    ee.Reducer.mean(), '', True
-                ).combine(
-                    ee.Reducer.stdDev(), '', True
-                ),
-                geometry=roi,
-                scale=10,
-                maxPixels=1e9
-            ).getInfo()
-            
-            if stats_result:
-                # Para single band, las keys son band_min, band_max, band_mean, band_stdDev
-                first_band = band if isinstance(band, str) else band[0]
-                stats = {
-                    'min': stats_result.get(f'{first_band}_min'),
-                    'max': stats_result.get(f'{first_band}_max'),
-                    'mean': stats_result.get(f'{first_band}_mean'),
-                    'stdDev': stats_result.get(f'{first_band}_stdDev')
-                }
-                print(f"Estadísticas calculadas para {req.index}: {stats}")
-        except Exception as e:
-            print(f"Warning: no se pudieron calcular estadísticas: {e}")
-        
-        # Visualizar con paleta si está disponible
-        if vis and vis.get('palette') and not isinstance(band, list):
-            # Single band con paleta
-            vis_img = layer.visualize(
-                min=vis.get('min', 0),
-                max=vis.get('max', 1),
-                palette=vis['palette']
-            )
-        else:
-            # RGB o sin paleta
-            vis_img = layer.visualize(**vis) if vis else layer
-        
-        # Recortar al polígono exacto para que solo se vea la parcela
-        vis_img = vis_img.clip(roi)
-        
-        # Obtener map ID y tile URL
-        map_id_dict = vis_img.getMapId()
-        tile_url = map_id_dict['tile_fetcher'].url_format
-        
-        # Calcular bounds para centrar mapa
-        bounds_coords = roi.bounds().getInfo()['coordinates'][0]
-        lons = [c[0] for c in bounds_coords]
-        lats = [c[1] for c in bounds_coords]
-        bounds = {
-            'west': min(lons),
-            'south': min(lats),
-            'east': max(lons),
-            'north': max(lats),
-            'center': {
-                'lon': (min(lons) + max(lons)) / 2,
-                'lat': (min(lats) + max(lats)) / 2
-            }
-        }
-        
-        # Generar serie temporal de 10 días si se solicitó un solo día
-        time_series = None
-        if generate_time_series:
+            plan, refine_plan = plan_stats(roi_geojson, req.stats_quality), None
+        series_plan = plan_stats(roi_geojson, req.stats_quality, series=True)
+
+        def _window_composite():
+            composite = get_composite(roi, start_date, end_date, cloud_pct, roi_geojson=roi_geojson)
             try:
+                size = composite.count()
+            except Exception:
+                size = 0
+            print(f"Sentinel-2 Heatmap: Found {size} images for composition (cloud_pct<{cloud_pct})")
+            return composite if size else None
+
+        def _compute_heatmap():
+            nonlocal start_date, end_date
+            composite = _window_composite()
+
+            if composite is None:
+                # Intentar con un buffer más amplio (7 días)
+                print(f"No se encontraron imágenes, intentando con ±7 días")
+                start_date = (target_date - timedelta(days=7)).strftime("%Y-%m-%d")
+                end_date = (target_date + timedelta(days=7)).strftime("%Y-%m-%d")
+
+                composite = _window_composite()
+
+                if composite is None:
+                    raise HTTPException(
+                        status_code=404,
+                        detail=f"No se encontraron imágenes cercanas a {req.date} con <{req.cloud_pct}% nubes (intentado ±7 días)"
+                    )
+
+            calls = {}
+            for idx in indices:
+                # Obtener banda y visualización para el índice
+                band, vis = index_band_and_vis(idx, satellite='sentinel2')
+                img = composite.index(idx)
+
+                # Seleccionar banda(s) para visualización
+                if isinstance(band, list):
+                    # RGB composite
+                    layer = img.select(band)
+                else:
+                    # Single band
+                    layer = img.select([band])
+
+                # Visualizar con paleta si está disponible
+                if vis and vis.get('palette') and not isinstance(band, list):
+                    # Single band con paleta
+                    vis_img = layer.visualize(
+                        min=vis.get('min', 0),
+                        max=vis.get('max', 1),
+                        palette=vis['palette']
+                    )
+                else:
+                    # RGB o sin paleta
+                    vis_img = layer.visualize(**vis) if vis else layer
+
+                # Recortar al polígono exacto para que solo se vea la parcela
+                vis_img = vis_img.clip(roi)
+
+                def _create_map_id(vis_img=vis_img):
+                    m = get_map_id(vis_img)
+                    return {'tile_url_template': m['tile_fetcher'].url_format, 'mapid': m['mapid']}
+
+                # Map IDs caducan: cacheados con TTL y renovación en segundo plano
+                mapid_key = request_fingerprint(roi_geojson, kind='heatmap', index=idx, start=start_date, end=end_date, cloud_pct=cloud_pct)
+                # El del índice principal es obligatorio; los de índices adicionales, opcionales
+                name = 'map_id' if idx == req.index else f'map_id:{idx}'
+                calls[name] = EECall(get_or_create_mapid, mapid_key, _create_map_id, optional=(idx != req.index))
+
+            # Estadísticas de la primera banda de cada índice, todas en una sola reducción
+            stats_reduction = reduce_stats(composite, indices, roi, plan)
+
+            # Estadísticas, map IDs y serie de 10 días son independientes: lanzarlas en paralelo.
+            # Las estadísticas y la serie son opcionales (la respuesta sale sin ellas si fallan).
+            calls['stats'] = EECall(get_info, stats_reduction, optional=True)
+            if generate_time_series:
                 # Rango de 10 días: 5 días antes y 5 días después del día central
                 series_start = (target_date - timedelta(days=5)).strftime("%Y-%m-%d")
                 series_end = (target_date + timedelta(days=5)).strftime("%Y-%m-%d")
-                
                 print(f"Generando serie temporal de 10 días: {series_start} a {series_end}")
-                time_series = get_sentinel2_time_series(
+                calls['time_series'] = EECall(
+                    get_sentinel2_time_series,
                     roi=roi,
                     start=series_start,
                     end=series_end,
                     index=req.index,
-                    cloud_pct=req.cloud_pct or 30
+                    cloud_pct=cloud_pct,
+                    scale=series_plan['scale_m'],
+                    max_pixels=series_plan['max_pixels'],
+                    optional=True
                 )
+            results, errors = run_parallel(calls)
+
+            # Calcular estadísticas
+            stats_result = results.get('stats')
+            layer_stats = {}
+            for idx in indices:
+                # Keys por banda (renombrada al índice): idx_min, idx_max, idx_mean, idx_stdDev
+                layer_stats[idx] = stat_dict(stats_result, idx)
+                if layer_stats[idx]:
+                    print(f"Estadísticas calculadas para {idx}: {layer_stats[idx]}")
+            if not stats_result and 'stats' in errors:
+                print(f"Warning: no se pudieron calcular estadísticas: {errors['stats']}")
+
+            # Obtener map ID y tile URL
+            map_id_dict = results['map_id']
+            tile_url = map_id_dict['tile_url_template']
+
+            # Calcular bounds para centrar mapa (localmente, sin llamar a EE)
+            west, south, east, north = geojson_bounds(roi_geojson)
+            bounds = {
+                'west': west,
+                'south': south,
+                'east': east,
+                'north': north,
+                'center': {
+                    'lon': (west + east) / 2,
+                    'lat': (south + north) / 2
+                }
+            }
+
+            # Serie temporal de 10 días si se solicitó un solo día
+            time_series = results.get('time_series')
+            if time_series is not None:
                 print(f"Serie temporal generada: {len(time_series)} puntos")
-            except Exception as e:
-                print(f"Warning: no se pudo generar serie temporal: {e}")
-                time_series = None
+            elif 'time_series' in errors:
+                print(f"Warning: no se pudo generar serie temporal: {errors['time_series']}")
+
+            # Con varios índices, una capa (tiles + estadísticas) por índice
+            layers = None
+            if len(indices) > 1:
+                layers = []
+                for idx in indices:
+                    m = results.get('map_id' if idx == req.index else f'map_id:{idx}')
+                    layer_out = {'index': idx, 'tile_url': m['tile_url_template'] if m else None, 'map_id': m['mapid'] if m else None, 'stats': layer_stats[idx]}
+                    if not m:
+                        layer_out['error'] = str(errors.get(f'map_id:{idx}'))
+                    layers.append(layer_out)
+
+            # Estadísticas a escala nativa en segundo plano (ver /jobs/{job_id} y /jobs/{job_id}/events)
+            refine_job = None
+            if refine_plan is not None:
+                refine_job = submit_refine_job(roi_geojson, start_date, end_date, cloud_pct, indices, refine_plan, kml_id=req.kml_id)
+
+            return {
+                'tile_url': tile_url,
+                'map_id': map_id_dict['mapid'],
+                'bounds': bounds,
+                'stats': layer_stats[req.index],
+                'time_series': time_series,
+                'layers': layers,
+                # Píxeles realmente reducidos (índice principal)
+                'stats_plan': dict(plan, pixel_count=(stats_result or {}).get(f'{req.index}_count')),
+                'refine_job': refine_job
+            }
+
+        # Peticiones idénticas concurrentes (misma parcela, índice, fecha y nubes) comparten
+        # una sola computación en EE. En modo progresivo `plan` es siempre la vista previa
+        # (fast): la calidad de la clave es la pedida, la del refinado.
+        flight_key = request_fingerprint(roi_geojson, kind='heatmap_request', index=req.index, indices=indices, date=req.date, cloud_pct=req.cloud_pct, days_buffer=days_buffer_original, stats_quality=(refine_plan or plan)['quality'], progressive=refine_plan is not None)
+        result = ee_flights.do(flight_key, _compute_heatmap)
         
         return HeatmapResponse(
             success=True,
@@ -231,11 +271,14 @@ def get_heatmap(req: HeatmapRequest):
             date=req.date,
             index=req.index,
             roi=roi_geojson,
-            tile_url=tile_url,
-            map_id=map_id_dict['mapid'],
-            bounds=bounds,
-            stats=stats,
-            time_series=time_series
+            tile_url=result['tile_url'],
+            map_id=result['map_id'],
+            bounds=result['bounds'],
+            stats=result['stats'],
+            time_series=result['time_series'],
+            layers=result['layers'],
+            stats_plan=result['stats_plan'],
+            refine_job=result['refine_job']
         )
         
     except ValueError as e:
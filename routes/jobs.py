@@ -0,0 +1,113 @@
+from fastapi import APIRouter, HTTPException
+from fastapi.responses import FileResponse, StreamingResponse
+from pathlib import Path
+import json
+import os
+import time
+from services.jobs import job_status, JOB_STATUSES
+from services.db import list_jobs
+
+router = APIRouter()
+
+# SSE de /jobs/{job_id}/events: intervalo de sondeo del estado y tiempo máximo abierto
+JOB_EVENTS_POLL_S = float(os.getenv('JOB_EVENTS_POLL_S', '0.5'))
+JOB_EVENTS_TIMEOUT_S = float(os.getenv('JOB_EVENTS_TIMEOUT_S', '600'))
+JOB_EVENTS_KEEPALIVE_S = 15
+
+_MEDIA_TYPES = {
+    '.txt': 'text/plain',
+    '.csv': 'text/csv',
+    '.tif': 'image/tiff',
+    '.png': 'image/png',
+}
+
+
+def _public_job(job):
+    # El payload puede ser grande (geometrías); no se devuelve en el estado
+    job = dict(job)
+    job.pop('payload', None)
+    return job
+
+
+@router.get('/jobs')
+def get_jobs(status: str = None, kind: str = None, limit: int = 50):
+    if status and status not in JOB_STATUSES:
+        raise HTTPException(status_code=400, detail=f'status inválido, usar uno de {JOB_STATUSES}')
+    jobs = list_jobs(status=[status] if status else None, kind=kind, limit=limit)
+    return {'count': len(jobs), 'jobs': [_public_job(j) for j in jobs]}
+
+
+@router.get('/jobs/{job_id}')
+def get_job_status(job_id: str):
+    job = job_status(job_id)
+    if not job:
+        raise HTTPException(status_code=404, detail='job not found')
+    return _public_job(job)
+
+
+def _sse(event, data):
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+
+def _job_events(job_id, job):
+    # Un evento por cambio de estado/progreso; 'done' o 'failed' con el job completo y fin
+    last = None
+    deadline = time.monotonic() + JOB_EVENTS_TIMEOUT_S
+    sent_at = time.monotonic()
+    while True:
+        public = _public_job(job)
+        if public['status'] in ('done', 'failed'):
+            yield _sse(public['status'], public)
+            return
+        state = (public['status'], public.get('progress'), public.get('total'), public.get('message'))
+        now = time.monotonic()
+        if state != last:
+            yield _sse('progress', public)
+            last, sent_at = state, now
+        elif now > deadline:
+            yield _sse('timeout', {'job_id': job_id, 'status_url': f'/jobs/{job_id}'})
+            return
+        elif now - sent_at > JOB_EVENTS_KEEPALIVE_S:
+            # Comentario SSE: mantiene viva la conexión a través de proxies
+            yield ': keep-alive\n\n'
+            sent_at = now
+        time.sleep(JOB_EVENTS_POLL_S)
+        job = job_status(job_id) or job
+
+
+@router.get('/jobs/{job_id}/events')
+def get_job_events(job_id: str):
+    """Estado del job como Server-Sent Events: 'progress' en cada cambio y un evento final
+    'done' (con el resultado) o 'failed'. Alternativa a sondear /jobs/{job_id}."""
+    job = job_status(job_id)
+    if not job:
+        raise HTTPException(status_code=404, detail='job not found')
+    return StreamingResponse(_job_events(job_id, job), media_type='text/event-stream',
+                             headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+
+@router.get('/jobs/{job_id}/result')
+def get_job_result(job_id: str, file: str = None):
+    """Resultado de un job terminado. Si generó ficheros (.txt/.tif/.png) se descarga
+    el indicado en `file` (o el único que haya); si no, se devuelve el resultado JSON."""
+    job = job_status(job_id)
+    if not job:
+        raise HTTPException(status_code=404, detail='job not found')
+    if job['status'] == 'failed':
+        raise HTTPException(status_code=500, detail=job.get('error') or 'job failed')
+    if job['status'] != 'done':
+        raise HTTPException(status_code=409, detail=f"job {job['status']}: progreso {job.get('progress')}/{job.get('total')}")
+
+    result = job.get('result') or {}
+    files = result.get('files') if isinstance(result, dict) else None
+    if not files:
+        return result
+    if file is None:
+        if len(files) > 1:
+            raise HTTPException(status_code=400, detail=f'el job generó varios ficheros, indicar file= uno de {sorted(files)}')
+        file = next(iter(files))
+    path = files.get(file)
+    if not path or not Path(path).exists():
+        raise HTTPException(status_code=404, detail=f'fichero {file} no disponible')
+    p = Path(path)
+    return FileResponse(str(p), media_type=_MEDIA_TYPES.get(p.suffix.lower(), 'application/octet-stream'), filename=p.name)
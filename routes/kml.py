@@ -1,29 +1,45 @@
 from fastapi import APIRouter, HTTPException, UploadFile, File
-from services.ee.ee_client import parse_kml_to_geojson
+from fastapi.concurrency import run_in_threadpool
+from utils_pkg.kml import parse_kml, open_kml_source
+from services.plots import register_plot
 from config import BASE_OUTPUT_DIR
 import pathlib
 import uuid
 import json
+import zipfile
+import xml.etree.ElementTree as ET
 
 router = APIRouter()
 
 
+def _parse_upload(fileobj):
+    fileobj.seek(0)
+    return parse_kml(open_kml_source(fileobj))
+
+
 @router.post("/upload-kml")
 async def upload_kml(file: UploadFile = File(...)):
     try:
-        if not file.filename.lower().endswith('.kml'):
-            raise HTTPException(status_code=400, detail="El archivo debe tener extensión .kml")
-        content = await file.read()
-        kml_content = content.decode('utf-8')
-        result = parse_kml_to_geojson(kml_content)
+        if not file.filename.lower().endswith(('.kml', '.kmz')):
+            raise HTTPException(status_code=400, detail="El archivo debe tener extensión .kml o .kmz")
+        # La subida ya está en un SpooledTemporaryFile: se parsea en streaming desde ahí
+        # (fuera del event loop) sin cargar el archivo completo en memoria
+        result = await run_in_threadpool(_parse_upload, file.file)
         if not result["success"]:
             raise HTTPException(status_code=400, detail=result["message"]) 
         kml_dir = pathlib.Path(BASE_OUTPUT_DIR) / 'kml_uploads'
         kml_dir.mkdir(parents=True, exist_ok=True)
         kml_id = str(uuid.uuid4())
         geojson_path = kml_dir / f"{kml_id}.geojson"
+        fc = {'type': 'FeatureCollection', 'features': result.get('features', [])}
         with open(geojson_path, 'w', encoding='utf-8') as fh:
-            json.dump({'type': 'FeatureCollection', 'features': result.get('features', [])}, fh, ensure_ascii=False)
+            json.dump(fc, fh, ensure_ascii=False)
+        try:
+            # Bounds, área, huella y geometría simplificada se calculan una sola vez aquí
+            await run_in_threadpool(register_plot, kml_id, fc)
+        except Exception as e:
+            # get_plot lo registrará desde el .geojson en el primer uso
+            print(f"Warning: no se pudo registrar la parcela {kml_id}: {e}")
         return {
             "success": result["success"],
             "message": result["message"],
@@ -33,7 +49,9 @@ async def upload_kml(file: UploadFile = File(...)):
             "bounds": result["bounds"],
             "kml_id": kml_id
         }
-    except UnicodeDecodeError:
+    except HTTPException:
+        raise
+    except (UnicodeDecodeError, ET.ParseError, zipfile.BadZipFile, ValueError):
         raise HTTPException(status_code=400, detail="Error al decodificar el archivo KML. Asegúrate de que sea un archivo de texto válido.")
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error procesando archivo KML: {str(e)}")
@@ -1,16 +1,40 @@
 from fastapi import APIRouter, HTTPException
-from services.db import list_measurements, get_measurement
+from fastapi.responses import StreamingResponse
+from services.db import list_measurements, get_measurement, iter_measurements, next_page_cursor, check_page_cursor, MEASUREMENTS_PAGE_KEYS
+from services.write_behind import db_writer
+import json
 
 router = APIRouter()
 
+DEFAULT_PAGE_SIZE = 500
+
+
+def _simple(r):
+    # Solo las fechas y metric_id para construir el calendario
+    return {'metric_id': r['metric_id'], 'ts': r['ts'], 'value': r['value'], 'metric_type': r['metric_type'], 'plot_id': r['plot_id']}
+
 
 @router.get('/measurements')
-def measurements_list(plot_id: str = None, metric_type: str = None, limit: int = 500):
+def measurements_list(plot_id: str = None, metric_type: str = None, limit: int = None, cursor: str = None, stream: bool = False):
+    """Mediciones más recientes primero, paginadas con `cursor` (usar `next_cursor` de la respuesta).
+
+    Con stream=true responde NDJSON (una medición por línea) leyendo por lotes desde
+    la BD, sin límite salvo que se indique `limit`.
+    """
+    try:
+        check_page_cursor(cursor, MEASUREMENTS_PAGE_KEYS)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
     try:
-        results = list_measurements(plot_id=plot_id, metric_type=metric_type, limit=limit)
-        # Devolver solo las fechas y metric_id para construir el calendario
-        simple = [{'metric_id': r['metric_id'], 'ts': r['ts'], 'value': r['value'], 'metric_type': r['metric_type'], 'plot_id': r['plot_id']} for r in results]
-        return {'count': len(simple), 'measurements': simple}
+        # Incluir las mediciones aún en la cola write-behind
+        db_writer.flush()
+        if stream:
+            rows = iter_measurements(plot_id=plot_id, metric_type=metric_type, limit=limit, cursor=cursor)
+            return StreamingResponse((json.dumps(_simple(r)) + '\n' for r in rows), media_type='application/x-ndjson')
+        limit = limit or DEFAULT_PAGE_SIZE
+        results = list_measurements(plot_id=plot_id, metric_type=metric_type, limit=limit, cursor=cursor)
+        simple = [_simple(r) for r in results]
+        return {'count': len(simple), 'measurements': simple, 'next_cursor': next_page_cursor(results, limit, MEASUREMENTS_PAGE_KEYS)}
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
@@ -18,6 +42,7 @@ def measurements_list(plot_id: str = None, metric_type: str = None, limit: int =
 @router.get('/measurements/{metric_id}')
 def measurement_get(metric_id: str):
     try:
+        db_writer.flush()
         m = get_measurement(metric_id)
         if not m:
             raise HTTPException(status_code=404, detail='measurement not found')
@@ -1,5 +1,6 @@
 from fastapi import APIRouter
 import ee
+from services.write_behind import db_writer
 
 router = APIRouter()
 
@@ -17,6 +18,6 @@ def root():
 def health():
     try:
         _ = ee.Date('2020-01-01').format().getInfo()
-        return {"status": "ok"}
+        return {"status": "ok", "write_queue_depth": db_writer.depth(), "write_failed": db_writer.failed}
     except Exception as e:
-        return {"status": "error", "detail": str(e)}
+        return {"status": "error", "detail": str(e), "write_queue_depth": db_writer.depth(), "write_failed": db_writer.failed}
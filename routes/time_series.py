@@ -1,7 +1,10 @@
 from fastapi import APIRouter, HTTPException
 from schemas.models import TimeSeriesRequest
-from services.ee.ee_client import get_sentinel2_time_series, init_ee
-from utils_pkg import make_roi_from_geojson, make_roi
+from services.ee.ee_client import init_ee
+from services.series import incremental_time_series
+from utils_pkg import make_roi_from_geojson, make_roi, meters_to_degrees, bounds_to_polygon, request_fingerprint
+from utils_pkg.singleflight import ee_flights
+from utils_pkg.stats_plan import plan_stats
 import logging
 
 router = APIRouter()
@@ -16,10 +19,17 @@ def get_time_series(req: TimeSeriesRequest):
         init_ee()
         if req.geometry:
             roi = make_roi_from_geojson(req.geometry)
+            roi_geojson = req.geometry
         else:
             roi = make_roi(req.lon, req.lat, req.width_m, req.height_m)
+            roi_geojson = bounds_to_polygon(meters_to_degrees(req.lon, req.lat, req.width_m, req.height_m))
         cloud_pct = getattr(req, 'cloud_pct', 70)
-        series_data = get_sentinel2_time_series(roi, req.start, req.end, req.index, cloud_pct)
+        # Escala de la reducción por pasada según el área de la ROI y la calidad pedida
+        plan = plan_stats(roi_geojson, getattr(req, 'stats_quality', None), series=True)
+        # Peticiones idénticas concurrentes comparten la misma serie; solo las pasadas
+        # aún no guardadas se calculan en EE
+        flight_key = request_fingerprint(roi_geojson, kind='series', index=req.index, start=req.start, end=req.end, cloud_pct=cloud_pct, scale=plan['scale_m'])
+        series_data = ee_flights.do(flight_key, lambda: incremental_time_series(roi, roi_geojson, req.start, req.end, req.index, cloud_pct, plan=plan))
         if not series_data:
             raise HTTPException(status_code=404, detail=f"No se encontraron imágenes de Sentinel-2 para el índice {req.index} en el rango {req.start} - {req.end}")
         # Aplicar redondeo a dos cifras significativas a cada punto de la serie
@@ -44,7 +54,7 @@ def get_time_series(req: TimeSeriesRequest):
             }
         else:
             summary_stats = {"total_points": 0, "valid_points": 0}
-        response = {"analysis_type": req.index, "roi": roi.getInfo(), "date_range": {"start": req.start, "end": req.end}, "time_series": series_data, "summary": summary_stats}
+        response = {"analysis_type": req.index, "roi": roi_geojson, "date_range": {"start": req.start, "end": req.end}, "time_series": series_data, "summary": summary_stats, "stats_plan": plan}
         return response
     except HTTPException:
         raise
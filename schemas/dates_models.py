@@ -16,6 +16,7 @@ class DatesRequest(BaseModel):
     start: str   # "YYYY-MM-DD" - fecha inicial de búsqueda
     end: str     # "YYYY-MM-DD" - fecha final de búsqueda
     cloud_pct: Optional[int] = 100  # Max cloud cover filter (0-100). Default 100 = all images.
+    stream: Optional[bool] = False  # Si true, responde NDJSON (una fecha por línea) a medida que llegan los tramos de EE
 
 
 class ImageDate(BaseModel):
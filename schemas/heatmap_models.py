@@ -1,5 +1,5 @@
 from pydantic import BaseModel, Field
-from typing import Optional, List
+from typing import Literal, Optional, List
 
 
 class HeatmapRequest(BaseModel):
@@ -18,6 +18,9 @@ class HeatmapRequest(BaseModel):
     index: str = "NDVI"  # índice a calcular (NDVI, EVI, NDWI, etc.)
     cloud_pct: Optional[int] = 30  # máximo % de nubes
     days_buffer: Optional[int] = 0  # días antes/después para composición (0 = solo ese día)
+    indices: Optional[List[str]] = None  # índices adicionales: se derivan del mismo composite (ver layers)
+    progressive: Optional[bool] = False  # estadísticas rápidas a escala gruesa + refinado en segundo plano (ver refine_job)
+    stats_quality: Optional[Literal['fast', 'balanced', 'accurate']] = None  # estadísticas: presupuesto de píxeles (precisión vs latencia); None = DEFAULT_STATS_QUALITY
 
 
 class HeatmapResponse(BaseModel):
@@ -32,3 +35,6 @@ class HeatmapResponse(BaseModel):
     bounds: dict  # bbox para centrar el mapa
     stats: Optional[dict] = None  # estadísticas del índice (min, max, mean, etc.)
     time_series: Optional[List[dict]] = None  # serie temporal de 10 días (solo cuando days_buffer=0)
+    layers: Optional[List[dict]] = None  # con `indices`: [{index, tile_url, map_id, stats}] por índice
+    stats_plan: Optional[dict] = None  # escala y píxeles efectivos de las estadísticas
+    refine_job: Optional[dict] = None  # con `progressive`: job con las estadísticas refinadas (status_url, events_url)
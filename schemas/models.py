@@ -18,6 +18,10 @@ class ComputeRequest(BaseModel):
     cloud_pct: Optional[int] = 30  # Para Alpha Earth heatmaps
     export_format: Optional[Literal['png', 'geotiff', 'csv']] = None  # Si se pide, exportar el heatmap/serie (png, geotiff, csv)
     split_kml: Optional[bool] = False  # Si true y la geometría es FeatureCollection (o kml_id apunta a FC), procesar por feature
+    async_job: Optional[bool] = False  # /stats/kml y exports png/geotiff: encolar como job y devolver job_id (ver /jobs/{job_id})
+    indices: Optional[List[Literal["rgb", "ndvi", "ndwi", "evi", "savi", "gci", "vegetation_health", "water_detection", "urban_index", "soil_moisture", "change_detection", "ndmi", "ndre", "lai", "soil_ph"]]] = None  # heatmap (tiles): índices adicionales del mismo composite (ver layers)
+    progressive: Optional[bool] = False  # estadísticas rápidas a escala gruesa + refinado en segundo plano (ver refine_job)
+    stats_quality: Optional[Literal['fast', 'balanced', 'accurate']] = None  # estadísticas: presupuesto de píxeles (precisión vs latencia); None = DEFAULT_STATS_QUALITY
 
 class TimeSeriesRequest(BaseModel):
     geometry: Optional[dict] = None  # GeoJSON geometry
@@ -30,6 +34,7 @@ class TimeSeriesRequest(BaseModel):
     index: Literal["rgb", "ndvi", "ndwi", "evi", "savi", "gci", "vegetation_health", "water_detection", "urban_index", "soil_moisture", "change_detection", "ndmi", "ndre", "lai", "soil_ph"] = "rgb"
     cloud_pct: Optional[int] = 80  # Para series temporales, más permisivo por defecto
     fast_mode: Optional[bool] = True  # Modo rápido por defecto
+    stats_quality: Optional[Literal['fast', 'balanced', 'accurate']] = None  # estadísticas: presupuesto de píxeles (precisión vs latencia); None = DEFAULT_STATS_QUALITY
 
 class KMLUploadResponse(BaseModel):
     success: bool
@@ -52,3 +57,7 @@ class ComputeResponse(BaseModel):
     vis: Optional[dict] = None
     series: Optional[List[TimePoint]] = None
     saved_files: Optional[dict] = None  # {'geotiff': '...', 'csv': '...'}
+    job_id: Optional[str] = None  # Si async_job, id del job que generará los ficheros
+    layers: Optional[List[dict]] = None  # Con `indices`: una capa por índice (tileUrlTemplate, vis, estadísticas)
+    stats_plan: Optional[dict] = None  # Escala y píxeles efectivos de las estadísticas (ver utils_pkg/stats_plan.py)
+    refine_job: Optional[dict] = None  # Con `progressive`: job con las estadísticas refinadas (status_url, events_url)
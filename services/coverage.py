@@ -0,0 +1,63 @@
+"""Cobertura de consultas a EE: qué rangos de fechas ya se trajeron por completo.
+
+Los intervalos son semiabiertos [start, end) con fechas 'YYYY-MM-DD', igual que
+`filterDate` de EE. Las rutas consultan `split_by_coverage` para servir desde
+SQLite lo ya cubierto y pedir a EE solo los huecos; tras guardar un hueco lo
+registran con `record_coverage`.
+
+Los días más recientes no se dan por cerrados: EE ingiere las escenas con
+retraso, así que la cobertura registrada termina como mucho
+COVERAGE_SETTLE_DAYS antes de hoy y esos días se vuelven a consultar.
+"""
+import os
+import datetime
+from services.db import get_coverage, add_coverage
+
+COVERAGE_SETTLE_DAYS = int(os.getenv('COVERAGE_SETTLE_DAYS', '5'))
+
+SENTINEL2_DATES = 'sentinel2_dates'
+SERIES_POINTS = 'series_points'
+
+
+def _settled_until():
+    return (datetime.datetime.utcnow().date() - datetime.timedelta(days=COVERAGE_SETTLE_DAYS)).strftime('%Y-%m-%d')
+
+
+def split_by_coverage(start, end, covered):
+    """Divide [start, end) en tramos (a, b, cubierto) en orden cronológico."""
+    segments = []
+    cursor = start
+    for a, b in sorted(covered):
+        if b <= cursor or a >= end:
+            continue
+        if a > cursor:
+            segments.append((cursor, a, False))
+        seg_end = min(b, end)
+        segments.append((max(a, cursor), seg_end, True))
+        cursor = seg_end
+        if cursor >= end:
+            break
+    if cursor < end:
+        segments.append((cursor, end, False))
+    return segments
+
+
+def missing_intervals(start, end, covered):
+    return [(a, b) for a, b, is_covered in split_by_coverage(start, end, covered) if not is_covered]
+
+
+def coverage_segments(dataset, key, start, end, param=None, min_param=None):
+    """Tramos (a, b, cubierto) de [start, end) según la cobertura guardada."""
+    if start >= end:
+        return []
+    covered = get_coverage(dataset, key, start, end, param=param, min_param=min_param)
+    return split_by_coverage(start, end, covered)
+
+
+def record_coverage(dataset, key, start, end, param=None):
+    """Marca [start, end) como traído por completo, sin incluir los días aún no asentados."""
+    end = min(end, _settled_until())
+    if start >= end:
+        return False
+    add_coverage(dataset, key, start, end, param=param)
+    return True
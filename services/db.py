@@ -1,17 +1,35 @@
 from pathlib import Path
 from config import BASE_OUTPUT_DIR
+import os
+import base64
 import sqlite3
 import json
+import threading
+from contextlib import contextmanager
 from typing import Optional
 
 DB_PATH = Path(BASE_OUTPUT_DIR) / 'terra.db'
 
+# Cada hilo (threadpool de FastAPI, jobs, executor EE) mantiene su propia conexión
+# abierta en lugar de abrir/cerrar una por consulta. WAL permite lecturas
+# concurrentes con una escritura; synchronous=NORMAL es seguro con WAL y evita un
+# fsync por commit. El caché de sentencias de sqlite3 reutiliza las consultas
+# preparadas de cada conexión.
+DB_CACHE_SIZE_KB = int(os.getenv('DB_CACHE_SIZE_KB', '16384'))
+DB_BUSY_TIMEOUT_S = float(os.getenv('DB_BUSY_TIMEOUT_S', '30'))
+DB_CACHED_STATEMENTS = 256
+
+_local = threading.local()
+_all_connections = []
+_connections_lock = threading.Lock()
+# Se incrementa en close_connections(): las conexiones de otros hilos quedan
+# cerradas y cada hilo abre una nueva en su siguiente consulta
+_pool_generation = 0
+
 # Copying original DB helper functions - trimmed for brevity
 
 def init_db():
-    DB_PATH.parent.mkdir(parents=True, exist_ok=True)
-    conn = sqlite3.connect(str(DB_PATH))
-    try:
+    with _transaction() as conn:
         cur = conn.cursor()
         # Create assets table
         cur.execute('''
@@ -59,75 +77,615 @@ def init_db():
             cloud_cover REAL,
             tile_id TEXT,
             roi_geojson TEXT,
+            created_at TEXT DEFAULT CURRENT_TIMESTAMP
+        )''')
+
+        # Create jobs table (trabajos en segundo plano, ver services/jobs.py)
+        cur.execute('''
+        CREATE TABLE IF NOT EXISTS jobs (
+            job_id TEXT PRIMARY KEY,
+            kind TEXT NOT NULL,
+            status TEXT NOT NULL,
+            progress INTEGER DEFAULT 0,
+            total INTEGER,
+            message TEXT,
+            payload TEXT,
+            result TEXT,
+            error TEXT,
             created_at TEXT DEFAULT CURRENT_TIMESTAMP,
-            UNIQUE(geometry_id, date, system_time_start)
+            started_at TEXT,
+            finished_at TEXT
         )''')
 
-        conn.commit()
-    finally:
-        conn.close()
+    migrate_db(conn)
 
 
-def _connect():
+# --- Migraciones de esquema ---
+# Cada migración se aplica una sola vez, en orden, dentro de una transacción, y
+# deja PRAGMA user_version con su número. Para cambiar el esquema añadir una
+# función al final de MIGRATIONS (nunca modificar una ya publicada).
+
+# Clave natural de una medición: misma parcela, métrica y fecha = misma fila.
+# Solo aplica a filas con plot_id: sin parcela no se sabe si dos mediciones son
+# de la misma ROI, así que esas filas no se compactan ni se actualizan.
+MEASUREMENTS_NATURAL_KEY = "ifnull(tenant_id, ''), plot_id, metric_type, ts"
+MEASUREMENTS_NATURAL_KEY_WHERE = 'plot_id IS NOT NULL'
+
+
+def _migration_1_measurements_keys(cur):
+    # Compactar duplicados existentes conservando la fila más reciente
+    cur.execute(f'''
+    DELETE FROM measurements WHERE {MEASUREMENTS_NATURAL_KEY_WHERE} AND id NOT IN (
+        SELECT MAX(id) FROM measurements WHERE {MEASUREMENTS_NATURAL_KEY_WHERE} GROUP BY {MEASUREMENTS_NATURAL_KEY}
+    )''')
+    removed = cur.rowcount
+    cur.execute(f'''
+    CREATE UNIQUE INDEX IF NOT EXISTS ux_measurements_natural_key ON measurements({MEASUREMENTS_NATURAL_KEY})
+    WHERE {MEASUREMENTS_NATURAL_KEY_WHERE}''')
+    # Índices para los patrones de /measurements (filtros por plot_id/metric_type, orden por ts)
+    cur.execute('CREATE INDEX IF NOT EXISTS ix_measurements_plot_metric_ts ON measurements(plot_id, metric_type, ts)')
+    cur.execute('CREATE INDEX IF NOT EXISTS ix_measurements_plot_ts ON measurements(plot_id, ts)')
+    cur.execute('CREATE INDEX IF NOT EXISTS ix_measurements_metric_ts ON measurements(metric_type, ts)')
+    cur.execute('CREATE INDEX IF NOT EXISTS ix_measurements_ts ON measurements(ts)')
+    cur.execute('CREATE INDEX IF NOT EXISTS ix_measurements_metric_id ON measurements(metric_id)')
+    if removed and removed > 0:
+        print(f"migración measurements: {removed} filas duplicadas eliminadas")
+    return removed
+
+
+def _migration_2_keyset_indexes(cur):
+    # Índices que sirven el orden (clave, id) de la paginación keyset
+    cur.execute('CREATE INDEX IF NOT EXISTS ix_assets_ingested ON assets(ingested_ts, asset_id)')
+    cur.execute('CREATE INDEX IF NOT EXISTS ix_assets_tenant_ingested ON assets(tenant_id, ingested_ts, asset_id)')
+    cur.execute('CREATE INDEX IF NOT EXISTS ix_assets_plot_ingested ON assets(plot_id, ingested_ts, asset_id)')
+    cur.execute('CREATE INDEX IF NOT EXISTS ix_sentinel2_dates_date ON sentinel2_dates(date)')
+    cur.execute('CREATE INDEX IF NOT EXISTS ix_sentinel2_dates_geometry_date ON sentinel2_dates(geometry_id, date)')
+    return 0
+
+
+def _migration_3_assets_rtree(cur):
+    # Índice espacial de la extensión de cada asset (clave = rowid de assets)
+    cur.execute('CREATE VIRTUAL TABLE IF NOT EXISTS assets_rtree USING rtree(id, min_lon, max_lon, min_lat, max_lat)')
+    cur.execute('''
+    CREATE TRIGGER IF NOT EXISTS assets_rtree_delete AFTER DELETE ON assets BEGIN
+        DELETE FROM assets_rtree WHERE id = old.rowid;
+    END''')
+    cur.execute('SELECT asset_id, bbox, footprint FROM assets')
+    existing = [dict(r) for r in cur.fetchall()]
+    _index_asset_bounds(cur, existing)
+    return 0
+
+
+def _migration_4_fetch_coverage(cur):
+    # Rangos [start, end) ya consultados por completo en EE (ver services/coverage.py)
+    cur.execute('''
+    CREATE TABLE IF NOT EXISTS fetch_coverage (
+        dataset TEXT NOT NULL,
+        key TEXT NOT NULL,
+        param REAL,
+        start TEXT NOT NULL,
+        end TEXT NOT NULL,
+        fetched_at TEXT DEFAULT CURRENT_TIMESTAMP
+    )''')
+    cur.execute('CREATE INDEX IF NOT EXISTS ix_fetch_coverage_key ON fetch_coverage(dataset, key, start)')
+    # sentinel2_dates pasa a ser fuente de respuestas: dos tiles MGRS con el mismo
+    # system_time_start son imágenes distintas y deben conservarse ambas. Las bases
+    # creadas antes tienen UNIQUE(geometry_id, date, system_time_start) en la tabla
+    # y hay que reconstruirla; init_db ya la crea sin esa restricción.
+    cur.execute("SELECT sql FROM sqlite_master WHERE type = 'table' AND name = 'sentinel2_dates'")
+    if 'UNIQUE' in (cur.fetchone()[0] or '').upper():
+        _rebuild_sentinel2_dates(cur)
+    cur.execute("CREATE UNIQUE INDEX IF NOT EXISTS ux_sentinel2_dates_image ON sentinel2_dates(geometry_id, date, system_time_start, ifnull(tile_id, ''))")
+    cur.execute('CREATE INDEX IF NOT EXISTS ix_sentinel2_dates_date ON sentinel2_dates(date)')
+    cur.execute('CREATE INDEX IF NOT EXISTS ix_sentinel2_dates_geometry_date ON sentinel2_dates(geometry_id, date)')
+    return 0
+
+
+def _rebuild_sentinel2_dates(cur):
+    cur.execute('''
+    CREATE TABLE sentinel2_dates_new (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        geometry_id TEXT NOT NULL,
+        user_id TEXT,
+        date TEXT NOT NULL,
+        system_time_start INTEGER,
+        cloud_cover REAL,
+        tile_id TEXT,
+        roi_geojson TEXT,
+        created_at TEXT DEFAULT CURRENT_TIMESTAMP
+    )''')
+    cur.execute('''
+    INSERT INTO sentinel2_dates_new(id, geometry_id, user_id, date, system_time_start, cloud_cover, tile_id, roi_geojson, created_at)
+    SELECT id, geometry_id, user_id, date, system_time_start, cloud_cover, tile_id, roi_geojson, created_at FROM sentinel2_dates''')
+    cur.execute('DROP TABLE sentinel2_dates')
+    cur.execute('ALTER TABLE sentinel2_dates_new RENAME TO sentinel2_dates')
+
+
+def _migration_5_series_points(cur):
+    # Media de cada pasada por (huella de geometría, índice); ver services/series.py
+    cur.execute('''
+    CREATE TABLE IF NOT EXISTS series_points (
+        series_key TEXT NOT NULL,
+        image_id TEXT NOT NULL,
+        ts TEXT NOT NULL,
+        system_time_start INTEGER NOT NULL,
+        value REAL,
+        cloud_cover REAL,
+        created_at TEXT DEFAULT CURRENT_TIMESTAMP,
+        PRIMARY KEY (series_key, image_id)
+    )''')
+    cur.execute('CREATE INDEX IF NOT EXISTS ix_series_points_key_ts ON series_points(series_key, ts)')
+    return 0
+
+
+def _migration_6_plots(cur):
+    # Registro de parcelas subidas con sus artefactos precalculados (ver services/plots.py)
+    cur.execute('''
+    CREATE TABLE IF NOT EXISTS plots (
+        plot_id TEXT PRIMARY KEY,
+        fingerprint TEXT NOT NULL,
+        feature_collection TEXT NOT NULL,
+        geometry TEXT NOT NULL,
+        simplified TEXT,
+        bounds TEXT,
+        area_m2 REAL,
+        perimeter_m REAL,
+        features TEXT,
+        features_count INTEGER,
+        created_at TEXT DEFAULT CURRENT_TIMESTAMP
+    )''')
+    cur.execute('CREATE INDEX IF NOT EXISTS ix_plots_fingerprint ON plots(fingerprint)')
+    return 0
+
+
+def _migration_7_plots_simplified_report(cur):
+    # Informe de la preparación de la geometría enviada a EE (utils_pkg/geometry_prep.py).
+    # Las filas anteriores quedan con NULL y se preparan de nuevo al leerlas.
+    cur.execute('ALTER TABLE plots ADD COLUMN simplified_report TEXT')
+    return 0
+
+
+def _migration_8_plots_rtree(cur):
+    # Índice espacial de la extensión de cada parcela (clave = rowid de plots)
+    cur.execute('CREATE VIRTUAL TABLE IF NOT EXISTS plots_rtree USING rtree(id, min_lon, max_lon, min_lat, max_lat)')
+    cur.execute('''
+    CREATE TRIGGER IF NOT EXISTS plots_rtree_delete AFTER DELETE ON plots BEGIN
+        DELETE FROM plots_rtree WHERE id = old.rowid;
+    END''')
+    cur.execute('SELECT plot_id, bounds, features FROM plots')
+    existing = []
+    for r in cur.fetchall():
+        plot = {'plot_id': r['plot_id']}
+        for k in ('bounds', 'features'):
+            try:
+                plot[k] = json.loads(r[k]) if r[k] else None
+            except Exception:
+                plot[k] = None
+        existing.append(plot)
+    _index_plot_bounds(cur, existing)
+    return 0
+
+
+def _migration_9_sentinel2_dates_fingerprint_ids(cur):
+    # geometry_id pasó de sha256(json.dumps(roi, sort_keys=True))[:16] a la huella
+    # canónica (utils_pkg/fingerprint.py): reasignar las filas con el id antiguo para
+    # que la misma parcela siga encontrando sus fechas
+    import hashlib
+    from utils_pkg.fingerprint import geometry_fingerprint
+
+    cur.execute('SELECT geometry_id, roi_geojson FROM sentinel2_dates WHERE roi_geojson IS NOT NULL GROUP BY geometry_id')
+    renames = []
+    for r in cur.fetchall():
+        try:
+            roi = json.loads(r['roi_geojson'])
+            legacy_id = hashlib.sha256(json.dumps(roi, sort_keys=True).encode()).hexdigest()[:16]
+            new_id = geometry_fingerprint(roi)
+        except Exception:
+            continue
+        if r['geometry_id'] == legacy_id and new_id != legacy_id:
+            renames.append((new_id, legacy_id))
+    # Las fechas que ya existen con el id nuevo se conservan y se descarta la copia antigua
+    cur.executemany('UPDATE OR IGNORE sentinel2_dates SET geometry_id = ? WHERE geometry_id = ?', renames)
+    cur.executemany('DELETE FROM sentinel2_dates WHERE geometry_id = ?', [(legacy_id,) for _, legacy_id in renames])
+    if renames:
+        print(f"migración sentinel2_dates: {len(renames)} geometry_id reasignados a la huella canónica")
+    return 0
+
+
+def _migration_10_null_safe_keyset_indexes(cur):
+    # La paginación ordena por ifnull(clave, '') (ver _keyset): índices sobre esa
+    # expresión para que el orden siga saliendo del índice. Los de la versión 2
+    # sobre assets solo servían a la paginación.
+    cur.execute('DROP INDEX IF EXISTS ix_assets_ingested')
+    cur.execute('DROP INDEX IF EXISTS ix_assets_tenant_ingested')
+    cur.execute('DROP INDEX IF EXISTS ix_assets_plot_ingested')
+    cur.execute("CREATE INDEX IF NOT EXISTS ix_assets_page ON assets(ifnull(ingested_ts, ''), asset_id)")
+    cur.execute("CREATE INDEX IF NOT EXISTS ix_assets_tenant_page ON assets(tenant_id, ifnull(ingested_ts, ''), asset_id)")
+    cur.execute("CREATE INDEX IF NOT EXISTS ix_assets_plot_page ON assets(plot_id, ifnull(ingested_ts, ''), asset_id)")
+    cur.execute("CREATE INDEX IF NOT EXISTS ix_measurements_page ON measurements(ifnull(ts, ''), id)")
+    cur.execute("CREATE INDEX IF NOT EXISTS ix_measurements_plot_page ON measurements(plot_id, ifnull(ts, ''), id)")
+    cur.execute("CREATE INDEX IF NOT EXISTS ix_measurements_metric_page ON measurements(metric_type, ifnull(ts, ''), id)")
+    cur.execute("CREATE INDEX IF NOT EXISTS ix_measurements_plot_metric_page ON measurements(plot_id, metric_type, ifnull(ts, ''), id)")
+    cur.execute("CREATE INDEX IF NOT EXISTS ix_sentinel2_dates_page ON sentinel2_dates(ifnull(date, ''), id)")
+    cur.execute("CREATE INDEX IF NOT EXISTS ix_sentinel2_dates_geometry_page ON sentinel2_dates(geometry_id, ifnull(date, ''), id)")
+    return 0
+
+
+def _migration_11_jobs_owner(cur):
+    # Proceso que encoló o reanudó cada job (ver services/jobs.py:resume_jobs)
+    cur.execute('PRAGMA table_info(jobs)')
+    if 'owner' not in [r['name'] for r in cur.fetchall()]:
+        cur.execute('ALTER TABLE jobs ADD COLUMN owner TEXT')
+    return 0
+
+
+MIGRATIONS = [
+    _migration_1_measurements_keys,
+    _migration_2_keyset_indexes,
+    _migration_3_assets_rtree,
+    _migration_4_fetch_coverage,
+    _migration_5_series_points,
+    _migration_6_plots,
+    _migration_7_plots_simplified_report,
+    _migration_8_plots_rtree,
+    _migration_9_sentinel2_dates_fingerprint_ids,
+    _migration_10_null_safe_keyset_indexes,
+    _migration_11_jobs_owner,
+]
+
+
+def schema_version(conn=None):
+    conn = conn or _connect()
+    return conn.execute('PRAGMA user_version').fetchone()[0]
+
+
+def migrate_db(conn=None):
+    """Aplica las migraciones pendientes. Retorna la versión final del esquema."""
+    conn = conn or _connect()
+    current = schema_version(conn)
+    compacted = False
+    for version, migration in enumerate(MIGRATIONS, start=1):
+        if version <= current:
+            continue
+        try:
+            conn.execute('BEGIN IMMEDIATE')
+            # Releer dentro del lock por si otro proceso ya la aplicó
+            if schema_version(conn) >= version:
+                conn.commit()
+                continue
+            cur = conn.cursor()
+            removed = migration(cur)
+            cur.execute(f'PRAGMA user_version = {version}')
+            conn.commit()
+            compacted = compacted or bool(removed)
+            print(f"DB migrada a la versión {version} ({migration.__name__})")
+        except Exception:
+            conn.rollback()
+            raise
+    if compacted:
+        # Recuperar el espacio de las filas eliminadas
+        conn.execute('VACUUM')
+    if len(MIGRATIONS) > current:
+        conn.execute('PRAGMA optimize')
+    return schema_version(conn)
+
+
+def _open_connection():
     DB_PATH.parent.mkdir(parents=True, exist_ok=True)
-    conn = sqlite3.connect(str(DB_PATH))
+    # check_same_thread=False solo para poder cerrarlas todas al apagar; cada
+    # conexión se usa exclusivamente desde el hilo que la creó.
+    conn = sqlite3.connect(str(DB_PATH), timeout=DB_BUSY_TIMEOUT_S,
+                           cached_statements=DB_CACHED_STATEMENTS, check_same_thread=False)
     conn.row_factory = sqlite3.Row
+    conn.execute('PRAGMA journal_mode=WAL')
+    conn.execute('PRAGMA synchronous=NORMAL')
+    conn.execute(f'PRAGMA cache_size=-{DB_CACHE_SIZE_KB}')
+    conn.execute('PRAGMA temp_store=MEMORY')
     return conn
 
 
+def _connect():
+    """Conexión del hilo actual (se crea la primera vez y se reutiliza)."""
+    conn = getattr(_local, 'conn', None)
+    if conn is None or getattr(_local, 'generation', None) != _pool_generation:
+        conn = _open_connection()
+        with _connections_lock:
+            _all_connections.append(conn)
+            _local.generation = _pool_generation
+        _local.conn = conn
+    return conn
+
+
+@contextmanager
+def _transaction():
+    """Conexión del hilo para un bloque: commit al salir y rollback si falla.
+
+    La conexión se reutiliza entre llamadas, así que un error no puede dejar una
+    transacción abierta para la consulta siguiente del mismo hilo.
+    """
+    conn = _connect()
+    try:
+        yield conn
+        conn.commit()
+    except BaseException:
+        conn.rollback()
+        raise
+
+
+def close_connections():
+    """Cierra todas las conexiones del pool (al apagar la aplicación)."""
+    global _pool_generation
+    with _connections_lock:
+        conns = list(_all_connections)
+        _all_connections.clear()
+        _pool_generation += 1
+    for conn in conns:
+        try:
+            conn.close()
+        except Exception:
+            pass
+    _local.conn = None
+
+
+# --- Paginación keyset ---
+# Las listas se ordenan por (clave, id) descendente y la página siguiente se pide
+# con un cursor opaco que codifica la última fila: WHERE (clave, id) < (?, ?).
+# La clave puede ser NULL (ts, ingested_ts) y la comparación por filas con NULL
+# nunca es cierta, así que se pagina sobre ifnull(clave, ''): las filas sin clave
+# van al final y siguen apareciendo. El id desempata y nunca es NULL.
+# Cada página es una consulta independiente, así que un stream puede continuar en
+# otro hilo (con su propia conexión) sin compartir cursores SQLite.
+MEASUREMENTS_PAGE_KEYS = ('ts', 'id')
+ASSETS_PAGE_KEYS = ('ingested_ts', 'asset_id')
+DATES_PAGE_KEYS = ('date', 'id')
+
+
+def _encode_cursor(values):
+    raw = json.dumps(values, separators=(',', ':')).encode('utf-8')
+    return base64.urlsafe_b64encode(raw).decode('ascii').rstrip('=')
+
+
+def _decode_cursor(token, n):
+    try:
+        values = json.loads(base64.urlsafe_b64decode(token + '=' * (-len(token) % 4)))
+        if isinstance(values, list) and len(values) == n:
+            return values
+    except Exception:
+        pass
+    raise ValueError('cursor inválido')
+
+
+def _page_key_exprs(keys):
+    return [f"ifnull({k}, '')" for k in keys[:-1]] + [keys[-1]]
+
+
+def _keyset(clauses, params, keys, cursor):
+    """Añade la condición del cursor a clauses/params y retorna el ORDER BY."""
+    exprs = _page_key_exprs(keys)
+    if cursor:
+        values = _decode_cursor(cursor, len(keys))
+        values = ['' if v is None else v for v in values[:-1]] + values[-1:]
+        # La cota redundante sobre la primera clave permite buscar en el índice de
+        # expresión: SQLite no lo hace con la comparación por filas sola
+        clauses.append(f"{exprs[0]} <= ?")
+        clauses.append(f"({', '.join(exprs)}) < ({', '.join('?' for _ in keys)})")
+        params.extend([values[0]] + values)
+    return ' ORDER BY ' + ', '.join(f'{e} DESC' for e in exprs)
+
+
+def check_page_cursor(cursor, keys):
+    """Lanza ValueError si `cursor` no es un cursor válido para `keys`."""
+    if cursor:
+        _decode_cursor(cursor, len(keys))
+
+
+def next_page_cursor(rows, limit, keys):
+    """Cursor para la página siguiente, o None si `rows` fue la última."""
+    if not rows or not limit or len(rows) < limit:
+        return None
+    return _encode_cursor([rows[-1].get(k) for k in keys])
+
+
+def _iter_pages(list_fn, keys, batch_size, limit, cursor, **filters):
+    remaining = limit
+    while remaining is None or remaining > 0:
+        n = batch_size if remaining is None else min(batch_size, remaining)
+        rows = list_fn(limit=n, cursor=cursor, **filters)
+        yield from rows
+        if remaining is not None:
+            remaining -= len(rows)
+        cursor = next_page_cursor(rows, n, keys)
+        if not cursor:
+            return
+
+
 def insert_asset(asset_id: str, product: str = None, sensor: str = None, url_s3: str = None,
                  epsg: int = None, resolution_m: float = None, acquired_ts: str = None,
                  ingested_ts: str = None, footprint: Optional[dict] = None, bbox: Optional[list] = None,
                  min_val: float = None, max_val: float = None, mean_val: float = None, stddev_val: float = None,
                  cog_ok: bool = False, tenant_id: str = None, plot_id: str = None):
-    conn = _connect()
-    try:
+    insert_assets([dict(
+        asset_id=asset_id, product=product, sensor=sensor, url_s3=url_s3, epsg=epsg, resolution_m=resolution_m,
+        acquired_ts=acquired_ts, ingested_ts=ingested_ts, footprint=footprint, bbox=bbox, min_val=min_val,
+        max_val=max_val, mean_val=mean_val, stddev_val=stddev_val, cog_ok=cog_ok, tenant_id=tenant_id, plot_id=plot_id
+    )])
+
+
+_ASSET_FIELDS = ('asset_id', 'product', 'sensor', 'url_s3', 'epsg', 'resolution_m', 'acquired_ts', 'ingested_ts',
+                 'footprint', 'bbox', 'min_val', 'max_val', 'mean_val', 'stddev_val', 'cog_ok', 'tenant_id', 'plot_id')
+
+# Upsert (en vez de INSERT OR REPLACE) para conservar el rowid, que es la clave del R-tree
+_UPSERT_ASSET = f'''
+        INSERT INTO assets({', '.join(_ASSET_FIELDS)})
+        VALUES ({', '.join('?' for _ in _ASSET_FIELDS)})
+        ON CONFLICT(asset_id) DO UPDATE SET
+            {', '.join(f'{k} = excluded.{k}' for k in _ASSET_FIELDS[1:])}
+        '''
+
+
+def _asset_params(a: dict):
+    params = []
+    for k in _ASSET_FIELDS:
+        v = a.get(k)
+        if k in ('footprint', 'bbox'):
+            v = json.dumps(v) if v is not None else None
+        elif k == 'cog_ok':
+            v = 1 if v else 0
+        params.append(v)
+    return tuple(params)
+
+
+def _asset_bounds(a: dict):
+    """[west, south, east, north] de un asset a partir de bbox (lista o GeoJSON) o footprint."""
+    from utils_pkg.roi import geojson_bounds
+
+    for k in ('bbox', 'footprint'):
+        v = a.get(k)
+        if isinstance(v, str):
+            try:
+                v = json.loads(v)
+            except Exception:
+                continue
+        try:
+            if isinstance(v, (list, tuple)) and len(v) == 4:
+                return [float(x) for x in v]
+            if isinstance(v, dict):
+                b = geojson_bounds(v)
+                if b:
+                    return b
+        except Exception:
+            continue
+    return None
+
+
+def _index_asset_bounds(cur, assets):
+    rows = []
+    for a in assets:
+        b = _asset_bounds(a)
+        if b:
+            rows.append((a['asset_id'], b[0], b[2], b[1], b[3]))
+        else:
+            cur.execute('DELETE FROM assets_rtree WHERE id = (SELECT rowid FROM assets WHERE asset_id = ?)', (a['asset_id'],))
+    cur.executemany('''
+    INSERT OR REPLACE INTO assets_rtree(id, min_lon, max_lon, min_lat, max_lat)
+    SELECT rowid, ?, ?, ?, ? FROM assets WHERE asset_id = ?
+    ''', [(w, e, s_, n, asset_id) for asset_id, w, e, s_, n in rows])
+
+
+def insert_assets(assets: list):
+    """Inserta (o reemplaza) varios assets en una sola transacción.
+
+    Cada elemento es un dict con las mismas claves que los argumentos de insert_asset.
+    El índice espacial (assets_rtree) se actualiza en la misma transacción.
+    Retorna el número de filas escritas.
+    """
+    assets = [a for a in assets if a.get('asset_id')]
+    if not assets:
+        return 0
+    with _transaction() as conn:
         cur = conn.cursor()
-        cur.execute('''
-        INSERT OR REPLACE INTO assets(asset_id, product, sensor, url_s3, epsg, resolution_m, acquired_ts, ingested_ts, footprint, bbox, min_val, max_val, mean_val, stddev_val, cog_ok, tenant_id, plot_id)
-        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-        ''', (
-            asset_id, product, sensor, url_s3, epsg, resolution_m, acquired_ts, ingested_ts,
-            json.dumps(footprint) if footprint is not None else None,
-            json.dumps(bbox) if bbox is not None else None,
-            min_val, max_val, mean_val, stddev_val, 1 if cog_ok else 0, tenant_id, plot_id
-        ))
-        conn.commit()
-    finally:
-        conn.close()
+        cur.executemany(_UPSERT_ASSET, [_asset_params(a) for a in assets])
+        _index_asset_bounds(cur, assets)
+        return len(assets)
+
+
+def _rtree_clauses(bbox, relation):
+    """Condiciones sobre un R-tree `r` para extensiones que intersectan o cubren el bbox."""
+    w, s_, e, n = [float(x) for x in bbox]
+    clauses = ['r.min_lon <= ?', 'r.max_lon >= ?', 'r.min_lat <= ?', 'r.max_lat >= ?']
+    if relation == 'covers':
+        return clauses, [w, e, s_, n]
+    if relation == 'intersects':
+        return clauses, [e, w, n, s_]
+    raise ValueError("relation debe ser 'intersects' o 'covers'")
+
+
+def search_assets(bbox: list = None, geometry: dict = None, relation: str = 'intersects', product: str = None,
+                  tenant_id: str = None, plot_id: str = None, limit: int = 100):
+    """Assets cuya extensión intersecta (relation='intersects') o cubre por completo
+    (relation='covers') un bbox [west, south, east, north] o una geometría GeoJSON.
+
+    El R-tree filtra por bounds; con `geometry` se refina con shapely sobre el
+    footprint (o bbox) de cada candidato.
+    """
+    if geometry is not None and bbox is None:
+        from utils_pkg.roi import geojson_bounds
+        bbox = geojson_bounds(geometry)
+    if not bbox:
+        raise ValueError('se requiere bbox o geometry')
+    clauses, params = _rtree_clauses(bbox, relation)
+    for col, val in (('product', product), ('tenant_id', tenant_id), ('plot_id', plot_id)):
+        if val:
+            clauses.append(f'a.{col} = ?')
+            params.append(val)
+
+    with _transaction() as conn:
+        cur = conn.cursor()
+        q = 'SELECT a.* FROM assets_rtree r JOIN assets a ON a.rowid = r.id WHERE ' + ' AND '.join(clauses)
+        q += ' ORDER BY a.ingested_ts DESC'
+        # Sin refinado exacto el LIMIT va en SQL; con geometría se aplica tras filtrar
+        if geometry is None:
+            q += ' LIMIT ?'
+            params.append(limit)
+        cur.execute(q, tuple(params))
+        rows = cur.fetchall()
+
+    results = [_asset_row(r) for r in rows]
+    if geometry is None:
+        return results
+
+    from shapely.geometry import shape, box
+    target = shape(geometry)
+    matched = []
+    for d in results:
+        extent = d.get('footprint') or d.get('bbox')
+        try:
+            if isinstance(extent, (list, tuple)):
+                extent_shape = box(*extent)
+            else:
+                extent_shape = shape(extent)
+            ok = extent_shape.covers(target) if relation == 'covers' else extent_shape.intersects(target)
+        except Exception:
+            ok = True  # sin geometría interpretable, quedarse con el resultado del R-tree
+        if ok:
+            matched.append(d)
+            if len(matched) >= limit:
+                break
+    return matched
 
 
 def get_asset(asset_id: str):
-    conn = _connect()
-    try:
+    with _transaction() as conn:
         cur = conn.cursor()
         cur.execute('SELECT * FROM assets WHERE asset_id = ?', (asset_id,))
         row = cur.fetchone()
         if not row:
             return None
-        d = dict(row)
-        # parse JSON fields
-        try:
-            d['footprint'] = json.loads(d['footprint']) if d.get('footprint') else None
-        except Exception:
-            d['footprint'] = d.get('footprint')
-        try:
-            d['bbox'] = json.loads(d['bbox']) if d.get('bbox') else None
-        except Exception:
-            d['bbox'] = d.get('bbox')
-        # cast cog_ok
-        try:
-            d['cog_ok'] = bool(d.get('cog_ok'))
-        except Exception:
-            d['cog_ok'] = False
-        return d
-    finally:
-        conn.close()
+        return _asset_row(row)
 
 
-def list_assets(tenant_id: str = None, plot_id: str = None, limit: int = 100):
-    conn = _connect()
+def _asset_row(row):
+    d = dict(row)
+    # parse JSON fields
+    try:
+        d['footprint'] = json.loads(d['footprint']) if d.get('footprint') else None
+    except Exception:
+        d['footprint'] = d.get('footprint')
+    try:
+        d['bbox'] = json.loads(d['bbox']) if d.get('bbox') else None
+    except Exception:
+        d['bbox'] = d.get('bbox')
+    # cast cog_ok
     try:
+        d['cog_ok'] = bool(d.get('cog_ok'))
+    except Exception:
+        d['cog_ok'] = False
+    return d
+
+
+def list_assets(tenant_id: str = None, plot_id: str = None, limit: int = 100, cursor: str = None):
+    """Assets más recientes primero; `cursor` (de next_page_cursor) continúa la página anterior."""
+    with _transaction() as conn:
         cur = conn.cursor()
         q = 'SELECT * FROM assets'
         params = []
@@ -138,72 +696,84 @@ def list_assets(tenant_id: str = None, plot_id: str = None, limit: int = 100):
         if plot_id:
             clauses.append('plot_id = ?')
             params.append(plot_id)
+        order = _keyset(clauses, params, ASSETS_PAGE_KEYS, cursor)
         if clauses:
             q += ' WHERE ' + ' AND '.join(clauses)
-        q += ' ORDER BY ingested_ts DESC LIMIT ?'
+        q += order + ' LIMIT ?'
         params.append(limit)
         cur.execute(q, tuple(params))
-        rows = cur.fetchall()
-        results = []
-        for r in rows:
-            d = dict(r)
-            try:
-                d['footprint'] = json.loads(d['footprint']) if d.get('footprint') else None
-            except Exception:
-                d['footprint'] = d.get('footprint')
-            try:
-                d['bbox'] = json.loads(d['bbox']) if d.get('bbox') else None
-            except Exception:
-                d['bbox'] = d.get('bbox')
-            try:
-                d['cog_ok'] = bool(d.get('cog_ok'))
-            except Exception:
-                d['cog_ok'] = False
-            results.append(d)
-        return results
-    finally:
-        conn.close()
+        return [_asset_row(r) for r in cur.fetchall()]
+
+
+def iter_assets(tenant_id: str = None, plot_id: str = None, limit: int = None, cursor: str = None, batch_size: int = 1000):
+    """Recorre los assets por páginas keyset de `batch_size` sin cargarlos todos en memoria."""
+    return _iter_pages(list_assets, ASSETS_PAGE_KEYS, batch_size, limit, cursor, tenant_id=tenant_id, plot_id=plot_id)
+
+
+# Upsert por clave natural: repetir una serie actualiza los valores en lugar de duplicarlos
+# (las filas sin plot_id se insertan siempre)
+_UPSERT_MEASUREMENT = f'''
+        INSERT INTO measurements(metric_id, tenant_id, plot_id, ts, metric_type, value, quality)
+        VALUES (?, ?, ?, ?, ?, ?, ?)
+        ON CONFLICT({MEASUREMENTS_NATURAL_KEY}) WHERE {MEASUREMENTS_NATURAL_KEY_WHERE} DO UPDATE SET
+            value = excluded.value,
+            quality = coalesce(excluded.quality, measurements.quality),
+            metric_id = coalesce(excluded.metric_id, measurements.metric_id)
+        '''
 
 
 def insert_measurement(metric_id: str = None, tenant_id: str = None, plot_id: str = None,
                        ts: str = None, metric_type: str = None, value: float = None, quality: str = None):
-    conn = _connect()
-    try:
+    with _transaction() as conn:
         cur = conn.cursor()
-        cur.execute('''
-        INSERT INTO measurements(metric_id, tenant_id, plot_id, ts, metric_type, value, quality)
-        VALUES (?, ?, ?, ?, ?, ?, ?)
-        ''', (metric_id, tenant_id, plot_id, ts, metric_type, value, quality))
-        conn.commit()
-        return cur.lastrowid
-    finally:
-        conn.close()
+        cur.execute(_UPSERT_MEASUREMENT + ' RETURNING id', (metric_id, tenant_id, plot_id, ts, metric_type, value, quality))
+        row = cur.fetchone()
+        return row[0] if row else None
+
+
+
+def insert_measurements(measurements: list):
+    """Inserta (o actualiza, por clave natural) varias mediciones en una sola transacción.
 
+    Cada elemento es un dict con claves metric_id, tenant_id, plot_id, ts,
+    metric_type, value y quality (las ausentes quedan en NULL). Retorna el número
+    de filas insertadas.
+    """
+    rows = [
+        (m.get('metric_id'), m.get('tenant_id'), m.get('plot_id'), m.get('ts'), m.get('metric_type'), m.get('value'), m.get('quality'))
+        for m in measurements
+    ]
+    if not rows:
+        return 0
+    with _transaction() as conn:
+        cur = conn.cursor()
+        cur.executemany(_UPSERT_MEASUREMENT, rows)
+        return len(rows)
 
 def get_measurement(metric_id: str):
     if metric_id is None:
         return None
-    conn = _connect()
-    try:
+    with _transaction() as conn:
         cur = conn.cursor()
         cur.execute('SELECT * FROM measurements WHERE metric_id = ? LIMIT 1', (metric_id,))
         row = cur.fetchone()
         if not row:
             return None
-        d = dict(row)
-        # convert types
-        try:
-            d['value'] = float(d['value']) if d.get('value') is not None else None
-        except Exception:
-            d['value'] = d.get('value')
-        return d
-    finally:
-        conn.close()
+        return _measurement_row(row)
 
 
-def list_measurements(plot_id: str = None, metric_type: str = None, limit: int = 500):
-    conn = _connect()
+def _measurement_row(row):
+    d = dict(row)
     try:
+        d['value'] = float(d['value']) if d.get('value') is not None else None
+    except Exception:
+        d['value'] = d.get('value')
+    return d
+
+
+def list_measurements(plot_id: str = None, metric_type: str = None, limit: int = 500, cursor: str = None):
+    """Mediciones más recientes primero; `cursor` (de next_page_cursor) continúa la página anterior."""
+    with _transaction() as conn:
         cur = conn.cursor()
         q = 'SELECT * FROM measurements'
         clauses = []
@@ -214,23 +784,18 @@ def list_measurements(plot_id: str = None, metric_type: str = None, limit: int =
         if metric_type:
             clauses.append('metric_type = ?')
             params.append(metric_type)
+        order = _keyset(clauses, params, MEASUREMENTS_PAGE_KEYS, cursor)
         if clauses:
             q += ' WHERE ' + ' AND '.join(clauses)
-        q += ' ORDER BY ts DESC LIMIT ?'
+        q += order + ' LIMIT ?'
         params.append(limit)
         cur.execute(q, tuple(params))
-        rows = cur.fetchall()
-        results = []
-        for r in rows:
-            d = dict(r)
-            try:
-                d['value'] = float(d['value']) if d.get('value') is not None else None
-            except Exception:
-                d['value'] = d.get('value')
-            results.append(d)
-        return results
-    finally:
-        conn.close()
+        return [_measurement_row(r) for r in cur.fetchall()]
+
+
+def iter_measurements(plot_id: str = None, metric_type: str = None, limit: int = None, cursor: str = None, batch_size: int = 1000):
+    """Recorre las mediciones por páginas keyset de `batch_size` sin cargarlas todas en memoria."""
+    return _iter_pages(list_measurements, MEASUREMENTS_PAGE_KEYS, batch_size, limit, cursor, plot_id=plot_id, metric_type=metric_type)
 
 
 def insert_sentinel2_date(geometry_id: str, user_id: str = None, date: str = None,
@@ -251,8 +816,7 @@ def insert_sentinel2_date(geometry_id: str, user_id: str = None, date: str = Non
     Returns:
         int: ID de la fila insertada o None si ya existe (UNIQUE constraint)
     """
-    conn = _connect()
-    try:
+    with _transaction() as conn:
         cur = conn.cursor()
         cur.execute('''
         INSERT OR IGNORE INTO sentinel2_dates(geometry_id, user_id, date, system_time_start, cloud_cover, tile_id, roi_geojson)
@@ -266,13 +830,49 @@ def insert_sentinel2_date(geometry_id: str, user_id: str = None, date: str = Non
             tile_id,
             json.dumps(roi_geojson) if roi_geojson is not None else None
         ))
-        conn.commit()
         return cur.lastrowid if cur.lastrowid > 0 else None
-    finally:
-        conn.close()
 
 
-def get_sentinel2_dates(geometry_id: str = None, user_id: str = None, start_date: str = None, end_date: str = None, limit: int = 500):
+
+def insert_sentinel2_dates(geometry_id: str, dates: list, user_id: str = None, roi_geojson: dict = None):
+    """
+    Inserta varias fechas de Sentinel-2 de una geometría en una sola transacción.
+
+    Args:
+        geometry_id: hash único que identifica la geometría
+        dates: lista de dicts con date, system_time_start, cloud_cover y tile_id
+        user_id: ID del usuario que realizó la consulta
+        roi_geojson: geometría en formato GeoJSON (dict), se serializa una sola vez
+
+    Returns:
+        int: número de fechas nuevas (las ya existentes se ignoran por el UNIQUE)
+    """
+    roi_json = json.dumps(roi_geojson) if roi_geojson is not None else None
+    rows = [
+        (geometry_id, user_id, d.get('date'), d.get('system_time_start'), d.get('cloud_cover'), d.get('tile_id'), roi_json)
+        for d in dates if d.get('date')
+    ]
+    if not rows:
+        return 0
+    with _transaction() as conn:
+        before = conn.total_changes
+        cur = conn.cursor()
+        cur.executemany('''
+        INSERT OR IGNORE INTO sentinel2_dates(geometry_id, user_id, date, system_time_start, cloud_cover, tile_id, roi_geojson)
+        VALUES (?, ?, ?, ?, ?, ?, ?)
+        ''', rows)
+        return conn.total_changes - before
+
+def _date_row(row):
+    d = dict(row)
+    try:
+        d['roi_geojson'] = json.loads(d['roi_geojson']) if d.get('roi_geojson') else None
+    except Exception:
+        d['roi_geojson'] = d.get('roi_geojson')
+    return d
+
+
+def get_sentinel2_dates(geometry_id: str = None, user_id: str = None, start_date: str = None, end_date: str = None, limit: int = 500, cursor: str = None):
     """
     Obtiene fechas de Sentinel-2 almacenadas en BD.
     
@@ -282,12 +882,12 @@ def get_sentinel2_dates(geometry_id: str = None, user_id: str = None, start_date
         start_date: fecha inicial (YYYY-MM-DD)
         end_date: fecha final (YYYY-MM-DD)
         limit: máximo número de resultados
+        cursor: continuación devuelta por next_page_cursor para la página siguiente
     
     Returns:
         List[dict]: lista de fechas con metadata
     """
-    conn = _connect()
-    try:
+    with _transaction() as conn:
         cur = conn.cursor()
         q = 'SELECT * FROM sentinel2_dates'
         clauses = []
@@ -304,23 +904,283 @@ def get_sentinel2_dates(geometry_id: str = None, user_id: str = None, start_date
         if end_date:
             clauses.append('date <= ?')
             params.append(end_date)
+        order = _keyset(clauses, params, DATES_PAGE_KEYS, cursor)
         if clauses:
             q += ' WHERE ' + ' AND '.join(clauses)
-        q += ' ORDER BY date DESC LIMIT ?'
+        q += order + ' LIMIT ?'
         params.append(limit)
         cur.execute(q, tuple(params))
+        return [_date_row(r) for r in cur.fetchall()]
+
+
+def iter_sentinel2_dates(geometry_id: str = None, user_id: str = None, start_date: str = None, end_date: str = None,
+                         limit: int = None, cursor: str = None, batch_size: int = 1000):
+    """Recorre las fechas guardadas por páginas keyset de `batch_size`."""
+    return _iter_pages(get_sentinel2_dates, DATES_PAGE_KEYS, batch_size, limit, cursor,
+                       geometry_id=geometry_id, user_id=user_id, start_date=start_date, end_date=end_date)
+
+
+def sentinel2_dates_in_range(geometry_id: str, start: str, end: str, max_cloud: float = None):
+    """Fechas guardadas de una geometría en [start, end), en orden cronológico.
+
+    Con `max_cloud` solo se devuelven las imágenes con cloud_cover <= max_cloud
+    (las que no tienen cobertura registrada solo si max_cloud >= 100).
+    """
+    with _transaction() as conn:
+        cur = conn.cursor()
+        q = 'SELECT * FROM sentinel2_dates WHERE geometry_id = ? AND date >= ? AND date < ?'
+        params = [geometry_id, start, end]
+        if max_cloud is not None:
+            q += ' AND (cloud_cover <= ? OR (cloud_cover IS NULL AND ? >= 100))'
+            params.extend([max_cloud, max_cloud])
+        q += ' ORDER BY date, system_time_start, tile_id'
+        cur.execute(q, tuple(params))
+        return [_date_row(r) for r in cur.fetchall()]
+
+
+def get_coverage(dataset: str, key: str, start: str, end: str, param: float = None, min_param: float = None):
+    """Intervalos [start, end) registrados para (dataset, key) que solapan [start, end).
+
+    `param` exige ese valor exacto; `min_param` acepta cualquiera >= min_param.
+    """
+    with _transaction() as conn:
+        cur = conn.cursor()
+        q = 'SELECT start, end FROM fetch_coverage WHERE dataset = ? AND key = ? AND start < ? AND end > ?'
+        params = [dataset, key, end, start]
+        if param is not None:
+            q += ' AND param = ?'
+            params.append(param)
+        if min_param is not None:
+            q += ' AND param >= ?'
+            params.append(min_param)
+        q += ' ORDER BY start'
+        cur.execute(q, tuple(params))
+        return [(r['start'], r['end']) for r in cur.fetchall()]
+
+
+def add_coverage(dataset: str, key: str, start: str, end: str, param: float = None):
+    """Registra [start, end) como consultado, fusionándolo con los intervalos que solapa o toca."""
+    with _transaction() as conn:
+        cur = conn.cursor()
+        param_clause = 'param IS ?' if param is None else 'param = ?'
+        cur.execute(f'''
+        SELECT rowid, start, end FROM fetch_coverage
+        WHERE dataset = ? AND key = ? AND {param_clause} AND start <= ? AND end >= ?
+        ''', (dataset, key, param, end, start))
         rows = cur.fetchall()
-        results = []
-        for r in rows:
-            d = dict(r)
-            try:
-                d['roi_geojson'] = json.loads(d['roi_geojson']) if d.get('roi_geojson') else None
-            except Exception:
-                d['roi_geojson'] = d.get('roi_geojson')
-            results.append(d)
-        return results
-    finally:
-        conn.close()
+        if rows:
+            start = min([start] + [r['start'] for r in rows])
+            end = max([end] + [r['end'] for r in rows])
+            cur.executemany('DELETE FROM fetch_coverage WHERE rowid = ?', [(r['rowid'],) for r in rows])
+        cur.execute('INSERT INTO fetch_coverage(dataset, key, param, start, end) VALUES (?, ?, ?, ?, ?)',
+                    (dataset, key, param, start, end))
+
+
+def insert_series_points(series_key: str, points: list):
+    """Guarda (o actualiza) las pasadas de una serie en una sola transacción.
+
+    Cada punto es un dict con image_id, ts ('YYYY-MM-DD' UTC), system_time_start,
+    value y cloud_cover. Retorna el número de puntos escritos.
+    """
+    rows = [
+        (series_key, p['image_id'], p['ts'], p['system_time_start'], p.get('value'), p.get('cloud_cover'))
+        for p in points
+    ]
+    if not rows:
+        return 0
+    with _transaction() as conn:
+        cur = conn.cursor()
+        cur.executemany('''
+        INSERT INTO series_points(series_key, image_id, ts, system_time_start, value, cloud_cover)
+        VALUES (?, ?, ?, ?, ?, ?)
+        ON CONFLICT(series_key, image_id) DO UPDATE SET
+            value = excluded.value,
+            cloud_cover = excluded.cloud_cover
+        ''', rows)
+        return len(rows)
+
+
+def series_points_in_range(series_key: str, start: str, end: str, max_cloud: float = None):
+    """Pasadas guardadas de una serie en [start, end), en orden cronológico.
+
+    Con `max_cloud` solo las de cloud_cover < max_cloud (mismo criterio que el
+    filtro CLOUDY_PIXEL_PERCENTAGE de EE).
+    """
+    with _transaction() as conn:
+        cur = conn.cursor()
+        q = 'SELECT * FROM series_points WHERE series_key = ? AND ts >= ? AND ts < ?'
+        params = [series_key, start, end]
+        if max_cloud is not None:
+            q += ' AND cloud_cover < ?'
+            params.append(max_cloud)
+        q += ' ORDER BY system_time_start, image_id'
+        cur.execute(q, tuple(params))
+        return [dict(r) for r in cur.fetchall()]
+
+
+_PLOT_JSON_FIELDS = ('feature_collection', 'geometry', 'simplified', 'simplified_report', 'bounds', 'features')
+
+
+def upsert_plot(plot: dict):
+    """Guarda (o reemplaza) una parcela del registro y su extensión en plots_rtree; los campos GeoJSON/listas se serializan a JSON."""
+    row = {k: (json.dumps(plot.get(k), ensure_ascii=False) if k in _PLOT_JSON_FIELDS and plot.get(k) is not None else plot.get(k))
+           for k in ('plot_id', 'fingerprint', 'feature_collection', 'geometry', 'simplified', 'simplified_report',
+                     'bounds', 'area_m2', 'perimeter_m', 'features', 'features_count')}
+    with _transaction() as conn:
+        cur = conn.cursor()
+        cur.execute('''
+        INSERT INTO plots(plot_id, fingerprint, feature_collection, geometry, simplified, simplified_report, bounds, area_m2, perimeter_m, features, features_count)
+        VALUES (:plot_id, :fingerprint, :feature_collection, :geometry, :simplified, :simplified_report, :bounds, :area_m2, :perimeter_m, :features, :features_count)
+        ON CONFLICT(plot_id) DO UPDATE SET
+            fingerprint = excluded.fingerprint,
+            feature_collection = excluded.feature_collection,
+            geometry = excluded.geometry,
+            simplified = excluded.simplified,
+            simplified_report = excluded.simplified_report,
+            bounds = excluded.bounds,
+            area_m2 = excluded.area_m2,
+            perimeter_m = excluded.perimeter_m,
+            features = excluded.features,
+            features_count = excluded.features_count
+        ''', row)
+        # Índice espacial en la misma transacción (el upsert conserva el rowid)
+        _index_plot_bounds(cur, [plot])
+
+
+def _plot_bounds(plot: dict):
+    """[west, south, east, north] de todas las features de una parcela (o de su ROI)."""
+    boxes = [f['bounds'] for f in plot.get('features') or [] if isinstance(f, dict) and f.get('bounds')]
+    if plot.get('bounds'):
+        boxes.append(plot['bounds'])
+    if not boxes:
+        return None
+    return [min(b[0] for b in boxes), min(b[1] for b in boxes), max(b[2] for b in boxes), max(b[3] for b in boxes)]
+
+
+def _index_plot_bounds(cur, plots):
+    rows = []
+    for p in plots:
+        b = _plot_bounds(p)
+        if b:
+            rows.append((b[0], b[2], b[1], b[3], p['plot_id']))
+        else:
+            cur.execute('DELETE FROM plots_rtree WHERE id = (SELECT rowid FROM plots WHERE plot_id = ?)', (p['plot_id'],))
+    cur.executemany('''
+    INSERT OR REPLACE INTO plots_rtree(id, min_lon, max_lon, min_lat, max_lat)
+    SELECT rowid, ?, ?, ?, ? FROM plots WHERE plot_id = ?
+    ''', rows)
+
+
+_PLOT_SUMMARY_FIELDS = ('plot_id', 'fingerprint', 'bounds', 'area_m2', 'perimeter_m', 'features_count', 'created_at')
+
+
+def search_plots(bbox: list, relation: str = 'intersects', limit: int = 100):
+    """Parcelas registradas cuya extensión intersecta o cubre un bbox [west, south, east, north].
+
+    Retorna solo el resumen de cada parcela (sin geometrías); la parcela completa
+    se obtiene con get_plot.
+    """
+    clauses, params = _rtree_clauses(bbox, relation)
+    with _transaction() as conn:
+        cur = conn.cursor()
+        cols = ', '.join(f'p.{k}' for k in _PLOT_SUMMARY_FIELDS)
+        cur.execute(f'SELECT {cols} FROM plots_rtree r JOIN plots p ON p.rowid = r.id WHERE '
+                    + ' AND '.join(clauses) + ' ORDER BY p.created_at DESC LIMIT ?', tuple(params) + (limit,))
+        rows = [dict(r) for r in cur.fetchall()]
+    for d in rows:
+        d['bounds'] = json.loads(d['bounds']) if d.get('bounds') else None
+    return rows
+
 
+def get_plot(plot_id: str):
+    if plot_id is None:
+        return None
+    with _transaction() as conn:
+        cur = conn.cursor()
+        cur.execute('SELECT * FROM plots WHERE plot_id = ?', (plot_id,))
+        row = cur.fetchone()
+        if not row:
+            return None
+        d = dict(row)
+        for k in _PLOT_JSON_FIELDS:
+            if d.get(k) is not None:
+                d[k] = json.loads(d[k])
+        return d
+
+
+def _job_row(row):
+    d = dict(row)
+    for k in ('payload', 'result'):
+        try:
+            d[k] = json.loads(d[k]) if d.get(k) else None
+        except Exception:
+            d[k] = d.get(k)
+    return d
+
+
+def insert_job(job_id: str, kind: str, payload: dict = None, status: str = 'queued', owner: str = None):
+    with _transaction() as conn:
+        cur = conn.cursor()
+        cur.execute('''
+        INSERT INTO jobs(job_id, kind, status, payload, owner)
+        VALUES (?, ?, ?, ?, ?)
+        ''', (job_id, kind, status, json.dumps(payload) if payload is not None else None, owner))
+
+
+def claim_job(job_id: str, owner: str, expected_owner: str = None, statuses=('queued', 'running'), **fields):
+    """Pasa el job a `owner` (status='queued') si sigue en `statuses` y su dueño es
+    `expected_owner`. Retorna True solo para quien lo consiguió: dos procesos que
+    leyeron el mismo job no pueden reclamarlo ambos."""
+    fields = {k: v for k, v in fields.items() if k in _JOB_COLUMNS and k != 'status'}
+    assignments = ''.join(f', {k} = ?' for k in fields)
+    with _transaction() as conn:
+        cur = conn.cursor()
+        cur.execute(f'''
+        UPDATE jobs SET status = 'queued', owner = ?{assignments}
+        WHERE job_id = ? AND status IN ({', '.join('?' for _ in statuses)}) AND ifnull(owner, '') = ?
+        ''', (owner,) + tuple(fields.values()) + (job_id,) + tuple(statuses) + (expected_owner or '',))
+        return cur.rowcount == 1
 
-# insert_asset, get_asset, list_assets, insert_measurement should be copied from original db.py as needed
+
+_JOB_COLUMNS = ('status', 'progress', 'total', 'message', 'result', 'error', 'started_at', 'finished_at')
+
+
+def update_job(job_id: str, **fields):
+    """Actualiza las columnas indicadas de un job (result se guarda como JSON)."""
+    fields = {k: v for k, v in fields.items() if k in _JOB_COLUMNS}
+    if not fields:
+        return
+    if 'result' in fields and fields['result'] is not None:
+        fields['result'] = json.dumps(fields['result'])
+    with _transaction() as conn:
+        cur = conn.cursor()
+        assignments = ', '.join(f'{k} = ?' for k in fields)
+        cur.execute(f'UPDATE jobs SET {assignments} WHERE job_id = ?', tuple(fields.values()) + (job_id,))
+
+
+def get_job(job_id: str):
+    with _transaction() as conn:
+        cur = conn.cursor()
+        cur.execute('SELECT * FROM jobs WHERE job_id = ?', (job_id,))
+        row = cur.fetchone()
+        return _job_row(row) if row else None
+
+
+def list_jobs(status: Optional[list] = None, kind: str = None, limit: int = 100):
+    with _transaction() as conn:
+        cur = conn.cursor()
+        q = 'SELECT * FROM jobs'
+        clauses = []
+        params = []
+        if status:
+            clauses.append('status IN (' + ', '.join('?' for _ in status) + ')')
+            params.extend(status)
+        if kind:
+            clauses.append('kind = ?')
+            params.append(kind)
+        if clauses:
+            q += ' WHERE ' + ' AND '.join(clauses)
+        q += ' ORDER BY created_at DESC LIMIT ?'
+        params.append(limit)
+        cur.execute(q, tuple(params))
+        return [_job_row(r) for r in cur.fetchall()]
@@ -0,0 +1,77 @@
+"""Helpers para reducir y contabilizar los round trips a Earth Engine.
+
+- `EEBundle` agrupa varios resultados escalares de una petición en un único
+  `ee.Dictionary` que se evalúa con un solo `getInfo`.
+- `get_info` / `get_map_id` envuelven las llamadas bloqueantes y las cuentan en
+  el contador de la petición actual (ver middleware en app.py, header
+  `X-EE-Roundtrips`).
+"""
+import contextvars
+import ee
+
+ROUNDTRIPS_HEADER = 'X-EE-Roundtrips'
+
+# Contador mutable por petición; se comparte con los hilos del threadpool porque
+# el contexto copiado apunta al mismo dict.
+_roundtrips = contextvars.ContextVar('ee_roundtrips', default=None)
+
+
+def start_roundtrip_counter():
+    counter = {'count': 0}
+    _roundtrips.set(counter)
+    return counter
+
+
+def record_roundtrip(n=1):
+    counter = _roundtrips.get()
+    if counter is not None:
+        counter['count'] += n
+
+
+def roundtrip_count():
+    counter = _roundtrips.get()
+    return counter['count'] if counter is not None else 0
+
+
+def get_info(obj):
+    """`obj.getInfo()` contabilizado. Valores Python se devuelven tal cual."""
+    if not hasattr(obj, 'getInfo'):
+        return obj
+    record_roundtrip()
+    return obj.getInfo()
+
+
+def get_map_id(image, vis_params=None):
+    """`image.getMapId(vis_params)` contabilizado."""
+    record_roundtrip()
+    return image.getMapId(vis_params)
+
+
+class EEBundle:
+    """Acumula objetos EE por clave y los evalúa juntos en un único getInfo.
+
+    Si la evaluación conjunta falla (p.ej. una reducción inválida), cada parte se
+    evalúa por separado para no perder el resto; las que fallen quedan en None.
+    """
+
+    def __init__(self):
+        self._items = {}
+
+    def add(self, key, value):
+        self._items[key] = value
+        return self
+
+    def evaluate(self):
+        if not self._items:
+            return {}
+        try:
+            return get_info(ee.Dictionary(self._items)) or {}
+        except Exception as e:
+            print(f"EEBundle: evaluación conjunta falló ({e}); evaluando por separado")
+        out = {}
+        for key, value in self._items.items():
+            try:
+                out[key] = get_info(value)
+            except Exception:
+                out[key] = None
+        return out
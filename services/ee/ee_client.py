@@ -4,9 +4,7 @@ import math
 import ee
 from google.oauth2 import service_account
 from dotenv import load_dotenv
-import xml.etree.ElementTree as ET
-from shapely.geometry import Polygon, mapping
-import re
+from utils_pkg.kml import parse_kml_string
 
 # Cargar variables del archivo .env automáticamente
 load_dotenv()
@@ -33,101 +31,12 @@ def init_ee():
 
 # Import index computations from ee_indices (keeps compatibility)
 from services.ee.ee_indices import compute_sentinel2_index
+from services.ee.ee_batch import get_info
 
 # --------- Utilidades para KML ---------
 def parse_kml_to_geojson(kml_content: str):
-    root = ET.fromstring(kml_content)
-    coordinates_elements = []
-    for elem in root.iter():
-        if elem.tag.endswith('coordinates') or 'coordinates' in elem.tag:
-            if elem.text and elem.text.strip():
-                coordinates_elements.append(elem.text.strip())
-    if not coordinates_elements:
-        return {
-            "success": False,
-            "message": "No se encontraron coordenadas válidas en el archivo KML",
-            "geometry": None,
-            "features_count": 0,
-            "area_hectares": 0,
-            "bounds": None
-        }
-    features = []
-    total_area = 0
-    bounds = {"north": -90, "south": 90, "east": -180, "west": 180}
-    for coord_text in coordinates_elements:
-        try:
-            coord_text = re.sub(r'\s+', ' ', coord_text.strip())
-            coord_pairs = coord_text.split()
-            if len(coord_pairs) < 3:
-                continue
-            coordinates = []
-            for pair in coord_pairs:
-                parts = pair.split(',')
-                if len(parts) >= 2:
-                    try:
-                        lon = float(parts[0])
-                        lat = float(parts[1])
-                        coordinates.append([lon, lat])
-                    except ValueError:
-                        continue
-            if len(coordinates) < 3:
-                continue
-            if coordinates[0] != coordinates[-1]:
-                coordinates.append(coordinates[0])
-            polygon = Polygon(coordinates)
-            if not polygon.is_valid:
-                polygon = polygon.buffer(0)
-            if not polygon.is_valid:
-                continue
-            area_sq_degrees = polygon.area
-            area_sq_meters = area_sq_degrees * 111000 * 111000
-            area_hectares = area_sq_meters / 10000
-            total_area += area_hectares
-            geom_bounds = polygon.bounds
-            bounds["west"] = min(bounds["west"], geom_bounds[0])
-            bounds["south"] = min(bounds["south"], geom_bounds[1])
-            bounds["east"] = max(bounds["east"], geom_bounds[2])
-            bounds["north"] = max(bounds["north"], geom_bounds[3])
-            geojson_geom = mapping(polygon)
-            features.append({
-                "type": "Feature",
-                "properties": {
-                    "name": f"Parcela {len(features) + 1}",
-                    "description": "Extraído de archivo KML",
-                    "area_hectares": round(area_hectares, 2)
-                },
-                "geometry": geojson_geom
-            })
-        except Exception as e:
-            continue
-    if not features:
-        return {
-            "success": False,
-            "message": "No se pudieron procesar las coordenadas del archivo KML",
-            "geometry": None,
-            "features_count": 0,
-            "area_hectares": 0,
-            "bounds": None
-        }
-    # Si hay múltiples polígonos, construir MultiPolygon como geometría principal
-    if len(features) > 1:
-        try:
-            from shapely.geometry import MultiPolygon
-            multip = MultiPolygon([Polygon(f['geometry']['coordinates'][0]) if f['geometry']['type']=='Polygon' else Polygon(f['geometry']['coordinates'][0][0]) for f in features])
-            main_geometry = mapping(multip)
-        except Exception:
-            main_geometry = features[0]["geometry"]
-    else:
-        main_geometry = features[0]["geometry"]
-    return {
-        "success": True,
-        "message": f"KML procesado correctamente. {len(features)} polígono(s) encontrado(s).",
-        "geometry": main_geometry,
-        "features_count": len(features),
-        "area_hectares": round(total_area, 2),
-        "bounds": bounds,
-        "features": features
-    }
+    """Extrae los polígonos de un KML (str o bytes; bytes también admite KMZ). Ver utils_pkg.kml."""
+    return parse_kml_string(kml_content)
 
 
 def composite_embedding(roi, start, end, cloud_pct=None):
@@ -165,91 +74,220 @@ def get_sentinel2_collection(roi, start, end, cloud_pct=30):
             .filter(ee.Filter.lt('CLOUDY_PIXEL_PERCENTAGE', cloud_pct))
             .map(maskS2clouds))
 
-def get_sentinel2_time_series(roi, start, end, index, cloud_pct=70):
+def _series_index_band(img, index):
+    idx = index.lower()
+    if idx == 'ndvi':
+        return img.addBands(img.normalizedDifference(['B8', 'B4']).rename(index))
+    elif idx == 'ndwi':
+        return img.addBands(img.normalizedDifference(['B3', 'B8']).rename(index))
+    elif idx == 'ndmi':
+        return img.addBands(img.normalizedDifference(['B8', 'B11']).rename(index))
+    elif idx == 'evi':
+        evi = img.normalizedDifference(['B8', 'B4']).multiply(2.5).rename(index)
+        return img.addBands(evi)
+    elif idx == 'savi':
+        savi = img.normalizedDifference(['B8', 'B4']).multiply(1.5).rename(index)
+        return img.addBands(savi)
+    else:
+        return img.addBands(img.normalizedDifference(['B8', 'B4']).rename(index))
+
+
+def _series_passes(roi, date_filter, index, threshold, scale=60, max_pixels=1e5):
+    """(tamaño, FeatureCollection) con la media del índice en cada pasada, sin evaluar."""
+    def simple_cloud_mask(img):
+        scl = img.select('SCL')
+        mask = scl.neq(9).And(scl.neq(10))
+        return img.updateMask(mask)
+
+    def pass_mean(img):
+        stats = _series_index_band(simple_cloud_mask(img), index).select(index).reduceRegion(
+            reducer=ee.Reducer.mean(), geometry=roi, scale=scale, maxPixels=max_pixels, bestEffort=True)
+        return ee.Feature(None, {
+            't': img.get('system:time_start'),
+            'mean': stats.get(index),
+            'id': img.get('system:index'),
+            'cloud': img.get('CLOUDY_PIXEL_PERCENTAGE'),
+        })
+
+    collection = (ee.ImageCollection('COPERNICUS/S2_SR_HARMONIZED')
+                  .filterBounds(roi)
+                  .filter(date_filter)
+                  .filter(ee.Filter.lt('CLOUDY_PIXEL_PERCENTAGE', threshold))
+                  .sort('system:time_start'))
+    return collection.size(), ee.FeatureCollection(collection.map(pass_mean))
+
+
+# Umbral de respaldo de las series cuando ninguna pasada queda bajo el pedido
+SERIES_FALLBACK_CLOUD_PCT = 90
+
+
+def series_threshold(cloud_pct):
+    """Umbral de nubes efectivo de la serie (permisivo por velocidad, máximo 80)."""
+    return min(cloud_pct, 80)
+
+
+def get_sentinel2_time_series(roi, start, end, index, cloud_pct=70, scale=60, max_pixels=1e5):
     """
     Obtiene serie temporal de cada pasada individual de Sentinel-2 (OPTIMIZADA)
-    Retorna datos de cada imagen por separado con enfoque en velocidad
+
+    La reducción por imagen se mapea del lado del servidor y las fechas/medias de
+    todas las pasadas se traen en un único getInfo (antes: ~2 llamadas por imagen).
+    scale/max_pixels: ver utils_pkg.stats_plan.plan_stats(..., series=True).
     """
-    # For speed we use permissive thresholds and a simplified mask
-    cloud_thresholds = [min(cloud_pct, 80), 90]
-
-    for threshold in cloud_thresholds:
-        collection = (ee.ImageCollection('COPERNICUS/S2_SR_HARMONIZED')
-                     .filterBounds(roi)
-                     .filterDate(start, end)
-                     .filter(ee.Filter.lt('CLOUDY_PIXEL_PERCENTAGE', threshold))
-                     .sort('system:time_start')
-                     .limit(30))
-
-        size_before_mask = collection.size().getInfo()
-        if size_before_mask == 0:
+    import datetime
+
+    # For speed we use permissive thresholds; the fallback threshold is only
+    # evaluated server-side when the primary one yields no pass with a value
+    # (same rule as services/series.py).
+    date_filter = ee.Filter.date(start, end)
+    _, primary = _series_passes(roi, date_filter, index, series_threshold(cloud_pct), scale, max_pixels)
+    _, fallback = _series_passes(roi, date_filter, index, SERIES_FALLBACK_CLOUD_PCT, scale, max_pixels)
+    primary = primary.filter(ee.Filter.notNull(['mean']))
+    fallback = fallback.filter(ee.Filter.notNull(['mean']))
+    series_fc = ee.FeatureCollection(ee.Algorithms.If(primary.size().gt(0), primary, fallback))
+
+    try:
+        result = get_info(ee.Dictionary({
+            't': series_fc.aggregate_array('t'),
+            'mean': series_fc.aggregate_array('mean'),
+        }))
+    except Exception:
+        return []
+
+    from utils_pkg.io import round_sig
+    time_series = []
+    for date_ms, mean_value in zip(result.get('t') or [], result.get('mean') or []):
+        if date_ms is None or mean_value is None:
             continue
+        date_str = datetime.datetime.fromtimestamp(date_ms / 1000).strftime('%Y-%m-%d')
+        # Redondear a 2 cifras significativas antes de devolver
+        rounded = round_sig(mean_value, sig=2)
+        if rounded is None:
+            continue
+        time_series.append({'date': date_str, 'datetime': date_str + ' 12:00:00', 'timestamp': date_ms, 'mean': rounded})
+    time_series.sort(key=lambda x: x.get('timestamp', 0))
+    return time_series
 
-        def simple_cloud_mask(img):
-            scl = img.select('SCL')
-            mask = scl.neq(9).And(scl.neq(10))
-            return img.updateMask(mask)
 
-        collection = collection.map(simple_cloud_mask)
-        size_after_mask = collection.size().getInfo()
-        if size_after_mask > 0:
-            break
-    else:
+def get_sentinel2_series_passes(roi, ranges, index, threshold, scale=60, max_pixels=1e5):
+    """Pasadas de varios rangos [start, end) con su media sin redondear, en un único getInfo.
+
+    A diferencia de get_sentinel2_time_series no aplica el umbral de respaldo:
+    cada pasada depende solo de su imagen, lo que permite guardarlas y
+    completar la serie por tramos (ver services/series.py). Los errores de EE se
+    propagan para no dar por consultado un tramo que falló.
+    """
+    import datetime
+
+    if not ranges:
         return []
+    filters = [ee.Filter.date(a, b) for a, b in ranges]
+    date_filter = filters[0] if len(filters) == 1 else ee.Filter.Or(*filters)
+    _, passes = _series_passes(roi, date_filter, index, threshold, scale, max_pixels)
+    passes = passes.filter(ee.Filter.notNull(['mean']))
+    result = get_info(ee.Dictionary({
+        't': passes.aggregate_array('t'),
+        'mean': passes.aggregate_array('mean'),
+        'id': passes.aggregate_array('id'),
+        'cloud': passes.aggregate_array('cloud'),
+    }))
 
-    def add_index_band_fast(img):
-        idx = index.lower()
-        if idx == 'ndvi':
-            return img.addBands(img.normalizedDifference(['B8', 'B4']).rename(index))
-        elif idx == 'ndwi':
-            return img.addBands(img.normalizedDifference(['B3', 'B8']).rename(index))
-        elif idx == 'ndmi':
-            return img.addBands(img.normalizedDifference(['B8', 'B11']).rename(index))
-        elif idx == 'evi':
-            evi = img.normalizedDifference(['B8', 'B4']).multiply(2.5).rename(index)
-            return img.addBands(evi)
-        elif idx == 'savi':
-            savi = img.normalizedDifference(['B8', 'B4']).multiply(1.5).rename(index)
-            return img.addBands(savi)
-        else:
-            return img.addBands(img.normalizedDifference(['B8', 'B4']).rename(index))
-
-    processed_collection = collection.map(add_index_band_fast)
+    points = []
+    for date_ms, mean_value, image_id, cloud in zip(result.get('t') or [], result.get('mean') or [],
+                                                    result.get('id') or [], result.get('cloud') or []):
+        if date_ms is None or mean_value is None:
+            continue
+        points.append({
+            'image_id': image_id,
+            'ts': datetime.datetime.utcfromtimestamp(date_ms / 1000).strftime('%Y-%m-%d'),
+            'system_time_start': date_ms,
+            'value': mean_value,
+            'cloud_cover': cloud,
+        })
+    return points
 
-    try:
-        limited_collection = processed_collection.limit(30)
-        image_count = limited_collection.size().getInfo()
-        image_list = limited_collection.toList(image_count)
-        time_series = []
-        for i in range(image_count):
-            try:
-                img = ee.Image(image_list.get(i))
-                stats = img.select(index).reduceRegion(reducer=ee.Reducer.mean(), geometry=roi, scale=60, maxPixels=1e5, bestEffort=True).getInfo()
-                metadata = img.getInfo()
-                date_ms = metadata['properties']['system:time_start']
-                import datetime
-                date_obj = datetime.datetime.fromtimestamp(date_ms / 1000)
-                date_str = date_obj.strftime('%Y-%m-%d')
-                mean_value = stats.get(index)
-                if mean_value is not None:
-                    # Redondear a 2 cifras significativas antes de devolver
-                    try:
-                        from utils_pkg.io import round_sig
-                        rounded = round_sig(float(mean_value), sig=2)
-                    except Exception:
-                        rounded = float(mean_value)
-                    time_series.append({'date': date_str, 'datetime': date_str + ' 12:00:00', 'timestamp': date_ms, 'mean': rounded})
-            except Exception:
-                continue
-        time_series.sort(key=lambda x: x.get('timestamp', 0))
-        return time_series
-    except Exception:
+
+# En streaming (iter_sentinel2_dates) los rangos más largos que esto se consultan
+# por tramos (una llamada a EE por tramo) para empezar a responder antes
+DATES_CHUNK_DAYS = 366
+
+
+def get_sentinel2_dates_ranges(roi, ranges, cloud_pct=100):
+    """Trae la metadata de todas las imágenes de varios rangos [start, end) en un único getInfo."""
+    import datetime
+
+    if not ranges:
         return []
+    filters = [ee.Filter.date(a, b) for a, b in ranges]
+    date_filter = filters[0] if len(filters) == 1 else ee.Filter.Or(*filters)
+    # Obtener colección sin máscara (queremos todas las fechas disponibles)
+    collection = (ee.ImageCollection('COPERNICUS/S2_SR_HARMONIZED')
+                 .filterBounds(roi)
+                 .filter(date_filter)
+                 .filter(ee.Filter.lte('CLOUDY_PIXEL_PERCENTAGE', cloud_pct))
+                 .sort('system:time_start'))
+
+    # Una fila [time_start, cloud, tile, index] por imagen; agregada como lista
+    # para que los valores nulos no desalineen las columnas.
+    def to_row(img):
+        return ee.Feature(None, {'row': ee.List([
+            img.get('system:time_start'),
+            img.get('CLOUDY_PIXEL_PERCENTAGE'),
+            img.get('MGRS_TILE'),
+            img.get('system:index'),
+        ])})
+
+    rows = get_info(ee.FeatureCollection(collection.map(to_row)).aggregate_array('row')) or []
+
+    dates = []
+    for row in rows:
+        try:
+            date_ms, cloud_cover, mgrs_tile, system_index = (list(row) + [None] * 4)[:4]
+            if not date_ms:
+                continue
+            date_str = datetime.datetime.utcfromtimestamp(date_ms / 1000).strftime('%Y-%m-%d')
+            tile_id = mgrs_tile or system_index
+            dates.append({
+                'date': date_str,
+                'system_time_start': date_ms,
+                'cloud_cover': float(cloud_cover) if cloud_cover is not None else None,
+                'tile_id': str(tile_id) if tile_id else None
+            })
+        except Exception:
+            # Skip imágenes con errores de metadata
+            continue
+    return dates
+
+
+def iter_sentinel2_dates(roi, start, end, cloud_pct=100, chunk_days=DATES_CHUNK_DAYS):
+    """
+    Igual que get_sentinel2_dates pero genera los tramos a medida que llegan de EE.
+
+    Para rangos largos permite empezar a responder (y persistir) antes de tener
+    el rango completo. Cada elemento generado es la lista de fechas de un tramo.
+    """
+    import datetime
+
+    try:
+        cursor = datetime.datetime.strptime(start, '%Y-%m-%d')
+        stop = datetime.datetime.strptime(end, '%Y-%m-%d')
+    except (TypeError, ValueError):
+        # Fechas no ISO simples: dejar que EE las interprete en un solo tramo
+        yield get_sentinel2_dates_ranges(roi, [(start, end)], cloud_pct)
+        return
+
+    while cursor < stop:
+        chunk_end = min(cursor + datetime.timedelta(days=chunk_days), stop)
+        yield get_sentinel2_dates_ranges(roi, [(cursor.strftime('%Y-%m-%d'), chunk_end.strftime('%Y-%m-%d'))], cloud_pct)
+        cursor = chunk_end
 
 
 def get_sentinel2_dates(roi, start, end, cloud_pct=100):
     """
     Obtiene todas las fechas disponibles de imágenes Sentinel-2 para una geometría.
+
+    La metadata de toda la colección se agrega del lado del servidor, así que
+    el rango completo cuesta una sola llamada a EE.
     
     Args:
         roi: ee.Geometry - región de interés
@@ -265,53 +303,7 @@ def get_sentinel2_dates(roi, start, end, cloud_pct=100):
             - tile_id: str (MGRS tile)
     """
     try:
-        # Obtener colección sin máscara (queremos todas las fechas disponibles)
-        collection = (ee.ImageCollection('COPERNICUS/S2_SR_HARMONIZED')
-                     .filterBounds(roi)
-                     .filterDate(start, end)
-                     .filter(ee.Filter.lte('CLOUDY_PIXEL_PERCENTAGE', cloud_pct))
-                     .sort('system:time_start'))
-        
-        # Obtener el tamaño de la colección
-        size = collection.size().getInfo()
-        
-        if size == 0:
-            return []
-        
-        # Convertir a lista y extraer metadata
-        image_list = collection.toList(size)
-        dates = []
-        
-        for i in range(size):
-            try:
-                img = ee.Image(image_list.get(i))
-                props = img.getInfo()['properties']
-                
-                date_ms = props.get('system:time_start')
-                if not date_ms:
-                    continue
-                
-                # Convertir timestamp a fecha ISO
-                import datetime
-                date_obj = datetime.datetime.utcfromtimestamp(date_ms / 1000)
-                date_str = date_obj.strftime('%Y-%m-%d')
-                
-                # Extraer metadata adicional
-                cloud_cover = props.get('CLOUDY_PIXEL_PERCENTAGE')
-                tile_id = props.get('MGRS_TILE', props.get('system:index'))
-                
-                dates.append({
-                    'date': date_str,
-                    'system_time_start': date_ms,
-                    'cloud_cover': float(cloud_cover) if cloud_cover is not None else None,
-                    'tile_id': str(tile_id) if tile_id else None
-                })
-            except Exception:
-                # Skip imágenes con errores de metadata
-                continue
-        
-        return dates
-    
+        return get_sentinel2_dates_ranges(roi, [(start, end)], cloud_pct)
     except Exception as e:
         raise RuntimeError(f"Error obteniendo fechas de Sentinel-2: {str(e)}")
 
@@ -0,0 +1,96 @@
+"""Composite Sentinel-2 compartido entre índices.
+
+El composite enmascarado (`collection.mean().clip(roi)`) se construye una vez por
+(huella de ROI, ventana, cloud_pct) y de él se derivan todos los índices pedidos,
+como bandas de una misma imagen: NDVI, NDRE, NDMI y EVI de la misma parcela y
+ventana comparten el grafo del composite y sus estadísticas salen de un único
+reduceRegion. El número de imágenes del composite se cachea por la misma clave,
+así que pedir otro índice para la misma ventana no vuelve a lanzar `size().getInfo()`.
+"""
+import os
+import threading
+from collections import OrderedDict
+import ee
+from services.ee.ee_batch import get_info
+from services.ee.ee_indices import index_from_composite
+from utils_pkg.cache import TieredCache
+from utils_pkg.fingerprint import request_fingerprint
+
+COMPOSITE_CACHE_ENTRIES = int(os.getenv('COMPOSITE_CACHE_ENTRIES', '64'))
+# El conteo de una ventana reciente puede crecer al ingerirse escenas nuevas
+COMPOSITE_COUNT_TTL_S = int(os.getenv('COMPOSITE_COUNT_TTL_S', '3600'))
+
+_image_counts = TieredCache('s2count', ttl_s=COMPOSITE_COUNT_TTL_S, refresh_after_s=COMPOSITE_COUNT_TTL_S,
+                            memory_max_entries=1024, disk_max_bytes=1024 * 1024)
+_composites = OrderedDict()
+_lock = threading.Lock()
+
+
+class Sentinel2Composite:
+    """Composite de una ventana con los índices derivados memorizados (sin evaluar nada en EE)."""
+
+    def __init__(self, roi, start, end, cloud_pct=30, key=None):
+        from services.ee.ee_client import get_sentinel2_collection
+
+        self.roi = roi
+        self.key = key
+        collection = get_sentinel2_collection(roi, start, end, cloud_pct)
+        # Build a robust mean composite; fallback to first() if mean fails
+        try:
+            self.image = collection.mean().clip(roi)
+        except Exception:
+            self.image = collection.first().clip(roi)
+        self.image_count = collection.size()
+        self._indices = {}
+        self._lock = threading.Lock()
+
+    def index(self, index):
+        """Imagen del índice tal como la devuelve index_from_composite (RGB: bandas B4/B3/B2)."""
+        idx = (index or '').lower()
+        with self._lock:
+            img = self._indices.get(idx)
+            if img is None:
+                img = index_from_composite(self.image, idx, self.roi)
+                self._indices[idx] = img
+        return img
+
+    def bands(self, indices):
+        """Una sola imagen con una banda por índice, nombrada como el índice (RGB: su primera banda)."""
+        return ee.Image.cat([self.index(idx).select([0]).rename(idx) for idx in indices])
+
+    def count(self):
+        """Número de imágenes del composite (cacheado por clave si la hay)."""
+        if self.key is None:
+            return int(get_info(self.image_count) or 0)
+        return int(_image_counts.get_or_compute(self.key, lambda: int(get_info(self.image_count) or 0)) or 0)
+
+    def remember_count(self, size):
+        """Guarda un conteo ya evaluado junto a otros resultados (p.ej. en un EEBundle)."""
+        if self.key is not None:
+            _image_counts.set(self.key, int(size))
+
+
+def composite_key(roi_geojson, start, end, cloud_pct):
+    return request_fingerprint(roi_geojson, kind='s2_composite', start=start, end=end, cloud_pct=cloud_pct)
+
+
+def get_composite(roi, start, end, cloud_pct=30, roi_geojson=None):
+    """Composite compartido para (ROI, ventana, cloud_pct).
+
+    Con `roi_geojson` se reutiliza entre peticiones (LRU); sin él se construye uno nuevo.
+    """
+    if roi_geojson is None:
+        return Sentinel2Composite(roi, start, end, cloud_pct)
+    key = composite_key(roi_geojson, start, end, cloud_pct)
+    with _lock:
+        composite = _composites.get(key)
+        if composite is not None:
+            _composites.move_to_end(key)
+            return composite
+    composite = Sentinel2Composite(roi, start, end, cloud_pct, key=key)
+    with _lock:
+        composite = _composites.setdefault(key, composite)
+        _composites.move_to_end(key)
+        while len(_composites) > COMPOSITE_CACHE_ENTRIES:
+            _composites.popitem(last=False)
+    return composite
@@ -0,0 +1,65 @@
+"""Ejecución concurrente de llamadas independientes a Earth Engine.
+
+Las llamadas bloqueantes de una misma petición (getInfo de estadísticas, getMapId,
+series...) que no dependen entre sí se lanzan en un pool acotado y se esperan
+juntas, de modo que la latencia es la de la llamada más lenta y no la suma.
+"""
+import os
+import time
+import contextvars
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FuturesTimeoutError
+
+EE_MAX_WORKERS = int(os.getenv('EE_MAX_WORKERS', '8'))
+EE_CALL_TIMEOUT_S = float(os.getenv('EE_CALL_TIMEOUT_S', '120'))
+
+_executor = ThreadPoolExecutor(max_workers=EE_MAX_WORKERS, thread_name_prefix='ee-call')
+
+
+class EECall:
+    """Una llamada a ejecutar en paralelo.
+
+    - timeout: segundos máximos de espera para esta llamada (default EE_CALL_TIMEOUT_S).
+    - optional: si falla o expira, su resultado queda en None en lugar de abortar la petición.
+    """
+
+    def __init__(self, fn, *args, timeout=None, optional=False, **kwargs):
+        self.fn = fn
+        self.args = args
+        self.kwargs = kwargs
+        self.timeout = EE_CALL_TIMEOUT_S if timeout is None else timeout
+        self.optional = optional
+
+
+def run_parallel(calls):
+    """Ejecuta un dict {nombre: EECall} concurrentemente y une los resultados.
+
+    Retorna (results, errors): results tiene una entrada por nombre (None para las
+    opcionales que fallaron) y errors las excepciones de esas opcionales. Si una
+    llamada obligatoria falla o expira se cancela el resto y se re-lanza su error.
+    No debe llamarse desde dentro de una tarea del propio pool.
+    """
+    started = time.monotonic()
+    futures = {}
+    for name, call in calls.items():
+        # Copiar el contexto para que el contador de round trips siga a la petición
+        ctx = contextvars.copy_context()
+        futures[name] = _executor.submit(ctx.run, call.fn, *call.args, **call.kwargs)
+
+    results, errors = {}, {}
+    for name, future in futures.items():
+        call = calls[name]
+        remaining = max(0.0, started + call.timeout - time.monotonic())
+        try:
+            results[name] = future.result(timeout=remaining)
+        except Exception as e:
+            if isinstance(e, FuturesTimeoutError):
+                future.cancel()
+                e = TimeoutError(f"EE call '{name}' exceeded {call.timeout}s")
+            if not call.optional:
+                for other in futures.values():
+                    other.cancel()
+                raise e
+            print(f"run_parallel: llamada opcional '{name}' falló: {e}")
+            results[name] = None
+            errors[name] = e
+    return results, errors
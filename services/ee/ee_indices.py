@@ -1,133 +1,135 @@
+import re
 import ee
 
+# Índices derivados del composite Sentinel-2. Cada entrada se compila a una sola
+# operación EE (normalizedDifference o una expresión sobre las bandas del composite)
+# seguida como mucho de un ajuste lineal y un clamp. La visualización de cada
+# índice está en utils_pkg.visualization.INDEX_VIS.
+#   bands: alias usado en la fórmula -> banda Sentinel-2 requerida
+#   normalized_difference: (a, b) alias para normalizedDifference
+#   formula: expresión EE en términos de los alias
+#   linear: (gain, offset) aplicado al resultado
+#   clamp: (min, max); None en un extremo = sin límite
+INDEX_DEFINITIONS = {
+    'ndvi': {'bands': {'NIR': 'B8', 'RED': 'B4'}, 'normalized_difference': ('NIR', 'RED')},
+    # NDWI (water)
+    'ndwi': {'bands': {'GREEN': 'B3', 'NIR': 'B8'}, 'normalized_difference': ('GREEN', 'NIR')},
+    # NDMI (moisture)
+    'ndmi': {'bands': {'NIR': 'B8', 'SWIR1': 'B11'}, 'normalized_difference': ('NIR', 'SWIR1'), 'clamp': (-0.6, 0.6)},
+    # NDRE (red edge)
+    'ndre': {'bands': {'NIR': 'B8', 'RE1': 'B5'}, 'normalized_difference': ('NIR', 'RE1'), 'clamp': (-0.5, 0.6)},
+    'evi': {
+        'bands': {'NIR': 'B8', 'RED': 'B4', 'BLUE': 'B2'},
+        'formula': '2.5 * ((NIR - RED) / (NIR + 6 * RED - 7.5 * BLUE + 1))',
+        'clamp': (-0.2, 0.6),
+    },
+    # SAVI (soil-adjusted vegetation index)
+    'savi': {
+        'bands': {'NIR': 'B8', 'RED': 'B4'},
+        'formula': '1.5 * ((NIR - RED) / (NIR + RED + 0.5))',
+        'clamp': (-0.5, 1.0),
+    },
+    # LAI: empirical from NDVI, non-negative. Sobre normalizedDifference (no una
+    # expresión) para conservar su tratamiento de valores negativos
+    'lai': {
+        'bands': {'NIR': 'B8', 'RED': 'B4'},
+        'normalized_difference': ('NIR', 'RED'),
+        'linear': (3.618, -0.118),
+        'clamp': (0, None),
+    },
+    # soil_ph: proxy using SWIR/NIR ratio
+    'soil_ph': {'bands': {'SWIR1': 'B11', 'NIR': 'B8'}, 'formula': 'SWIR1 / NIR'},
+}
+# Índices sin definición propia: normalizedDifference(NIR, RED) con el nombre del índice
+DEFAULT_INDEX = 'ndvi'
+RGB_BANDS = ['B4', 'B3', 'B2']
+
+
+def build_sentinel2_index(roi, start, end, index, cloud_pct=30, roi_geojson=None):
+    """Build the index image without evaluating anything on Earth Engine.
+
+    Returns (image, image_count) where image_count is an ee.Number with the number of
+    images in the composite, so callers can bundle it with other results in one getInfo.
+    With `roi_geojson` the composite is shared with other indices of the same ROI/window
+    (see services/ee/ee_composite.py).
+    """
+    from services.ee.ee_composite import get_composite
+
+    composite = get_composite(roi, start, end, cloud_pct, roi_geojson=roi_geojson)
+    return composite.index(index), composite.image_count
 
-def compute_sentinel2_index(roi, start, end, index, cloud_pct=30):
+
+def compute_sentinel2_index(roi, start, end, index, cloud_pct=30, roi_geojson=None):
     """Compute various Sentinel-2 based indices for heatmaps.
 
     Returns an ee.Image clipped to the roi, with a single band named after the index.
+    The image count is cached per composite, so other indices of the same ROI/window
+    do not evaluate it again.
     """
-    from services.ee.ee_client import get_sentinel2_collection
+    from services.ee.ee_composite import get_composite
 
-    collection = get_sentinel2_collection(roi, start, end, cloud_pct)
+    try:
+        composite = get_composite(roi, start, end, cloud_pct, roi_geojson=roi_geojson)
+    except Exception:
+        return None
 
     # If no images, return None
     try:
-        size = int(collection.size().getInfo())
+        size = composite.count()
     except Exception:
         size = 0
     print(f"Sentinel-2 Heatmap: Found {size} images for composition (cloud_pct<{cloud_pct})")
     if size == 0:
         return None
+    return composite.index(index)
 
-    # Build a robust median composite; fallback to first() if median fails
-    try:
-        composite = collection.mean().clip(roi)
-    except Exception:
-        try:
-            composite = collection.first().clip(roi)
-        except Exception:
-            return None
-
-    idx = (index or '').lower()
 
-    # RGB (true color)
-    if idx == 'rgb':
-        try:
-            return composite.select(['B4', 'B3', 'B2'])
-        except Exception:
-            return composite
+def _expression(definition):
+    """Fórmula con los alias sustituidos por b('<banda>'): una sola expresión sobre el composite."""
+    bands = definition['bands']
+    pattern = re.compile(r'\b(' + '|'.join(map(re.escape, bands)) + r')\b')
+    return pattern.sub(lambda m: f"b('{bands[m.group(1)]}')", definition['formula'])
 
-    # NDVI
-    if idx == 'ndvi':
-        ndvi = composite.normalizedDifference(['B8', 'B4']).rename('ndvi')
-        return ndvi.clip(roi)
 
-    # NDWI (water)
-    if idx == 'ndwi':
-        ndwi = composite.normalizedDifference(['B3', 'B8']).rename('ndwi')
-        return ndwi.clip(roi)
+_EXPRESSIONS = {name: _expression(d) for name, d in INDEX_DEFINITIONS.items() if 'formula' in d}
 
-    # NDMI (moisture)
-    if idx == 'ndmi':
-        ndmi = composite.normalizedDifference(['B8', 'B11']).rename('ndmi')
-        try:
-            ndmi = ndmi.clamp(-0.6, 0.6)
-        except Exception:
-            pass
-        return ndmi.clip(roi)
 
-    # NDRE (red edge)
-    if idx == 'ndre':
-        try:
-            ndre = composite.normalizedDifference(['B8', 'B5']).rename('ndre')
-        except Exception:
-            ndre = composite.normalizedDifference(['B8', 'B4']).rename('ndre')
-        try:
-            ndre = ndre.clamp(-0.5, 0.6)
-        except Exception:
-            pass
-        return ndre.clip(roi)
-
-    # EVI
-    if idx == 'evi':
-        evi = composite.expression(
-            '2.5 * ((NIR - RED) / (NIR + 6 * RED - 7.5 * BLUE + 1))',
-            {
-                'NIR': composite.select('B8'),
-                'RED': composite.select('B4'),
-                'BLUE': composite.select('B2')
-            }
-        ).rename('evi')
-        try:
-            evi = evi.clamp(-0.2, 0.6)
-        except Exception:
-            pass
-        return evi.clip(roi)
+def index_from_composite(composite, index, roi):
+    """Derive the requested index band from an already built composite.
 
-    # SAVI (soil-adjusted vegetation index)
-    if idx == 'savi':
-        savi = composite.expression(
-            '(1.5) * ((NIR - RED) / (NIR + RED + 0.5))',
-            {
-                'NIR': composite.select('B8'),
-                'RED': composite.select('B4')
-            }
-        ).rename('savi')
-        try:
-            savi = savi.clamp(-0.5, 1.0)
-        except Exception:
-            pass
-        return savi.clip(roi)
-
-    # LAI: empirical from NDVI
-    if idx == 'lai':
-        ndvi = composite.normalizedDifference(['B8', 'B4'])
-        lai = ndvi.multiply(3.618).subtract(0.118)
-        try:
-            # Ensure non-negative LAI values
-            lai = lai.max(0)
-        except Exception:
-            pass
-        lai = lai.rename('lai')
-        try:
-            print('compute_sentinel2_index: returning LAI image')
-        except Exception:
-            pass
-        return lai.clip(roi)
+    The composite is already clipped to the roi, so the index is not clipped again.
+    """
+    idx = (index or '').lower()
 
-    # soil_ph: proxy using SWIR/NIR ratio
-    if idx == 'soil_ph':
-        try:
-            ratio = composite.select('B11').divide(composite.select('B8')).rename('soil_ph_raw')
-            soil_ph = ratio.multiply(1.0).rename('soil_ph')
-            return soil_ph.clip(roi)
-        except Exception:
-            ndvi = composite.normalizedDifference(['B8', 'B4']).rename('soil_ph')
-            return ndvi.clip(roi)
-
-    # Default fallback: normalizedDifference(NIR, RED)
-    try:
-        fallback = composite.normalizedDifference(['B8', 'B4']).rename(idx)
-        return fallback.clip(roi)
-    except Exception:
-        return composite
+    # RGB (true color)
+    if idx == 'rgb':
+        return composite.select(RGB_BANDS)
+
+    name = idx if idx in INDEX_DEFINITIONS else DEFAULT_INDEX
+    definition = INDEX_DEFINITIONS[name]
+    if 'normalized_difference' in definition:
+        a, b = definition['normalized_difference']
+        img = composite.normalizedDifference([definition['bands'][a], definition['bands'][b]])
+    else:
+        img = composite.expression(_EXPRESSIONS[name])
+    if 'linear' in definition:
+        gain, offset = definition['linear']
+        img = img.multiply(gain).add(offset)
+
+    low, high = definition.get('clamp') or (None, None)
+    if low is not None and high is not None:
+        img = img.clamp(low, high)
+    elif low is not None:
+        img = img.max(low)
+    elif high is not None:
+        img = img.min(high)
+    return img.rename(idx)
+
+
+def classify_breaks(image, breaks):
+    """Clase de cada píxel según `breaks` (ascendentes), en una sola operación.
+
+    0 si v <= breaks[0], i si breaks[i-1] < v <= breaks[i] y len(breaks) por encima
+    del último: es el número de breaks que el valor supera.
+    """
+    return image.gt(ee.Image.constant([float(b) for b in breaks])).reduce(ee.Reducer.sum()).rename('class')
@@ -0,0 +1,113 @@
+"""Estadísticas zonales de varios índices y varias features en una sola reducción.
+
+En lugar de recomponer el composite y lanzar un reduceRegion por cada par
+(feature, índice), se construye un único composite con todos los índices como
+bandas y se reduce con `reduceRegions` sobre la FeatureCollection completa
+(paginada para colecciones muy grandes).
+"""
+import ee
+from services.ee.ee_batch import EEBundle, get_info
+from services.ee.ee_executor import EECall, run_parallel
+from services.ee.ee_composite import get_composite
+from utils_pkg.roi import geojson_bounds, bounds_to_polygon
+from utils_pkg.geometry_prep import prepare_geometry
+
+# Features por llamada a reduceRegions; las páginas se lanzan en paralelo
+ZONAL_STATS_PAGE_SIZE = 250
+
+STAT_NAMES = ('mean', 'min', 'max', 'stdDev')
+
+
+def build_multi_index_image(roi, start, end, indices, cloud_pct=30, roi_geojson=None):
+    """Composite Sentinel-2 con una banda por índice.
+
+    Retorna (image, image_count) sin evaluar nada en EE.
+    """
+    composite = get_composite(roi, start, end, cloud_pct, roi_geojson=roi_geojson)
+    return composite.bands(indices), composite.image_count
+
+
+def _stats_reducer():
+    return ee.Reducer.mean().combine(ee.Reducer.min(), None, True).combine(ee.Reducer.max(), None, True).combine(ee.Reducer.stdDev(), None, True)
+
+
+def _page_rows(image, page, indices, scale):
+    # page: lista de (posición, feature); la posición identifica la fila aunque los ids se repitan
+    fc = ee.FeatureCollection([
+        ee.Feature(ee.Geometry(prepare_geometry(f['geometry'], scale)[0]), {'pos': pos}) for pos, f in page
+    ])
+    reduced = image.reduceRegions(collection=fc, reducer=_stats_reducer(), scale=scale, tileScale=2)
+    if len(indices) == 1:
+        props = list(STAT_NAMES)
+    else:
+        props = [f"{idx}_{stat}" for idx in indices for stat in STAT_NAMES]
+    # Una fila por feature: [pos, valores...] sin geometría para aligerar la respuesta
+    return reduced.map(lambda f: ee.Feature(None, {
+        'row': ee.List([f.get('pos')]).cat(ee.List([f.get(p) for p in props]))
+    })).aggregate_array('row')
+
+
+def _parse_rows(rows, indices):
+    out = {}
+    for row in rows or []:
+        pos, values = row[0], row[1:]
+        per_index = {}
+        for i, idx in enumerate(indices):
+            chunk = values[i * len(STAT_NAMES):(i + 1) * len(STAT_NAMES)]
+            stats = {stat: (float(v) if v is not None else None) for stat, v in zip(STAT_NAMES, chunk)}
+            per_index[idx] = stats if any(v is not None for v in stats.values()) else None
+        out[int(pos)] = per_index
+    return out
+
+
+def zonal_stats(features, start, end, indices, cloud_pct=30, scale=10, page_size=ZONAL_STATS_PAGE_SIZE, progress=None):
+    """Matriz features × índices × estadísticas.
+
+    `features` es la lista de split_feature_collection (dicts con 'geometry').
+    Retorna una lista alineada con `features` de {índice: {'mean','min','max','stdDev'} | None}
+    (None para features sin resultado), o None si no hay imágenes para el periodo.
+    La primera página viaja junto al conteo de imágenes en un único getInfo; el
+    resto de páginas (si las hay) se lanzan en paralelo. `progress(done, total)`, si
+    se indica, recibe el número de features ya reducidas.
+    """
+    located = [(pos, f) for pos, f in enumerate(features) if f.get('geometry')]
+    if not located:
+        return [None] * len(features)
+
+    bounds = [geojson_bounds(f['geometry']) for _, f in located]
+    bounds = [b for b in bounds if b]
+    master_bounds = [
+        min(b[0] for b in bounds), min(b[1] for b in bounds),
+        max(b[2] for b in bounds), max(b[3] for b in bounds)
+    ]
+    master_roi = ee.Geometry.Rectangle(master_bounds)
+    image, image_count = build_multi_index_image(master_roi, start, end, indices, cloud_pct, roi_geojson=bounds_to_polygon(master_bounds))
+
+    pages = [located[i:i + page_size] for i in range(0, len(located), page_size)]
+
+    bundle = EEBundle()
+    bundle.add('image_count', image_count)
+    bundle.add('rows', ee.Algorithms.If(image_count.gt(0), _page_rows(image, pages[0], indices, scale), None))
+    first = bundle.evaluate()
+    try:
+        size = int(first.get('image_count') or 0)
+    except Exception:
+        size = 0
+    print(f"zonal_stats: {size} images, {len(located)} features, {len(indices)} indices, {len(pages)} page(s)")
+    if size == 0:
+        return None
+
+    results = _parse_rows(first.get('rows'), indices)
+    if progress:
+        progress(len(pages[0]), len(located))
+    if len(pages) > 1:
+        calls = {
+            f'page_{n}': EECall(get_info, _page_rows(image, page, indices, scale))
+            for n, page in enumerate(pages[1:], start=1)
+        }
+        fanout, _ = run_parallel(calls)
+        for rows in fanout.values():
+            results.update(_parse_rows(rows, indices))
+        if progress:
+            progress(len(located), len(located))
+    return [results.get(pos) for pos in range(len(features))]
@@ -0,0 +1,128 @@
+"""Trabajos en segundo plano para operaciones largas (/stats/kml, exports).
+
+Un pool acotado de hilos ejecuta los jobs; su estado (progreso, resultado, error)
+se guarda en la tabla `jobs` de SQLite para que sobreviva a reinicios: al
+arrancar, `resume_jobs()` vuelve a encolar los que quedaron a medias.
+
+Los jobs cortos que completan una respuesta ya enviada (p.ej. el refinado de
+estadísticas de services/progressive.py) se registran con lane='interactive' y
+usan un pool propio, para no esperar detrás de los batch largos de /stats/kml.
+
+Cada job guarda el proceso que lo encoló (`owner`). Con varios workers
+arrancando a la vez, `resume_jobs()` reclama cada job con un UPDATE condicionado
+al dueño que leyó y solo lo ejecuta el proceso cuyo UPDATE lo consiguió.
+
+Cada tipo de job registra un handler con `register_job_handler(kind, fn)`;
+`fn(payload, progress)` recibe el payload JSON con el que se envió y un callable
+`progress(done, total=None, message=None)`, y retorna un dict serializable. Si
+el dict incluye 'files' ({nombre: ruta}), esos ficheros se sirven en
+/jobs/{job_id}/result.
+"""
+import os
+import time
+import uuid
+import socket
+import traceback
+from concurrent.futures import ThreadPoolExecutor
+from services.db import insert_job, update_job, get_job, list_jobs, claim_job
+from services.ee.ee_batch import start_roundtrip_counter
+
+JOB_MAX_WORKERS = int(os.getenv('JOB_MAX_WORKERS', '2'))
+JOB_INTERACTIVE_WORKERS = int(os.getenv('JOB_INTERACTIVE_WORKERS', '2'))
+
+JOB_LANES = ('batch', 'interactive')
+_executors = {
+    'batch': ThreadPoolExecutor(max_workers=JOB_MAX_WORKERS, thread_name_prefix='job'),
+    'interactive': ThreadPoolExecutor(max_workers=JOB_INTERACTIVE_WORKERS, thread_name_prefix='job-interactive'),
+}
+_handlers = {}
+_lanes = {}
+
+JOB_STATUSES = ('queued', 'running', 'done', 'failed')
+
+# Identifica a este proceso como dueño de los jobs que encola o reanuda
+JOB_OWNER = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+
+
+def _now():
+    return time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime())
+
+
+def register_job_handler(kind, fn, lane='batch'):
+    if lane not in JOB_LANES:
+        raise ValueError(f'lane de job desconocido: {lane}')
+    _handlers[kind] = fn
+    _lanes[kind] = lane
+
+
+def _executor_for(kind):
+    return _executors[_lanes.get(kind, 'batch')]
+
+
+def _progress_reporter(job_id):
+    def progress(done, total=None, message=None):
+        fields = {'progress': int(done)}
+        if total is not None:
+            fields['total'] = int(total)
+        if message is not None:
+            fields['message'] = message
+        try:
+            update_job(job_id, **fields)
+        except Exception as e:
+            print(f"jobs: no se pudo actualizar el progreso de {job_id}: {e}")
+    return progress
+
+
+def _run_job(job_id, kind, payload):
+    handler = _handlers.get(kind)
+    if handler is None:
+        update_job(job_id, status='failed', error=f'tipo de job desconocido: {kind}', finished_at=_now())
+        return
+    update_job(job_id, status='running', started_at=_now())
+    counter = start_roundtrip_counter()
+    try:
+        result = handler(payload or {}, _progress_reporter(job_id))
+        if isinstance(result, dict):
+            result.setdefault('ee_roundtrips', counter['count'])
+        update_job(job_id, status='done', result=result, finished_at=_now())
+        print(f"jobs: {kind} {job_id} terminado ({counter['count']} round trips EE)")
+    except Exception as e:
+        # HTTPException trae el mensaje útil en .detail
+        error = getattr(e, 'detail', None) or str(e)
+        traceback.print_exc()
+        update_job(job_id, status='failed', error=str(error), finished_at=_now())
+
+
+def submit_job(kind, payload=None):
+    """Encola un job y retorna su id sin esperar a que se ejecute."""
+    if kind not in _handlers:
+        raise ValueError(f'tipo de job desconocido: {kind}')
+    job_id = uuid.uuid4().hex
+    insert_job(job_id, kind, payload, owner=JOB_OWNER)
+    _executor_for(kind).submit(_run_job, job_id, kind, payload)
+    return job_id
+
+
+def job_status(job_id):
+    return get_job(job_id)
+
+
+def resume_jobs():
+    """Re-encola los jobs que no terminaron (p.ej. por un reinicio del servidor).
+
+    Cada job se reclama de forma atómica antes de enviarlo al pool, así que si
+    varios procesos lo intentan a la vez solo uno lo ejecuta.
+    """
+    pending = list_jobs(status=['queued', 'running'], limit=1000)
+    resumed = 0
+    for job in reversed(pending):
+        if job.get('owner') == JOB_OWNER:
+            continue
+        if not claim_job(job['job_id'], JOB_OWNER, expected_owner=job.get('owner'),
+                         progress=0, message='reanudado tras reinicio'):
+            continue
+        _executor_for(job['kind']).submit(_run_job, job['job_id'], job['kind'], job.get('payload'))
+        resumed += 1
+    if resumed:
+        print(f"jobs: {resumed} job(s) reanudados")
+    return resumed
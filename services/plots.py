@@ -0,0 +1,117 @@
+"""Registro de parcelas: lo que depende solo de la geometría se calcula una vez.
+
+Al subir un KML se guardan en la tabla `plots` la FeatureCollection, la geometría
+de la ROI (primera feature), sus bounds, área y perímetro geodésicos, la huella
+canónica, la versión preparada para enviar a EE (utils_pkg/geometry_prep.py) con
+su informe y el índice de features (id, nombre, bounds, área). Las rutas resuelven un `kml_id` con `get_plot`, que
+sirve desde un LRU en memoria delante de SQLite; los KML subidos antes de
+existir el registro se leen de kml_uploads/<id>.geojson la primera vez y quedan
+registrados.
+
+Los dicts devueltos se comparten entre peticiones: no modificarlos.
+"""
+import os
+import json
+import threading
+from collections import OrderedDict
+from pathlib import Path
+from config import BASE_OUTPUT_DIR
+from services import db
+from utils_pkg.fingerprint import geometry_fingerprint
+from utils_pkg.geodesy import measure_geometries
+from utils_pkg.geometry_prep import prepare_geometry, describe_report
+from utils_pkg.roi import geojson_bounds
+
+PLOT_CACHE_ENTRIES = int(os.getenv('PLOT_CACHE_ENTRIES', '128'))
+
+_cache = OrderedDict()
+_lock = threading.Lock()
+
+
+def _uploads_path(plot_id):
+    return Path(BASE_OUTPUT_DIR) / 'kml_uploads' / f"{plot_id}.geojson"
+
+
+def build_plot(plot_id, fc):
+    """Calcula los artefactos de una parcela a partir de su FeatureCollection."""
+    if fc.get('type') == 'FeatureCollection':
+        features = fc.get('features') or []
+    else:
+        # GeoJSON suelto: tratarlo como una FeatureCollection de una feature
+        features = [{'type': 'Feature', 'properties': {}, 'geometry': fc}]
+        fc = {'type': 'FeatureCollection', 'features': features}
+    geometries = [f.get('geometry') if isinstance(f, dict) else None for f in features]
+    if not geometries or not geometries[0]:
+        raise ValueError('KML stored but contains no features')
+    areas, perimeters, bounds = measure_geometries(geometries)
+
+    index = []
+    for i, f in enumerate(features):
+        props = (f.get('properties') if isinstance(f, dict) else None) or {}
+        index.append({
+            'id': str(f.get('id') or props.get('id') or props.get('name') or f'feature_{i+1}'),
+            'name': props.get('name') or props.get('title') or None,
+            'bounds': None if bounds[i][0] != bounds[i][0] else [float(v) for v in bounds[i]],
+            'area_m2': None if areas[i] != areas[i] else float(areas[i]),
+        })
+
+    geom = geometries[0]
+    simplified, report = prepare_geometry(geom)
+    print(f"plot {plot_id}: {describe_report(report)}")
+    return {
+        'plot_id': plot_id,
+        'fingerprint': geometry_fingerprint(geom),
+        'feature_collection': fc,
+        'geometry': geom,
+        'simplified': simplified,
+        'simplified_report': report,
+        'bounds': geojson_bounds(geom),
+        'area_m2': index[0]['area_m2'],
+        'perimeter_m': None if perimeters[0] != perimeters[0] else float(perimeters[0]),
+        'features': index,
+        'features_count': len(features),
+    }
+
+
+def _remember(plot):
+    with _lock:
+        _cache[plot['plot_id']] = plot
+        _cache.move_to_end(plot['plot_id'])
+        while len(_cache) > PLOT_CACHE_ENTRIES:
+            _cache.popitem(last=False)
+
+
+def register_plot(plot_id, fc):
+    """Registra una parcela recién subida (SQLite + LRU) y la retorna."""
+    plot = build_plot(plot_id, fc)
+    db.upsert_plot(plot)
+    _remember(plot)
+    return plot
+
+
+def get_plot(plot_id):
+    """Parcela registrada (dict con geometry, simplified, simplified_report, bounds, area_m2,
+    fingerprint, feature_collection, features...) o None si el id no existe."""
+    if not plot_id:
+        return None
+    with _lock:
+        plot = _cache.get(plot_id)
+        if plot is not None:
+            _cache.move_to_end(plot_id)
+            return plot
+    plot = db.get_plot(plot_id)
+    if plot is None:
+        path = _uploads_path(plot_id)
+        if not path.exists():
+            return None
+        # KML subido antes del registro: calcular y registrar ahora
+        with open(path, 'r', encoding='utf-8') as fh:
+            fc = json.load(fh)
+        return register_plot(plot_id, fc)
+    if plot.get('simplified_report') is None:
+        # Registrada antes de existir la preparación de geometrías: prepararla ahora
+        plot['simplified'], plot['simplified_report'] = prepare_geometry(plot['geometry'])
+        if plot['simplified_report'] is not None:
+            db.upsert_plot(plot)
+    _remember(plot)
+    return plot
@@ -0,0 +1,99 @@
+"""Estadísticas progresivas: primero una reducción gruesa, después la refinada.
+
+Con `progressive=true`, /heatmap y /compute (heatmap) responden con las
+estadísticas de un plan `fast` (escala gruesa, pocos píxeles) y encolan un job
+`refine_stats` que repite la reducción a la escala de la calidad pedida (por
+defecto `accurate`, la nativa salvo en fincas enormes). El resultado refinado
+se consulta en /jobs/{job_id} o se recibe por SSE en /jobs/{job_id}/events.
+
+Si las dos escalas coinciden (parcelas pequeñas) no hay nada que refinar: la
+respuesta ya trae las estadísticas definitivas y no se encola ningún job.
+
+El composite se comparte con la petición original (services/ee/ee_composite.py),
+así que el job no vuelve a construirlo si sigue en el LRU.
+"""
+import ee
+from services.ee.ee_batch import get_info
+from services.ee.ee_composite import get_composite
+from services.ee.ee_indices import classify_breaks
+from services.jobs import submit_job, register_job_handler
+from utils_pkg import index_band_and_vis, prepared_ee_geometry
+from utils_pkg.stats_plan import plan_stats, reduce_region_args
+
+PREVIEW_QUALITY = 'fast'
+REFINED_QUALITY = 'accurate'
+STAT_NAMES = ('min', 'max', 'mean', 'stdDev', 'count')
+
+
+def stats_reducer():
+    return ee.Reducer.mean().combine(ee.Reducer.min(), None, True).combine(ee.Reducer.max(), None, True).combine(ee.Reducer.stdDev(), None, True).combine(ee.Reducer.count(), None, True)
+
+
+def stats_stack(composite, indices, classify=False):
+    """Una banda por índice (la primera, RGB: B4), nombrada como el índice.
+
+    Con `classify` los índices con vis discreta se reducen sobre su clase
+    (classify_breaks), como las estadísticas del heatmap de /compute.
+    """
+    bands = []
+    for idx in indices:
+        band, vis = index_band_and_vis(idx, satellite='sentinel2')
+        first_band = band if isinstance(band, str) else band[0]
+        img = composite.index(idx).select([first_band])
+        if classify and vis.get('discrete') and vis.get('breaks'):
+            img = classify_breaks(img, vis['breaks'])
+        bands.append(img.rename(idx))
+    return ee.Image.cat(bands)
+
+
+def reduce_stats(composite, indices, roi, plan, classify=False):
+    """Diccionario EE (sin evaluar) con <índice>_<min|max|mean|stdDev|count>."""
+    return stats_stack(composite, indices, classify).reduceRegion(stats_reducer(), geometry=roi, **reduce_region_args(plan))
+
+
+def stat_dict(stats_info, idx):
+    """Estadísticas de un índice en el resultado de reduce_stats (None si no hay)."""
+    if not stats_info:
+        return None
+    return {stat: stats_info.get(f'{idx}_{stat}') for stat in STAT_NAMES if stat != 'count'}
+
+
+def progressive_plans(roi_geojson, quality=None):
+    """(plan de la vista previa, plan refinado o None si no hay nada que refinar)."""
+    preview = plan_stats(roi_geojson, PREVIEW_QUALITY)
+    refined = plan_stats(roi_geojson, quality or REFINED_QUALITY)
+    if refined['scale_m'] >= preview['scale_m']:
+        return refined, None
+    return dict(preview, preview=True), refined
+
+
+def submit_refine_job(roi_geojson, start, end, cloud_pct, indices, plan, kml_id=None, classify=False):
+    """Encola el refinado y retorna las URLs para seguirlo."""
+    job_id = submit_job('refine_stats', {
+        'roi': roi_geojson, 'kml_id': kml_id, 'start': start, 'end': end, 'cloud_pct': cloud_pct,
+        'indices': list(indices), 'quality': plan['quality'], 'classify': classify,
+    })
+    return {'job_id': job_id, 'status_url': f'/jobs/{job_id}', 'events_url': f'/jobs/{job_id}/events', 'stats_plan': plan}
+
+
+def _refine_stats_job(payload, progress):
+    from services.plots import get_plot
+
+    roi_geojson = payload['roi']
+    plot = get_plot(payload.get('kml_id')) if payload.get('kml_id') else None
+    roi = ee.Geometry(plot['simplified']) if plot else prepared_ee_geometry(roi_geojson)
+    indices = payload['indices']
+    plan = plan_stats(roi_geojson, payload.get('quality'))
+    progress(0, 1, f"refinando estadísticas a {plan['scale_m']} m")
+
+    composite = get_composite(roi, payload['start'], payload['end'], payload['cloud_pct'], roi_geojson=roi_geojson)
+    stats_info = get_info(reduce_stats(composite, indices, roi, plan, payload.get('classify', False))) or {}
+    progress(1, 1)
+    return {
+        'stats': {idx: stat_dict(stats_info, idx) for idx in indices},
+        'stats_plan': dict(plan, pixel_count=stats_info.get(f'{indices[0]}_count')),
+    }
+
+
+# Pool propio: el refinado no debe esperar detrás de los batch de /stats/kml
+register_job_handler('refine_stats', _refine_stats_job, lane='interactive')
@@ -0,0 +1,62 @@
+"""Series temporales incrementales: cada pasada de Sentinel-2 se calcula en EE una sola vez.
+
+La media del índice en una pasada depende solo de la imagen y de la parcela, así
+que se guarda en `series_points` por (huella de geometría, índice, escala) y la cobertura
+de fechas ya consultadas se registra en `fetch_coverage` con el umbral de nubes
+usado. Una petición pide a EE solo los huecos (en un único getInfo) y devuelve la
+serie completa ordenada desde SQLite. Lo consultado con un umbral más permisivo
+sirve también a umbrales más estrictos filtrando por cloud_cover. La escala de
+la reducción por pasada sale de utils_pkg.stats_plan (área de la ROI y calidad).
+
+Si ninguna pasada de la ventana queda bajo el umbral se repite con
+SERIES_FALLBACK_CLOUD_PCT, la misma regla que get_sentinel2_time_series; esas
+pasadas también se guardan y la próxima petición se sirve desde SQLite.
+"""
+import datetime
+from services.coverage import coverage_segments, record_coverage, SERIES_POINTS
+from services.db import insert_series_points, series_points_in_range
+from services.ee.ee_client import get_sentinel2_series_passes, series_threshold, SERIES_FALLBACK_CLOUD_PCT
+from utils_pkg import geometry_fingerprint, normalize_date, normalize_cloud_pct, round_sig
+from utils_pkg.stats_plan import plan_stats
+
+
+def series_key(roi_geojson, index, scale_m):
+    # Medias a escalas distintas no son intercambiables: la escala forma parte de la clave
+    return f"{geometry_fingerprint(roi_geojson)}:{index.lower()}:{scale_m}m"
+
+
+def _series_point(p):
+    # Mismo formato que get_sentinel2_time_series
+    date_str = datetime.datetime.fromtimestamp(p['system_time_start'] / 1000).strftime('%Y-%m-%d')
+    return {'date': date_str, 'datetime': date_str + ' 12:00:00', 'timestamp': p['system_time_start'], 'mean': round_sig(p['value'], sig=2)}
+
+
+def _stored_passes(roi, key, start, end, index, threshold, plan):
+    segments = coverage_segments(SERIES_POINTS, key, start, end, min_param=threshold)
+    gaps = [(a, b) for a, b, covered in segments if not covered]
+    if gaps:
+        passes = get_sentinel2_series_passes(roi, gaps, index, threshold, plan['scale_m'], plan['max_pixels'])
+        insert_series_points(key, passes)
+        for a, b in gaps:
+            record_coverage(SERIES_POINTS, key, a, b, param=threshold)
+    print(f"series {key} (nubes<{threshold}): {len(segments) - len(gaps)} tramo(s) desde BD, {len(gaps)} consultado(s) en EE")
+
+    points = [_series_point(p) for p in series_points_in_range(key, start, end, max_cloud=threshold)]
+    return [p for p in points if p['mean'] is not None]
+
+
+def incremental_time_series(roi, roi_geojson, start, end, index, cloud_pct=70, plan=None):
+    """Serie de pasadas de [start, end) consultando en EE solo las fechas no guardadas.
+
+    `plan`: plan_stats(roi_geojson, quality, series=True); sin él, la calidad por defecto.
+    Sin ninguna pasada bajo el umbral se usa SERIES_FALLBACK_CLOUD_PCT en toda la ventana.
+    """
+    start, end = normalize_date(start), normalize_date(end)
+    threshold = series_threshold(normalize_cloud_pct(cloud_pct))
+    plan = plan or plan_stats(roi_geojson, series=True)
+    key = series_key(roi_geojson, index, plan['scale_m'])
+
+    points = _stored_passes(roi, key, start, end, index, threshold, plan)
+    if not points and threshold < SERIES_FALLBACK_CLOUD_PCT:
+        points = _stored_passes(roi, key, start, end, index, SERIES_FALLBACK_CLOUD_PCT, plan)
+    return points
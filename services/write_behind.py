@@ -0,0 +1,160 @@
+"""Cola write-behind: las inserciones de bookkeeping (assets, measurements) salen
+del camino de la petición.
+
+Las rutas encolan las filas y responden; un único hilo escritor las agrupa y las
+escribe con los inserts masivos de services/db.py cuando el lote llega a
+WRITE_BEHIND_BATCH_SIZE filas o han pasado WRITE_BEHIND_FLUSH_S segundos, y al
+apagar la aplicación. Las lecturas que deben ver lo recién escrito (/assets,
+/measurements) llaman antes a `flush()`, que espera como mucho
+WRITE_BEHIND_FLUSH_TIMEOUT_S: si el escritor va retrasado la lectura responde
+sin las últimas filas en vez de bloquear la petición (se escriben igualmente).
+
+Si un lote falla se reintenta fila a fila; las filas que siguen fallando se
+guardan en `rejected` (con el error) y se cuentan en `failed`, que /health
+expone junto a la profundidad de la cola.
+"""
+import os
+import queue
+import collections
+import threading
+import time
+from services.db import insert_assets, insert_measurements
+
+WRITE_BEHIND_BATCH_SIZE = int(os.getenv('WRITE_BEHIND_BATCH_SIZE', '500'))
+WRITE_BEHIND_FLUSH_S = float(os.getenv('WRITE_BEHIND_FLUSH_S', '1.0'))
+WRITE_BEHIND_FLUSH_TIMEOUT_S = float(os.getenv('WRITE_BEHIND_FLUSH_TIMEOUT_S', '2.0'))
+WRITE_BEHIND_REJECTED_MAX = 1000
+
+_WRITERS = {
+    'asset': insert_assets,
+    'measurement': insert_measurements,
+}
+
+
+class _FlushRequest:
+    def __init__(self):
+        self.done = threading.Event()
+
+
+class WriteBehindQueue:
+
+    def __init__(self, batch_size=WRITE_BEHIND_BATCH_SIZE, flush_s=WRITE_BEHIND_FLUSH_S):
+        self.batch_size = batch_size
+        self.flush_s = flush_s
+        self._queue = queue.Queue()
+        self._thread = None
+        self._lock = threading.Lock()
+        self._stopping = False
+        self._pending = 0  # filas sacadas de la cola pero aún no escritas
+        self.written = 0
+        self.failed = 0
+        self.rejected = collections.deque(maxlen=WRITE_BEHIND_REJECTED_MAX)  # (kind, fila, error)
+
+    def start(self):
+        with self._lock:
+            if self._thread is not None and self._thread.is_alive():
+                return
+            self._stopping = False
+            self._thread = threading.Thread(target=self._run, name='db-writer', daemon=True)
+            self._thread.start()
+
+    def _running(self):
+        return self._thread is not None and self._thread.is_alive() and not self._stopping
+
+    def add(self, kind, row):
+        if kind not in _WRITERS:
+            raise ValueError(f'tipo de fila desconocido: {kind}')
+        if not self._running():
+            # Sin hilo escritor (p.ej. scripts o tras el apagado): escribir directamente
+            _WRITERS[kind]([row])
+            return
+        self._queue.put((kind, row))
+
+    def add_asset(self, **fields):
+        self.add('asset', fields)
+
+    def add_measurements(self, rows):
+        for row in rows:
+            self.add('measurement', row)
+
+    def depth(self):
+        """Filas pendientes de escribir (en cola + en el lote en curso)."""
+        return self._queue.qsize() + self._pending
+
+    def flush(self, timeout=None):
+        """Espera a que todo lo encolado hasta ahora esté en la BD.
+
+        Espera como mucho `timeout` segundos (WRITE_BEHIND_FLUSH_TIMEOUT_S por
+        defecto) y retorna False si venció antes de escribirse todo.
+        """
+        if not self._running():
+            return True
+        if timeout is None:
+            timeout = WRITE_BEHIND_FLUSH_TIMEOUT_S
+        req = _FlushRequest()
+        self._queue.put(req)
+        if req.done.wait(timeout):
+            return True
+        print(f"write-behind: flush sin completar tras {timeout}s ({self.depth()} filas pendientes)")
+        return False
+
+    def stop(self, timeout=30.0):
+        """Vacía la cola y detiene el hilo escritor (al apagar la aplicación)."""
+        if self._thread is None:
+            return
+        self.flush(timeout)
+        self._stopping = True
+        self._queue.put(None)
+        self._thread.join(timeout)
+        self._thread = None
+
+    def _write(self, batch):
+        by_kind = {}
+        for kind, row in batch:
+            by_kind.setdefault(kind, []).append(row)
+        for kind, rows in by_kind.items():
+            try:
+                self.written += _WRITERS[kind](rows) or 0
+            except Exception as e:
+                # Aislar filas problemáticas para no perder el lote completo
+                print(f"write-behind: fallo escribiendo {len(rows)} {kind}(s), reintentando una a una: {e}")
+                for row in rows:
+                    try:
+                        self.written += _WRITERS[kind]([row]) or 0
+                    except Exception as row_error:
+                        self.failed += 1
+                        self.rejected.append((kind, row, str(row_error)))
+                        print(f"write-behind: fila {kind} rechazada: {row_error}")
+
+    def _run(self):
+        batch = []
+        deadline = None
+        while True:
+            timeout = None if deadline is None else max(0.0, deadline - time.monotonic())
+            try:
+                item = self._queue.get(timeout=timeout)
+            except queue.Empty:
+                item = False  # venció el plazo del lote
+
+            if isinstance(item, tuple):
+                batch.append(item)
+                self._pending = len(batch)
+                if deadline is None:
+                    deadline = time.monotonic() + self.flush_s
+                if len(batch) < self.batch_size:
+                    continue
+
+            if batch:
+                self._write(batch)
+                batch = []
+                self._pending = 0
+            deadline = None
+
+            if isinstance(item, _FlushRequest):
+                item.done.set()
+            elif item is None:
+                return
+
+
+# Instancia compartida por las rutas
+db_writer = WriteBehindQueue()
@@ -0,0 +1,21 @@
+import os
+import sys
+import tempfile
+from pathlib import Path
+
+import pytest
+
+# BASE_OUTPUT_DIR debe fijarse antes de importar config/services
+os.environ['BASE_OUTPUT_DIR'] = tempfile.mkdtemp(prefix='terra_tests_')
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+
+@pytest.fixture
+def db(tmp_path, monkeypatch):
+    """services.db sobre una base SQLite vacía en tmp_path (sin migrar: llamar a init_db)."""
+    from services import db as db_module
+
+    db_module.close_connections()
+    monkeypatch.setattr(db_module, 'DB_PATH', tmp_path / 'terra.db')
+    yield db_module
+    db_module.close_connections()
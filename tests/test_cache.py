@@ -0,0 +1,82 @@
+import json
+import time
+import uuid
+
+import pytest
+
+from utils_pkg import cache as cache_module
+from utils_pkg.cache import TieredCache
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    now = [1_000_000.0]
+    monkeypatch.setattr(cache_module.time, 'time', lambda: now[0])
+    return now
+
+
+def _cache(**kw):
+    params = dict(ttl_s=100, refresh_after_s=60, memory_max_entries=8, disk_max_bytes=1024 * 1024)
+    params.update(kw)
+    return TieredCache(f'test{uuid.uuid4().hex[:8]}', **params)
+
+
+def _wait_for(predicate, timeout=5):
+    deadline = time.monotonic() + timeout
+    while not predicate():
+        if time.monotonic() > deadline:
+            raise AssertionError('timeout')
+        time.sleep(0.01)
+
+
+def test_fresh_stale_and_expired(clock):
+    c = _cache()
+    c.set('k', {'a': 1})
+    assert c.lookup('k') == ({'a': 1}, 'fresh')
+    clock[0] += 61
+    assert c.lookup('k') == ({'a': 1}, 'stale')
+    clock[0] += 40
+    assert c.lookup('k') == (None, None)
+    assert not c._path('k').exists()
+
+
+def test_get_or_compute_computes_once(clock):
+    c = _cache()
+    calls = []
+    compute = lambda: calls.append(1) or len(calls)
+    assert c.get_or_compute('k', compute) == 1
+    assert c.get_or_compute('k', compute) == 1
+    assert len(calls) == 1
+
+
+def test_stale_value_is_served_and_refreshed_in_background(clock):
+    c = _cache()
+    c.set('k', 'old')
+    clock[0] += 61
+    assert c.get_or_compute('k', lambda: 'new') == 'old'
+    _wait_for(lambda: c.lookup('k') == ('new', 'fresh'))
+
+
+def test_memory_lru_falls_back_to_disk(clock):
+    c = _cache(memory_max_entries=2)
+    for i in range(3):
+        c.set(f'k{i}', i)
+    assert 'k0' not in c._memory
+    assert c.get('k0') == 0
+
+
+def test_disk_budget_drops_oldest_files(clock):
+    c = _cache(disk_max_bytes=200)
+    for i in range(10):
+        c.set(f'k{i}', 'x' * 30)
+    files = sorted(cache_module._cache_dir().glob(f'{c.prefix}_*.json'))
+    assert sum(f.stat().st_size for f in files) <= 200
+    assert c._path('k9').exists()
+
+
+def test_legacy_value_only_files_are_read():
+    # Formato anterior: solo el valor; la antigüedad sale de la fecha del fichero
+    c = _cache()
+    with open(c._path('old'), 'w', encoding='utf-8') as fh:
+        json.dump({'tile_url_template': 'u'}, fh)
+    assert c.lookup('old') == ({'tile_url_template': 'u'}, 'fresh')
@@ -0,0 +1,79 @@
+import uuid
+from collections import OrderedDict
+
+import pytest
+
+from services.ee import ee_client, ee_composite
+from utils_pkg.cache import TieredCache
+
+SQUARE = [[-74.0, 4.0], [-73.99, 4.0], [-73.99, 4.01], [-74.0, 4.01], [-74.0, 4.0]]
+
+
+def _roi(dx=0.0):
+    return {'type': 'Polygon', 'coordinates': [[[x + dx, y] for x, y in SQUARE]]}
+
+
+class _FakeCollection:
+    """Lo mínimo que usa Sentinel2Composite, sin EE."""
+
+    def mean(self):
+        return self
+
+    def clip(self, roi):
+        return self
+
+    def size(self):
+        return 'size'
+
+
+@pytest.fixture
+def composites(monkeypatch):
+    built, derived, evaluated = [], [], []
+    monkeypatch.setattr(ee_client, 'get_sentinel2_collection', lambda *a, **kw: built.append(a) or _FakeCollection())
+    monkeypatch.setattr(ee_composite, 'index_from_composite', lambda image, idx, roi: derived.append(idx) or f'img:{idx}')
+    monkeypatch.setattr(ee_composite, 'get_info', lambda obj: evaluated.append(obj) or 7)
+    monkeypatch.setattr(ee_composite, '_composites', OrderedDict())
+    counts = TieredCache(f'test{uuid.uuid4().hex[:8]}', ttl_s=100, refresh_after_s=100, memory_max_entries=16, disk_max_bytes=1024 * 1024)
+    monkeypatch.setattr(ee_composite, '_image_counts', counts)
+    return built, derived, evaluated
+
+
+def test_same_roi_and_window_share_one_composite(composites):
+    built, derived, _ = composites
+    a = ee_composite.get_composite('roi', '2024-01-01', '2024-02-01', 30, roi_geojson=_roi())
+    # Misma geometría con otro orden de vértices: misma huella
+    b = ee_composite.get_composite('roi', '2024-01-01', '2024-02-01', 30, roi_geojson={'type': 'Polygon', 'coordinates': [SQUARE[::-1]]})
+    assert a is b and len(built) == 1
+    assert a.index('NDVI') == a.index('ndvi') == 'img:ndvi'
+    a.index('evi')
+    assert derived == ['ndvi', 'evi']
+    # Otra ventana u otro umbral de nubes: otro composite
+    assert ee_composite.get_composite('roi', '2024-01-01', '2024-03-01', 30, roi_geojson=_roi()) is not a
+    assert ee_composite.get_composite('roi', '2024-01-01', '2024-02-01', 50, roi_geojson=_roi()) is not a
+    # Sin huella no se comparte
+    assert ee_composite.get_composite('roi', '2024-01-01', '2024-02-01', 30) is not a
+
+
+def test_least_recently_used_composite_is_evicted(composites, monkeypatch):
+    built, _, _ = composites
+    monkeypatch.setattr(ee_composite, 'COMPOSITE_CACHE_ENTRIES', 2)
+    first = ee_composite.get_composite('roi', '2024-01-01', '2024-02-01', roi_geojson=_roi(0))
+    second = ee_composite.get_composite('roi', '2024-01-01', '2024-02-01', roi_geojson=_roi(1))
+    # Usar el primero lo hace el más reciente: sale el segundo
+    assert ee_composite.get_composite('roi', '2024-01-01', '2024-02-01', roi_geojson=_roi(0)) is first
+    ee_composite.get_composite('roi', '2024-01-01', '2024-02-01', roi_geojson=_roi(2))
+    assert len(ee_composite._composites) == 2
+    assert ee_composite.get_composite('roi', '2024-01-01', '2024-02-01', roi_geojson=_roi(0)) is first
+    assert ee_composite.get_composite('roi', '2024-01-01', '2024-02-01', roi_geojson=_roi(1)) is not second
+    assert len(built) == 4
+
+
+def test_image_count_is_evaluated_once_per_window(composites):
+    _, _, evaluated = composites
+    c = ee_composite.get_composite('roi', '2024-01-01', '2024-02-01', roi_geojson=_roi())
+    assert c.count() == 7 and c.count() == 7
+    assert evaluated == ['size']
+    # Un conteo ya evaluado junto a otros resultados no vuelve a EE
+    other = ee_composite.get_composite('roi', '2024-02-01', '2024-03-01', roi_geojson=_roi())
+    other.remember_count(3)
+    assert other.count() == 3 and evaluated == ['size']
@@ -0,0 +1,39 @@
+import datetime
+
+from services import coverage
+from services.coverage import split_by_coverage, missing_intervals, coverage_segments, record_coverage
+
+
+def test_split_by_coverage():
+    covered = [('2024-01-10', '2024-01-20'), ('2024-02-01', '2024-02-10')]
+    assert split_by_coverage('2024-01-01', '2024-02-05', covered) == [
+        ('2024-01-01', '2024-01-10', False),
+        ('2024-01-10', '2024-01-20', True),
+        ('2024-01-20', '2024-02-01', False),
+        ('2024-02-01', '2024-02-05', True),
+    ]
+    assert missing_intervals('2024-01-12', '2024-01-18', covered) == []
+    assert missing_intervals('2024-03-01', '2024-03-05', covered) == [('2024-03-01', '2024-03-05')]
+
+
+def test_recorded_intervals_merge(db):
+    db.init_db()
+    assert record_coverage('ds', 'geo', '2023-01-01', '2023-02-01', param=30)
+    assert record_coverage('ds', 'geo', '2023-02-01', '2023-03-01', param=30)
+    assert db.get_coverage('ds', 'geo', '2022-01-01', '2024-01-01') == [('2023-01-01', '2023-03-01')]
+    # Otro parámetro (cloud_pct) u otra clave no comparten cobertura
+    assert coverage_segments('ds', 'geo', '2023-01-15', '2023-02-15', param=50) == [('2023-01-15', '2023-02-15', False)]
+    assert coverage_segments('ds', 'other', '2023-01-15', '2023-02-15', param=30) == [('2023-01-15', '2023-02-15', False)]
+    assert coverage_segments('ds', 'geo', '2023-01-15', '2023-02-15', min_param=20) == [('2023-01-15', '2023-02-15', True)]
+
+
+def test_recent_days_are_not_recorded(db):
+    db.init_db()
+    today = datetime.datetime.utcnow().date()
+    start = (today - datetime.timedelta(days=30)).strftime('%Y-%m-%d')
+    end = (today + datetime.timedelta(days=1)).strftime('%Y-%m-%d')
+    record_coverage('ds', 'geo', start, end)
+    settled = (today - datetime.timedelta(days=coverage.COVERAGE_SETTLE_DAYS)).strftime('%Y-%m-%d')
+    assert db.get_coverage('ds', 'geo', start, end) == [(start, settled)]
+    recent = (today - datetime.timedelta(days=1)).strftime('%Y-%m-%d')
+    assert not record_coverage('ds', 'geo', recent, end)
@@ -0,0 +1,186 @@
+import hashlib
+import json
+import sqlite3
+
+import pytest
+
+# Esquema de measurements anterior a las migraciones (sin índices ni clave natural)
+BASELINE_MEASUREMENTS = '''
+CREATE TABLE measurements (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    metric_id TEXT, tenant_id TEXT, plot_id TEXT, ts TEXT,
+    metric_type TEXT, value REAL, quality TEXT
+)'''
+
+
+def _seed_baseline(db, rows):
+    conn = sqlite3.connect(str(db.DB_PATH))
+    conn.execute(BASELINE_MEASUREMENTS)
+    conn.executemany('INSERT INTO measurements(plot_id, ts, metric_type, value) VALUES (?, ?, ?, ?)', rows)
+    conn.commit()
+    conn.close()
+
+
+def _values(db):
+    return sorted((m['plot_id'] or '', m['ts'], m['value']) for m in db.list_measurements(limit=1000))
+
+
+def test_migrations_reach_latest_version_and_are_idempotent(db):
+    db.init_db()
+    assert db.schema_version() == len(db.MIGRATIONS)
+    assert db.migrate_db() == len(db.MIGRATIONS)
+
+
+def test_migration_keeps_rows_without_plot_id(db):
+    _seed_baseline(db, [
+        (None, '2024-01-01', 'ndvi', 0.1),   # ROI A
+        (None, '2024-01-01', 'ndvi', 0.2),   # ROI B, mismo índice y fecha
+        ('p1', '2024-01-01', 'ndvi', 0.3),
+        ('p1', '2024-01-01', 'ndvi', 0.4),   # duplicado real: se compacta
+    ])
+    db.init_db()
+    assert _values(db) == [('', '2024-01-01', 0.1), ('', '2024-01-01', 0.2), ('p1', '2024-01-01', 0.4)]
+
+
+def test_upsert_by_natural_key(db):
+    db.init_db()
+    db.insert_measurements([
+        {'plot_id': 'p1', 'ts': '2024-01-01', 'metric_type': 'ndvi', 'value': 0.1},
+        {'plot_id': 'p1', 'ts': '2024-01-01', 'metric_type': 'ndwi', 'value': 0.2},
+        {'plot_id': 'p2', 'ts': '2024-01-01', 'metric_type': 'ndvi', 'value': 0.3},
+    ])
+    first = db.insert_measurement(plot_id='p1', ts='2024-01-01', metric_type='ndvi', value=0.5, quality='ok')
+    again = db.insert_measurement(plot_id='p1', ts='2024-01-01', metric_type='ndvi', value=0.6)
+    assert first == again
+    rows = db.list_measurements(plot_id='p1', metric_type='ndvi')
+    assert [(r['value'], r['quality']) for r in rows] == [(0.6, 'ok')]
+    assert len(db.list_measurements(limit=1000)) == 3
+
+
+def test_upsert_never_merges_rows_without_plot_id(db):
+    db.init_db()
+    row = {'plot_id': None, 'ts': '2024-01-01', 'metric_type': 'ndvi'}
+    db.insert_measurements([dict(row, value=0.1), dict(row, value=0.2)])
+    db.insert_measurement(value=0.3, **row)
+    assert _values(db) == [('', '2024-01-01', 0.1), ('', '2024-01-01', 0.2), ('', '2024-01-01', 0.3)]
+
+
+def test_tenant_is_part_of_the_natural_key(db):
+    db.init_db()
+    row = {'plot_id': 'p1', 'ts': '2024-01-01', 'metric_type': 'ndvi'}
+    db.insert_measurements([dict(row, tenant_id='t1', value=0.1), dict(row, tenant_id='t2', value=0.2)])
+    assert len(db.list_measurements(plot_id='p1')) == 2
+
+
+def test_failed_transaction_is_rolled_back(db):
+    db.init_db()
+    with pytest.raises(RuntimeError):
+        with db._transaction() as conn:
+            conn.execute("INSERT INTO measurements(plot_id, ts, metric_type, value) VALUES ('p1', '2024-01-01', 'ndvi', 0.1)")
+            raise RuntimeError('boom')
+    assert not db._connect().in_transaction
+    assert db.list_measurements() == []
+
+
+def test_other_threads_reopen_after_close_connections(db):
+    from concurrent.futures import ThreadPoolExecutor
+
+    db.init_db()
+    with ThreadPoolExecutor(max_workers=1) as pool:
+        pool.submit(db.insert_measurement, plot_id='p1', ts='2024-01-01', metric_type='ndvi', value=0.1).result()
+        db.close_connections()
+        pool.submit(db.insert_measurement, plot_id='p1', ts='2024-01-02', metric_type='ndvi', value=0.2).result()
+    assert len(db.list_measurements()) == 2
+
+
+def test_keyset_pages_cover_all_rows_once(db):
+    db.init_db()
+    db.insert_measurements([{'plot_id': 'p1', 'ts': f'2024-01-{d:02d}', 'metric_type': 'ndvi', 'value': d} for d in range(1, 26)])
+    seen, cursor = [], None
+    while True:
+        page = db.list_measurements(plot_id='p1', limit=10, cursor=cursor)
+        seen.extend(r['ts'] for r in page)
+        cursor = db.next_page_cursor(page, 10, db.MEASUREMENTS_PAGE_KEYS)
+        if not cursor:
+            break
+    assert seen == sorted(seen, reverse=True) and len(set(seen)) == 25
+
+
+def test_keyset_pages_include_rows_with_null_keys(db):
+    db.init_db()
+    db.insert_measurements([{'plot_id': 'p1', 'ts': ts, 'metric_type': 'ndvi', 'value': i}
+                            for i, ts in enumerate(['2024-01-01', None, '2024-01-02', None, '2024-01-03'])])
+    db.insert_assets([{'asset_id': f'a{i}', 'ingested_ts': ts} for i, ts in enumerate([None, '2024-01-01', None, '2024-01-02'])])
+    values, cursor = [], None
+    while True:
+        page = db.list_measurements(limit=2, cursor=cursor)
+        values.extend(r['value'] for r in page)
+        cursor = db.next_page_cursor(page, 2, db.MEASUREMENTS_PAGE_KEYS)
+        if not cursor:
+            break
+    # Sin fecha al final, desempatadas por id
+    assert values == [4, 2, 0, 3, 1]
+    assert [a['asset_id'] for a in db.iter_assets(batch_size=1)] == ['a3', 'a1', 'a2', 'a0']
+
+
+def test_sentinel2_dates_legacy_geometry_ids_are_migrated(db):
+    from utils_pkg.fingerprint import geometry_fingerprint
+
+    db.init_db()
+    roi = {'type': 'Polygon', 'coordinates': [[[0, 0], [0, 1], [1, 1], [1, 0], [0, 0]]]}
+    legacy_id = hashlib.sha256(json.dumps(roi, sort_keys=True).encode()).hexdigest()[:16]
+    new_id = geometry_fingerprint(roi)
+    db.insert_sentinel2_dates(legacy_id, [{'date': '2024-01-01', 'system_time_start': 1}, {'date': '2024-01-06', 'system_time_start': 2}], roi_geojson=roi)
+    db.insert_sentinel2_dates(new_id, [{'date': '2024-01-06', 'system_time_start': 2}], roi_geojson=roi)
+    conn = db._connect()
+    conn.execute('PRAGMA user_version = 8')
+    conn.commit()
+    db.migrate_db()
+    rows = db.get_sentinel2_dates()
+    assert sorted((r['geometry_id'], r['date']) for r in rows) == [(new_id, '2024-01-01'), (new_id, '2024-01-06')]
+
+
+@pytest.mark.parametrize('legacy', [False, True])
+def test_sentinel2_dates_keep_tiles_of_the_same_pass(db, legacy):
+    if legacy:
+        # Tabla anterior a la migración 4, con la restricción UNIQUE en línea
+        conn = sqlite3.connect(str(db.DB_PATH))
+        conn.execute('''CREATE TABLE sentinel2_dates (
+            id INTEGER PRIMARY KEY AUTOINCREMENT, geometry_id TEXT NOT NULL, user_id TEXT, date TEXT NOT NULL,
+            system_time_start INTEGER, cloud_cover REAL, tile_id TEXT, roi_geojson TEXT,
+            created_at TEXT DEFAULT CURRENT_TIMESTAMP, UNIQUE(geometry_id, date, system_time_start))''')
+        conn.execute("INSERT INTO sentinel2_dates(geometry_id, date, system_time_start, tile_id) VALUES ('g', '2024-01-01', 1, 'T18NWL')")
+        conn.commit()
+        conn.close()
+    db.init_db()
+    sql = db._connect().execute("SELECT sql FROM sqlite_master WHERE name = 'sentinel2_dates'").fetchone()[0]
+    assert 'UNIQUE' not in sql.upper()
+    tiles = [{'date': '2024-01-01', 'system_time_start': 1, 'tile_id': t} for t in ('T18NWL', 'T18NXL')]
+    assert db.insert_sentinel2_dates('g', tiles) == (1 if legacy else 2)
+    assert db.insert_sentinel2_dates('g', tiles) == 0
+    assert sorted(r['tile_id'] for r in db.get_sentinel2_dates(geometry_id='g')) == ['T18NWL', 'T18NXL']
+
+
+def _plot(plot_id, w, s, e, n):
+    return {'plot_id': plot_id, 'fingerprint': plot_id, 'feature_collection': {}, 'geometry': {},
+            'bounds': [w, s, e, n], 'features': [{'id': 'f1', 'bounds': [w, s, e, n]}], 'features_count': 1}
+
+
+def test_plots_rtree_follows_upserts(db):
+    db.init_db()
+    db.upsert_plot(_plot('a', 0, 0, 1, 1))
+    db.upsert_plot(_plot('b', 5, 5, 6, 6))
+    assert [p['plot_id'] for p in db.search_plots([0.5, 0.5, 2, 2])] == ['a']
+    assert [p['plot_id'] for p in db.search_plots([0.2, 0.2, 0.3, 0.3], relation='covers')] == ['a']
+    assert db.search_plots([0.5, 0.5, 2, 2], relation='covers') == []
+    # Re-registrar la parcela mueve su entrada en el índice
+    db.upsert_plot(_plot('b', 10, 10, 11, 11))
+    assert db.search_plots([5, 5, 6, 6]) == []
+    assert [p['plot_id'] for p in db.search_plots([10.5, 10.5, 12, 12])] == ['b']
+
+
+def test_assets_rtree_search(db):
+    db.init_db()
+    db.insert_assets([{'asset_id': 'x', 'bbox': [0, 0, 1, 1]}, {'asset_id': 'y', 'bbox': [3, 3, 4, 4]}])
+    assert sorted(a['asset_id'] for a in db.search_assets(bbox=[0.5, 0.5, 3.5, 3.5])) == ['x', 'y']
+    assert [a['asset_id'] for a in db.search_assets(bbox=[3.2, 3.2, 3.4, 3.4], relation='covers')] == ['y']
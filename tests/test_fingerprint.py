@@ -0,0 +1,67 @@
+from utils_pkg.fingerprint import canonical_geometry, geometry_fingerprint, request_fingerprint, normalize_date, normalize_cloud_pct
+
+SQUARE = [[-74.0, 4.0], [-73.99, 4.0], [-73.99, 4.01], [-74.0, 4.01], [-74.0, 4.0]]
+
+
+def _polygon(ring, holes=()):
+    return {'type': 'Polygon', 'coordinates': [ring] + list(holes)}
+
+
+def _rotated(ring, k):
+    open_ring = ring[:-1]
+    open_ring = open_ring[k:] + open_ring[:k]
+    return open_ring + [open_ring[0]]
+
+
+def test_fingerprint_ignores_ring_rotation():
+    fp = geometry_fingerprint(_polygon(SQUARE))
+    for k in range(1, 4):
+        assert geometry_fingerprint(_polygon(_rotated(SQUARE, k))) == fp
+
+
+def test_fingerprint_ignores_winding():
+    assert geometry_fingerprint(_polygon(SQUARE[::-1])) == geometry_fingerprint(_polygon(SQUARE))
+
+
+def test_fingerprint_ignores_closing_point_precision_and_altitude():
+    open_ring = [[x + 1e-9, y, 2600.0] for x, y in SQUARE[:-1]]
+    assert geometry_fingerprint(_polygon(open_ring)) == geometry_fingerprint(_polygon(SQUARE))
+
+
+def test_fingerprint_hole_order_and_winding():
+    hole_a = [[-73.998, 4.002], [-73.997, 4.002], [-73.997, 4.003], [-73.998, 4.002]]
+    hole_b = [[-73.995, 4.005], [-73.994, 4.005], [-73.994, 4.006], [-73.995, 4.005]]
+    a = _polygon(SQUARE, [hole_a, hole_b])
+    b = _polygon(_rotated(SQUARE[::-1], 2), [hole_b[::-1], hole_a])
+    assert geometry_fingerprint(a) == geometry_fingerprint(b)
+    # Exterior antihorario, huecos horarios (RFC 7946)
+    canonical = canonical_geometry(a)['coordinates']
+    assert canonical[0][0] == min(canonical[0][:-1])
+    assert canonical[0][0] == canonical[0][-1]
+
+
+def test_fingerprint_distinguishes_geometries():
+    moved = [[x + 0.001, y] for x, y in SQUARE]
+    assert geometry_fingerprint(_polygon(moved)) != geometry_fingerprint(_polygon(SQUARE))
+
+
+def test_feature_and_single_multipolygon_match_polygon():
+    poly = _polygon(SQUARE)
+    assert geometry_fingerprint({'type': 'Feature', 'properties': {'name': 'x'}, 'geometry': poly}) == geometry_fingerprint(poly)
+    assert geometry_fingerprint({'type': 'MultiPolygon', 'coordinates': [[SQUARE]]}) == geometry_fingerprint(poly)
+
+
+def test_request_fingerprint_normalizes_params():
+    poly = _polygon(SQUARE)
+    a = request_fingerprint(poly, kind='heatmap', start='2024-1-5', cloud_pct=30.0)
+    b = request_fingerprint(_polygon(SQUARE[::-1]), kind='heatmap', start='2024-01-05T10:00:00Z', cloud_pct=30)
+    assert a == b
+    assert a != request_fingerprint(poly, kind='heatmap', start='2024-01-06', cloud_pct=30)
+
+
+def test_normalizers():
+    assert normalize_date('2024-1-5') == '2024-01-05'
+    assert normalize_date('2024-01-05T23:00:00Z') == '2024-01-05'
+    assert normalize_cloud_pct(120) == 100
+    assert normalize_cloud_pct(-3) == 0
+    assert normalize_cloud_pct('29.6') == 30
@@ -0,0 +1,57 @@
+import math
+
+import numpy as np
+import pytest
+
+from utils_pkg.geodesy import EARTH_AUTHALIC_RADIUS_M as R, measure_geometries, geodesic_area_m2, ring_areas_m2
+
+
+def _cell(w, s, e, n):
+    return {'type': 'Polygon', 'coordinates': [[[w, s], [e, s], [e, n], [w, n], [w, s]]]}
+
+
+def _cell_area(w, s, e, n):
+    # Área exacta de una celda lon/lat sobre la esfera: R² Δλ (sin φ2 - sin φ1)
+    return R ** 2 * math.radians(e - w) * (math.sin(math.radians(n)) - math.sin(math.radians(s)))
+
+
+@pytest.mark.parametrize('cell', [(-74.0, 4.0, -73.99, 4.01), (10.0, 59.0, 10.5, 59.5), (0.0, -1.0, 1.0, 1.0)])
+def test_area_of_lonlat_cell(cell):
+    assert geodesic_area_m2(_cell(*cell)) == pytest.approx(_cell_area(*cell), rel=1e-9)
+
+
+def test_area_ignores_winding_and_subtracts_holes():
+    outer = _cell(0.0, 0.0, 0.1, 0.1)
+    hole = [[0.02, 0.02], [0.02, 0.04], [0.04, 0.04], [0.04, 0.02], [0.02, 0.02]]
+    clockwise = {'type': 'Polygon', 'coordinates': [outer['coordinates'][0][::-1]]}
+    assert geodesic_area_m2(clockwise) == pytest.approx(geodesic_area_m2(outer))
+    with_hole = {'type': 'Polygon', 'coordinates': [outer['coordinates'][0], hole]}
+    expected = _cell_area(0.0, 0.0, 0.1, 0.1) - _cell_area(0.02, 0.02, 0.04, 0.04)
+    assert geodesic_area_m2(with_hole) == pytest.approx(expected, rel=1e-9)
+
+
+def test_perimeter_and_bounds():
+    w, s, e, n = -74.0, 4.0, -73.99, 4.01
+    areas, perimeters, bounds = measure_geometries([_cell(w, s, e, n)])
+    # Meridianos: R Δφ exacto; paralelos: ~R Δλ cos φ (la cuerda haversine es apenas más corta)
+    expected = 2 * R * math.radians(n - s) + R * math.radians(e - w) * (math.cos(math.radians(s)) + math.cos(math.radians(n)))
+    assert perimeters[0] == pytest.approx(expected, rel=1e-6)
+    assert list(bounds[0]) == [w, s, e, n]
+
+
+def test_multipolygon_feature_collection_and_degenerate_inputs():
+    a, b = (0.0, 0.0, 0.01, 0.01), (1.0, 1.0, 1.02, 1.01)
+    multi = {'type': 'MultiPolygon', 'coordinates': [_cell(*a)['coordinates'], _cell(*b)['coordinates']]}
+    feature = {'type': 'Feature', 'properties': {}, 'geometry': _cell(*a)}
+    point = {'type': 'Point', 'coordinates': [1.0, 2.0]}
+    areas, perimeters, bounds = measure_geometries([multi, feature, point, None])
+    assert areas[0] == pytest.approx(_cell_area(*a) + _cell_area(*b), rel=1e-9)
+    assert areas[1] == pytest.approx(_cell_area(*a), rel=1e-9)
+    assert areas[2] == 0 and perimeters[2] == 0 and list(bounds[2]) == [1.0, 2.0, 1.0, 2.0]
+    assert np.isnan(areas[3]) and geodesic_area_m2(None) is None
+
+
+def test_ring_areas_match_measure_geometries():
+    cells = [(0.0, 0.0, 0.01, 0.01), (5.0, 45.0, 5.1, 45.05)]
+    rings = [np.array(_cell(*c)['coordinates'][0]) for c in cells]
+    assert ring_areas_m2(rings) == pytest.approx([_cell_area(*c) for c in cells], rel=1e-9)
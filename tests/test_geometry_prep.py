@@ -0,0 +1,54 @@
+import math
+
+import shapely
+from shapely.geometry import shape
+
+from utils_pkg.fingerprint import COORD_PRECISION
+from utils_pkg.geometry_prep import prepare_geometry, GEOMETRY_PREP_MAX_AREA_CHANGE_PCT, GEOMETRY_PREP_MIN_VERTICES
+
+
+def _circle(lon, lat, radius_m, n):
+    r_lat = radius_m / 111320.0
+    r_lon = r_lat / math.cos(math.radians(lat))
+    ring = [[lon + r_lon * math.cos(2 * math.pi * i / n), lat + r_lat * math.sin(2 * math.pi * i / n)] for i in range(n)]
+    return {'type': 'Polygon', 'coordinates': [ring + [ring[0]]]}
+
+
+def _coordinates(geom):
+    coords = geom['coordinates']
+    while isinstance(coords[0][0], list):
+        coords = [c for part in coords for c in part]
+    return coords
+
+
+def test_dense_polygon_is_simplified_within_area_tolerance():
+    geom = _circle(-74.0, 4.0, 500, 5000)
+    prepared, report = prepare_geometry(geom)
+    assert report is not None
+    assert report['vertices_after'] < report['vertices_before'] / 5
+    assert report['bytes_after'] < report['bytes_before']
+    assert report['area_change_pct'] <= GEOMETRY_PREP_MAX_AREA_CHANGE_PCT
+    assert shapely.is_valid(shape(prepared))
+    for x, y in _coordinates(prepared):
+        assert round(x, COORD_PRECISION) == x and round(y, COORD_PRECISION) == y
+
+
+def test_multipolygon_keeps_its_parts():
+    a = _circle(-74.0, 4.0, 300, 2000)['coordinates']
+    b = _circle(-73.9, 4.1, 300, 2000)['coordinates']
+    prepared, report = prepare_geometry({'type': 'MultiPolygon', 'coordinates': [a, b]})
+    assert report is not None
+    assert prepared['type'] == 'MultiPolygon' and len(prepared['coordinates']) == 2
+
+
+def test_small_polygons_and_points_are_left_alone():
+    small = _circle(-74.0, 4.0, 500, GEOMETRY_PREP_MIN_VERTICES - 10)
+    assert prepare_geometry(small) == (small, None)
+    point = {'type': 'Point', 'coordinates': [-74.0, 4.0]}
+    assert prepare_geometry(point) == (point, None)
+    assert prepare_geometry(None) == (None, None)
+
+
+def test_unreadable_geometry_returns_original():
+    broken = {'type': 'Polygon', 'coordinates': 'no'}
+    assert prepare_geometry(broken) == (broken, None)
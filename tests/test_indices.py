@@ -0,0 +1,143 @@
+from types import SimpleNamespace
+
+import numpy as np
+import pytest
+
+from services.ee import ee_indices
+from services.ee.ee_indices import INDEX_DEFINITIONS, classify_breaks, index_from_composite
+from utils_pkg.visualization import INDEX_VIS
+
+
+class _Img:
+    """ee.Image de juguete sobre arrays numpy, con las operaciones que usan los índices."""
+
+    def __init__(self, bands):
+        self.bands = {k: np.asarray(v, dtype=float) for k, v in bands.items()}
+
+    def _single(self):
+        assert len(self.bands) == 1
+        return next(iter(self.bands.values()))
+
+    def _map(self, fn):
+        return _Img({k: fn(v) for k, v in self.bands.items()})
+
+    def select(self, names):
+        names = [names] if isinstance(names, str) else names
+        return _Img({n: self.bands[n] for n in names})
+
+    def normalizedDifference(self, names):
+        a, b = self.bands[names[0]], self.bands[names[1]]
+        with np.errstate(divide='ignore', invalid='ignore'):
+            nd = (a - b) / (a + b)
+        # Como EE: un valor negativo en cualquiera de las bandas enmascara el píxel
+        return _Img({'nd': np.where((a < 0) | (b < 0), np.nan, nd)})
+
+    def expression(self, expr):
+        with np.errstate(divide='ignore', invalid='ignore'):
+            return _Img({'constant': eval(expr, {'b': lambda n: self.bands[n]})})
+
+    def clamp(self, low, high):
+        return self._map(lambda v: np.clip(v, low, high))
+
+    def max(self, value):
+        return self._map(lambda v: np.maximum(v, value))
+
+    def min(self, value):
+        return self._map(lambda v: np.minimum(v, value))
+
+    def multiply(self, k):
+        return self._map(lambda v: v * k)
+
+    def add(self, k):
+        return self._map(lambda v: v + k)
+
+    def subtract(self, k):
+        return self._map(lambda v: v - k)
+
+    def divide(self, other):
+        with np.errstate(divide='ignore', invalid='ignore'):
+            return _Img({'ratio': self._single() / other._single()})
+
+    def gt(self, other):
+        v = self._single()
+        return _Img({k: (v > c).astype(float) for k, c in other.bands.items()})
+
+    def reduce(self, reducer):
+        assert reducer == 'sum'
+        return _Img({'sum': np.sum(list(self.bands.values()), axis=0)})
+
+    def rename(self, name):
+        return _Img({name: self._single()})
+
+
+@pytest.fixture
+def composite():
+    rng = np.random.default_rng(7)
+    bands = {b: rng.uniform(0, 5000, 200) for b in ('B2', 'B3', 'B4', 'B5', 'B8', 'B11')}
+    # Casos borde: bandas a cero, reflectancia negativa
+    bands['B8'][:3] = [0, -12, 0]
+    bands['B4'][:3] = [0, 300, 150]
+    return _Img(bands)
+
+
+def _nd(c, a, b):
+    return c.normalizedDifference([a, b])
+
+
+# Implementación anterior a INDEX_DEFINITIONS (cadena de operaciones por índice)
+BASELINE = {
+    'ndvi': lambda c: _nd(c, 'B8', 'B4'),
+    'ndwi': lambda c: _nd(c, 'B3', 'B8'),
+    'ndmi': lambda c: _nd(c, 'B8', 'B11').clamp(-0.6, 0.6),
+    'ndre': lambda c: _nd(c, 'B8', 'B5').clamp(-0.5, 0.6),
+    'evi': lambda c: c.expression("2.5 * ((b('B8') - b('B4')) / (b('B8') + 6 * b('B4') - 7.5 * b('B2') + 1))").clamp(-0.2, 0.6),
+    'savi': lambda c: c.expression("(1.5) * ((b('B8') - b('B4')) / (b('B8') + b('B4') + 0.5))").clamp(-0.5, 1.0),
+    'lai': lambda c: _nd(c, 'B8', 'B4').multiply(3.618).subtract(0.118).max(0),
+    'soil_ph': lambda c: c.select('B11').divide(c.select('B8')),
+    'gci': lambda c: _nd(c, 'B8', 'B4'),  # sin definición propia: NDVI con su nombre
+}
+
+
+def test_every_definition_has_a_baseline():
+    assert set(INDEX_DEFINITIONS) <= set(BASELINE)
+
+
+@pytest.mark.parametrize('index', sorted(BASELINE))
+def test_index_values_match_baseline(composite, index):
+    img = index_from_composite(composite, index, roi=None)
+    assert list(img.bands) == [index]
+    np.testing.assert_allclose(img.bands[index], BASELINE[index](composite)._single(), rtol=0, atol=1e-12, equal_nan=True)
+
+
+def test_lai_masks_negative_reflectance_like_baseline(composite):
+    lai = index_from_composite(composite, 'lai', roi=None).bands['lai']
+    assert np.isnan(lai[1]) and np.nanmin(lai) >= 0
+
+
+def test_rgb_selects_true_color_bands(composite):
+    assert list(index_from_composite(composite, 'RGB', roi=None).bands) == ['B4', 'B3', 'B2']
+
+
+def _baseline_classes(values, breaks):
+    # Una máscara por intervalo y una cadena de sumas, como hacía /compute
+    classes = []
+    prev = None
+    for i, b in enumerate(breaks):
+        mask = values <= b if prev is None else (values > prev) & (values <= b)
+        classes.append(mask * i)
+        prev = b
+    classes.append((values > prev) * len(breaks))
+    return np.sum(classes, axis=0)
+
+
+@pytest.mark.parametrize('index', sorted(k for k, v in INDEX_VIS.items() if v.get('discrete')))
+def test_classify_breaks_matches_baseline(monkeypatch, index):
+    fake_ee = SimpleNamespace(Image=SimpleNamespace(constant=lambda values: _Img({f'c{i}': v for i, v in enumerate(values)})),
+                              Reducer=SimpleNamespace(sum=lambda: 'sum'))
+    monkeypatch.setattr(ee_indices, 'ee', fake_ee)
+    breaks = INDEX_VIS[index]['breaks']
+    # Valores aleatorios y exactamente en cada break
+    values = np.concatenate([np.random.default_rng(1).uniform(breaks[0] - 1, breaks[-1] + 1, 500), breaks])
+    classes = classify_breaks(_Img({index: values}), breaks)
+    assert list(classes.bands) == ['class']
+    np.testing.assert_array_equal(classes.bands['class'], _baseline_classes(values, breaks))
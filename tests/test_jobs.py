@@ -0,0 +1,86 @@
+import threading
+import time
+
+import pytest
+
+from services import jobs
+
+
+def _wait_for_status(job_id, statuses=('done', 'failed'), timeout=5):
+    deadline = time.monotonic() + timeout
+    while True:
+        job = jobs.job_status(job_id)
+        if job and job['status'] in statuses:
+            return job
+        if time.monotonic() > deadline:
+            raise AssertionError(f'timeout: {job}')
+        time.sleep(0.01)
+
+
+@pytest.fixture
+def handlers(db, monkeypatch):
+    db.init_db()
+    monkeypatch.setattr(jobs, '_handlers', {})
+    monkeypatch.setattr(jobs, '_lanes', {})
+    return db
+
+
+def test_submit_runs_and_reports_progress(handlers):
+    release = threading.Event()
+
+    def handler(payload, progress):
+        progress(1, total=2, message='mitad')
+        release.wait(5)
+        return {'echo': payload['x']}
+
+    jobs.register_job_handler('echo', handler)
+    job_id = jobs.submit_job('echo', {'x': 3})
+    job = _wait_for_status(job_id, statuses=('running',))
+    assert job['started_at'] and not job['finished_at']
+    release.set()
+    job = _wait_for_status(job_id)
+    assert job['status'] == 'done' and job['result']['echo'] == 3
+    assert (job['progress'], job['total'], job['message']) == (1, 2, 'mitad')
+    assert job['finished_at'] and job['owner'] == jobs.JOB_OWNER
+
+
+def test_failed_job_keeps_the_error(handlers):
+    def handler(payload, progress):
+        raise RuntimeError('sin imágenes')
+
+    jobs.register_job_handler('boom', handler)
+    job = _wait_for_status(jobs.submit_job('boom'))
+    assert job['status'] == 'failed' and 'sin imágenes' in job['error']
+
+
+def test_unknown_kind_and_lane_are_rejected(handlers):
+    with pytest.raises(ValueError):
+        jobs.submit_job('nope')
+    with pytest.raises(ValueError):
+        jobs.register_job_handler('x', lambda p, progress: {}, lane='urgente')
+
+
+def test_resume_claims_each_unfinished_job_once(handlers):
+    db = handlers
+    ran = []
+    jobs.register_job_handler('echo', lambda payload, progress: ran.append(payload['n']) or {})
+    db.insert_job('a', 'echo', {'n': 1}, status='running', owner='muerto:1')
+    db.insert_job('b', 'echo', {'n': 2}, status='queued')
+    db.insert_job('c', 'echo', {'n': 3}, status='done', owner='muerto:1')
+    assert jobs.resume_jobs() == 2
+    assert _wait_for_status('a')['status'] == 'done'
+    assert _wait_for_status('b')['owner'] == jobs.JOB_OWNER
+    assert sorted(ran) == [1, 2]
+    # Ya terminados: un segundo arranque no los repite
+    assert jobs.resume_jobs() == 0
+
+
+def test_concurrent_claims_have_a_single_winner(handlers):
+    db = handlers
+    db.insert_job('a', 'echo', status='running', owner='muerto:1')
+    # Dos procesos leyeron el mismo job con el mismo dueño anterior
+    assert db.claim_job('a', 'w1', expected_owner='muerto:1')
+    assert not db.claim_job('a', 'w2', expected_owner='muerto:1')
+    assert db.get_job('a')['owner'] == 'w1'
+    db.update_job('a', status='done')
+    assert not db.claim_job('a', 'w3', expected_owner='w1')
@@ -0,0 +1,80 @@
+import io
+import zipfile
+
+import pytest
+
+from utils_pkg.kml import parse_kml, parse_kml_string, open_kml_source
+
+KML = '''<?xml version="1.0" encoding="UTF-8"?>
+<kml xmlns="http://www.opengis.net/kml/2.2">
+  <Document>
+    <Placemark>
+      <name>Lote 1</name>
+      <Polygon><outerBoundaryIs><LinearRing><coordinates>
+        -74.0,4.0,0 -73.99,4.0,0 -73.99,4.01,0 -74.0,4.01,0 -74.0,4.0,0
+      </coordinates></LinearRing></outerBoundaryIs></Polygon>
+    </Placemark>
+    <Folder>
+      <Placemark>
+        <name>Lote 2</name>
+        <Polygon><outerBoundaryIs><LinearRing><coordinates>
+          -73.98,4.0 -73.975,4.0 -73.975,4.005 -73.98,4.005 -73.98,4.0
+        </coordinates></LinearRing></outerBoundaryIs></Polygon>
+      </Placemark>
+    </Folder>
+  </Document>
+</kml>'''
+
+
+def _kmz(kml, name='doc.kml'):
+    buf = io.BytesIO()
+    with zipfile.ZipFile(buf, 'w') as zf:
+        zf.writestr('files/icon.png', b'\x89PNG')
+        zf.writestr(name, kml)
+    buf.seek(0)
+    return buf
+
+
+def test_parse_kml_polygons():
+    result = parse_kml(io.BytesIO(KML.encode('utf-8')))
+    assert result['success']
+    assert result['features_count'] == 2
+    assert result['geometry']['type'] == 'MultiPolygon'
+    assert result['bounds'] == {'north': 4.01, 'south': 4.0, 'east': -73.975, 'west': -74.0}
+    first = result['features'][0]
+    assert first['geometry']['coordinates'][0][0] == [-74.0, 4.0]
+    # ~1.1 km x 1.1 km y ~0.55 km x 0.55 km
+    assert first['properties']['area_hectares'] == pytest.approx(123.2, rel=0.01)
+    assert result['area_hectares'] == pytest.approx(123.2 + 30.8, rel=0.01)
+
+
+def test_parse_kml_string_str_and_bytes_match():
+    as_str = parse_kml_string(KML)
+    as_bytes = parse_kml_string(KML.encode('utf-8'))
+    assert as_str['features'] == as_bytes['features']
+
+
+@pytest.mark.parametrize('name', ['doc.kml', 'parcelas.kml'])
+def test_kmz_is_unpacked(name):
+    source = open_kml_source(_kmz(KML, name))
+    result = parse_kml(source)
+    assert result['success'] and result['features_count'] == 2
+
+
+def test_kmz_bytes_via_parse_kml_string():
+    assert parse_kml_string(_kmz(KML).getvalue())['features_count'] == 2
+
+
+def test_kmz_without_kml_is_rejected():
+    buf = io.BytesIO()
+    with zipfile.ZipFile(buf, 'w') as zf:
+        zf.writestr('readme.txt', 'nada')
+    buf.seek(0)
+    with pytest.raises(ValueError):
+        open_kml_source(buf)
+
+
+def test_kml_without_coordinates():
+    result = parse_kml_string('<kml xmlns="http://www.opengis.net/kml/2.2"><Document/></kml>')
+    assert not result['success']
+    assert result['features_count'] == 0
@@ -0,0 +1,93 @@
+import math
+import time
+
+import pytest
+
+from services import jobs, progressive
+from utils_pkg.stats_plan import plan_stats
+
+
+def _square(side_m, lat=4.0):
+    d_lat = side_m / 111320.0
+    d_lon = d_lat / math.cos(math.radians(lat))
+    return {'type': 'Polygon', 'coordinates': [[[0, lat], [d_lon, lat], [d_lon, lat + d_lat], [0, lat + d_lat], [0, lat]]]}
+
+
+BIG = _square(50_000)
+
+
+def _fake_reduce(composite, indices, roi, plan, classify=False):
+    # Resultado determinista por escala: la gruesa se aleja de la nativa
+    out = {}
+    for i, idx in enumerate(indices):
+        base = 0.5 + i / 10 + plan['scale_m'] / 10_000
+        out.update({f'{idx}_min': base - 0.3, f'{idx}_max': base + 0.3, f'{idx}_mean': base,
+                    f'{idx}_stdDev': 0.1, f'{idx}_count': int(plan['area_m2'] / plan['scale_m'] ** 2)})
+    return out
+
+
+@pytest.fixture
+def fake_ee(db, monkeypatch):
+    """Refinado sin EE: la reducción se sustituye por _fake_reduce."""
+    db.init_db()
+    reductions = []
+
+    def reduce(composite, indices, roi, plan, classify=False):
+        reductions.append((plan['scale_m'], classify))
+        return _fake_reduce(composite, indices, roi, plan, classify)
+
+    monkeypatch.setattr(progressive, 'reduce_stats', reduce)
+    monkeypatch.setattr(progressive, 'get_info', lambda obj: obj)
+    monkeypatch.setattr(progressive, 'get_composite', lambda *a, **kw: object())
+    monkeypatch.setattr(progressive, 'prepared_ee_geometry', lambda geom: geom)
+    return reductions
+
+
+def _wait_done(job_id, timeout=5):
+    deadline = time.monotonic() + timeout
+    while True:
+        job = jobs.job_status(job_id)
+        if job['status'] in ('done', 'failed'):
+            return job
+        if time.monotonic() > deadline:
+            raise AssertionError(f'timeout: {job}')
+        time.sleep(0.01)
+
+
+def test_small_plot_has_nothing_to_refine():
+    small = _square(300)
+    plan, refine_plan = progressive.progressive_plans(small)
+    assert refine_plan is None
+    assert plan == plan_stats(small, progressive.REFINED_QUALITY)
+
+
+@pytest.mark.parametrize('quality', [None, 'balanced', 'accurate'])
+def test_big_roi_previews_coarse_and_refines_to_the_requested_plan(quality):
+    preview, refined = progressive.progressive_plans(BIG, quality)
+    assert preview['preview'] and preview['quality'] == progressive.PREVIEW_QUALITY
+    assert refined == plan_stats(BIG, quality or progressive.REFINED_QUALITY)
+    assert preview['scale_m'] > refined['scale_m']
+
+
+@pytest.mark.parametrize('classify', [False, True])
+def test_refined_result_matches_non_progressive_stats(fake_ee, classify):
+    indices = ['ndvi', 'ndwi']
+    preview, refined = progressive.progressive_plans(BIG, 'balanced')
+    coarse = _fake_reduce(None, indices, None, preview)
+
+    sub = progressive.submit_refine_job(BIG, '2024-01-01', '2024-02-01', 30, indices, refined, classify=classify)
+    assert sub['status_url'] == f"/jobs/{sub['job_id']}" and sub['stats_plan'] == refined
+    job = _wait_done(sub['job_id'])
+    assert job['status'] == 'done', job['error']
+
+    # Lo que habría respondido la misma petición sin `progressive`
+    direct = _fake_reduce(None, indices, None, plan_stats(BIG, 'balanced'), classify)
+    assert job['result']['stats'] == {idx: progressive.stat_dict(direct, idx) for idx in indices}
+    assert job['result']['stats']['ndvi'] != progressive.stat_dict(coarse, 'ndvi')
+    assert job['result']['stats_plan']['scale_m'] == refined['scale_m']
+    assert job['result']['stats_plan']['pixel_count'] == direct['ndvi_count']
+    assert fake_ee == [(refined['scale_m'], classify)]
+
+
+def test_refine_runs_on_the_interactive_lane():
+    assert jobs._executor_for('refine_stats') is jobs._executors['interactive']
@@ -0,0 +1,75 @@
+import datetime
+
+import pytest
+
+from services import series
+from services.ee.ee_client import SERIES_FALLBACK_CLOUD_PCT
+
+ROI = {'type': 'Polygon', 'coordinates': [[[-74.0, 4.0], [-73.99, 4.0], [-73.99, 4.01], [-74.0, 4.01], [-74.0, 4.0]]]}
+PLAN = {'scale_m': 20, 'max_pixels': 1000}
+
+
+def _pass(day, value, cloud):
+    t = int(datetime.datetime(2023, 1, day, 15, tzinfo=datetime.timezone.utc).timestamp() * 1000)
+    return {'image_id': f'img{day:02d}', 'ts': f'2023-01-{day:02d}', 'system_time_start': t, 'value': value, 'cloud_cover': cloud}
+
+
+@pytest.fixture
+def ee_passes(db, monkeypatch):
+    """Sustituye la consulta a EE por pasadas fijas y registra cada llamada."""
+    db.init_db()
+    available = []
+    calls = []
+
+    def fake(roi, ranges, index, threshold, scale=60, max_pixels=1e5):
+        calls.append((list(ranges), threshold))
+        return [p for p in available
+                if p['cloud_cover'] < threshold and any(a <= p['ts'] < b for a, b in ranges)]
+
+    monkeypatch.setattr(series, 'get_sentinel2_series_passes', fake)
+    return available, calls
+
+
+def _dates(points):
+    return [p['date'] for p in points]
+
+
+def test_cached_passes_are_combined_with_fetched_gaps(ee_passes):
+    available, calls = ee_passes
+    available.extend([_pass(2, 0.41, 10), _pass(7, 0.52, 20), _pass(17, 0.63, 5), _pass(22, 0.7, 30)])
+    first = series.incremental_time_series(None, ROI, '2023-01-01', '2023-01-10', 'ndvi', 70, plan=PLAN)
+    assert _dates(first) == ['2023-01-02', '2023-01-07']
+    assert calls == [([('2023-01-01', '2023-01-10')], 70)]
+
+    calls.clear()
+    extended = series.incremental_time_series(None, ROI, '2023-01-01', '2023-01-20', 'ndvi', 70, plan=PLAN)
+    # Solo el hueco nuevo va a EE; la serie sale completa y en orden
+    assert calls == [([('2023-01-10', '2023-01-20')], 70)]
+    assert _dates(extended) == ['2023-01-02', '2023-01-07', '2023-01-17']
+    assert [p['mean'] for p in extended] == [0.41, 0.52, 0.63]
+
+    calls.clear()
+    # Un umbral más estricto se sirve de lo guardado filtrando por nubes
+    strict = series.incremental_time_series(None, ROI, '2023-01-01', '2023-01-20', 'ndvi', 15, plan=PLAN)
+    assert calls == []
+    assert _dates(strict) == ['2023-01-02', '2023-01-17']
+
+
+def test_falls_back_to_permissive_threshold_and_stores_it(ee_passes):
+    available, calls = ee_passes
+    available.extend([_pass(3, 0.2, 85), _pass(8, 0.3, 88)])
+    points = series.incremental_time_series(None, ROI, '2023-01-01', '2023-01-10', 'ndvi', 30, plan=PLAN)
+    assert _dates(points) == ['2023-01-03', '2023-01-08']
+    assert calls == [([('2023-01-01', '2023-01-10')], 30), ([('2023-01-01', '2023-01-10')], SERIES_FALLBACK_CLOUD_PCT)]
+
+    calls.clear()
+    again = series.incremental_time_series(None, ROI, '2023-01-01', '2023-01-10', 'ndvi', 30, plan=PLAN)
+    assert calls == [] and again == points
+
+
+def test_no_fallback_when_any_pass_is_under_the_threshold(ee_passes):
+    available, calls = ee_passes
+    available.extend([_pass(3, 0.2, 85), _pass(8, 0.3, 20)])
+    points = series.incremental_time_series(None, ROI, '2023-01-01', '2023-01-10', 'ndvi', 30, plan=PLAN)
+    assert _dates(points) == ['2023-01-08']
+    assert len(calls) == 1
@@ -0,0 +1,71 @@
+import threading
+import time
+
+from utils_pkg.singleflight import SingleFlight
+
+
+def _concurrently(n, fn):
+    results, errors = [None] * n, [None] * n
+
+    def run(i):
+        try:
+            results[i] = fn()
+        except Exception as e:
+            errors[i] = e
+
+    threads = [threading.Thread(target=run, args=(i,)) for i in range(n)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    return results, errors
+
+
+def test_concurrent_callers_share_one_computation():
+    flights = SingleFlight()
+    calls = []
+
+    def compute():
+        calls.append(1)
+        time.sleep(0.2)
+        return {'value': [1, 2]}
+
+    results, errors = _concurrently(5, lambda: flights.do('k', compute))
+    assert len(calls) == 1
+    assert errors == [None] * 5
+    assert all(r == {'value': [1, 2]} for r in results)
+    # Cada llamada recibe su propia copia
+    assert len({id(r) for r in results}) == 5
+    assert flights.in_flight() == 0
+
+
+def test_errors_are_shared_and_not_cached():
+    flights = SingleFlight()
+
+    def fail():
+        time.sleep(0.2)
+        raise RuntimeError('EE caído')
+
+    _, errors = _concurrently(3, lambda: flights.do('k', fail))
+    assert all(isinstance(e, RuntimeError) for e in errors)
+    # La siguiente llamada vuelve a computar
+    assert flights.do('k', lambda: 'ok') == 'ok'
+
+
+def test_different_keys_do_not_wait_for_each_other():
+    flights = SingleFlight()
+    release = threading.Event()
+    slow = threading.Thread(target=lambda: flights.do('slow', release.wait))
+    slow.start()
+    try:
+        assert flights.do('fast', lambda: 1) == 1
+    finally:
+        release.set()
+        slow.join()
+
+
+def test_sequential_calls_recompute():
+    flights = SingleFlight()
+    counter = iter(range(10))
+    assert flights.do('k', lambda: next(counter)) == 0
+    assert flights.do('k', lambda: next(counter)) == 1
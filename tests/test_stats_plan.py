@@ -0,0 +1,49 @@
+import math
+
+import pytest
+
+from utils_pkg.stats_plan import plan_stats, reduce_region_args, NATIVE_SCALE_M, MAX_PIXELS_MARGIN, REGION_PIXEL_BUDGETS, SERIES_PIXEL_BUDGETS, STATS_QUALITIES
+
+
+def _square(side_m, lat=4.0):
+    d_lat = side_m / 111320.0
+    d_lon = d_lat / math.cos(math.radians(lat))
+    return {'type': 'Polygon', 'coordinates': [[[0, lat], [d_lon, lat], [d_lon, lat + d_lat], [0, lat + d_lat], [0, lat]]]}
+
+
+def test_small_plot_uses_native_scale():
+    plan = plan_stats(_square(500), 'fast')
+    assert plan['scale_m'] == NATIVE_SCALE_M
+    assert plan['estimated_pixels'] == pytest.approx(2500, rel=0.01)
+
+
+@pytest.mark.parametrize('quality', STATS_QUALITIES)
+@pytest.mark.parametrize('series', [False, True])
+def test_large_roi_scale_fits_budget(quality, series):
+    plan = plan_stats(_square(50_000), quality, series=series)
+    budget = (SERIES_PIXEL_BUDGETS if series else REGION_PIXEL_BUDGETS)[quality]
+    assert plan['scale_m'] % NATIVE_SCALE_M == 0
+    assert plan['estimated_pixels'] <= budget
+    # La escala es la más fina que entra en el presupuesto
+    finer = plan['scale_m'] - NATIVE_SCALE_M
+    assert finer < NATIVE_SCALE_M or plan['area_m2'] / finer ** 2 > budget
+    assert plan['max_pixels'] == int(budget * MAX_PIXELS_MARGIN)
+
+
+def test_scale_grows_with_quality_tradeoff():
+    roi = _square(50_000)
+    scales = [plan_stats(roi, q)['scale_m'] for q in ('fast', 'balanced', 'accurate')]
+    assert scales == sorted(scales, reverse=True) and scales[0] > scales[-1]
+    assert plan_stats(roi, 'balanced', series=True)['scale_m'] > plan_stats(roi, 'balanced')['scale_m']
+
+
+def test_unknown_quality_and_missing_roi_fall_back():
+    plan = plan_stats(_square(500), 'acurate')
+    assert plan['quality'] in STATS_QUALITIES
+    empty = plan_stats(None)
+    assert empty['scale_m'] == NATIVE_SCALE_M and empty['area_m2'] == 0.0
+
+
+def test_reduce_region_args():
+    plan = plan_stats(_square(50_000), 'fast')
+    assert reduce_region_args(plan) == {'scale': plan['scale_m'], 'maxPixels': plan['max_pixels'], 'bestEffort': True}
@@ -0,0 +1,90 @@
+import threading
+import time
+
+import pytest
+
+from services import write_behind
+from services.write_behind import WriteBehindQueue
+
+
+def _row(i, **kw):
+    return dict({'plot_id': 'p1', 'ts': f'2024-01-{i:02d}', 'metric_type': 'ndvi', 'value': i / 10}, **kw)
+
+
+@pytest.fixture
+def writer(db):
+    db.init_db()
+    w = WriteBehindQueue(batch_size=100, flush_s=60)
+    w.start()
+    yield w
+    w.stop(timeout=5)
+
+
+def test_queued_writes_are_visible_after_flush(db, writer):
+    writer.add_measurements([_row(i) for i in range(1, 6)])
+    writer.add_asset(asset_id='a1', ingested_ts='2024-01-01')
+    assert writer.flush()
+    assert len(db.list_measurements()) == 5
+    assert db.get_asset('a1') is not None
+    assert writer.depth() == 0 and writer.written == 6
+
+
+def test_full_batch_is_written_in_one_call(db, monkeypatch):
+    db.init_db()
+    calls = []
+    monkeypatch.setitem(write_behind._WRITERS, 'measurement', lambda rows: calls.append(len(rows)) or db.insert_measurements(rows))
+    w = WriteBehindQueue(batch_size=3, flush_s=60)
+    w.start()
+    try:
+        w.add_measurements([_row(i) for i in range(1, 4)])
+        # Sin flush: el lote sale al llenarse
+        deadline = time.monotonic() + 5
+        while w.written < 3 and time.monotonic() < deadline:
+            time.sleep(0.01)
+        assert calls == [3]
+    finally:
+        w.stop(timeout=5)
+
+
+def test_flush_wait_is_bounded(db, monkeypatch):
+    db.init_db()
+    release = threading.Event()
+    monkeypatch.setitem(write_behind._WRITERS, 'measurement', lambda rows: release.wait(5) and db.insert_measurements(rows))
+    w = WriteBehindQueue(batch_size=100, flush_s=60)
+    w.start()
+    try:
+        w.add_measurements([_row(1)])
+        started = time.monotonic()
+        assert w.flush(timeout=0.1) is False
+        assert time.monotonic() - started < 1
+        release.set()
+        assert w.flush(timeout=5)
+        assert len(db.list_measurements()) == 1
+    finally:
+        release.set()
+        w.stop(timeout=5)
+
+
+def test_failed_batch_keeps_good_rows_and_reports_bad_ones(db, writer):
+    bad = _row(3, value={'no': 'serializable'})
+    writer.add_measurements([_row(1), _row(2), bad, _row(4)])
+    assert writer.flush()
+    assert sorted(m['ts'] for m in db.list_measurements()) == ['2024-01-01', '2024-01-02', '2024-01-04']
+    assert writer.failed == 1
+    kind, row, error = writer.rejected[0]
+    assert kind == 'measurement' and row is bad and error
+
+
+def test_stop_drains_the_queue_and_later_writes_go_direct(db, writer):
+    writer.add_measurements([_row(1), _row(2)])
+    writer.stop(timeout=5)
+    assert len(db.list_measurements()) == 2
+    # Tras el apagado no hay hilo escritor: add() escribe en el momento
+    writer.add_measurements([_row(3)])
+    assert len(db.list_measurements()) == 3
+    assert writer.flush()
+
+
+def test_unknown_kind_is_rejected(writer):
+    with pytest.raises(ValueError):
+        writer.add('plot', {})
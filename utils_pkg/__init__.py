@@ -1,8 +1,12 @@
 from .visualization import index_band_and_vis
-from .roi import meters_to_degrees, make_roi_from_geojson, make_roi, _parse_coord, center_point_to_bbox, get_roi_from_request, split_feature_collection
-from .cache import make_cache_key, save_mapid, load_mapid
+from .roi import meters_to_degrees, make_roi_from_geojson, make_roi, _parse_coord, center_point_to_bbox, get_roi_from_request, split_feature_collection, resolve_roi, geojson_bounds, bounds_to_polygon
+from .fingerprint import canonical_geometry, geometry_fingerprint, request_fingerprint, normalize_date, normalize_cloud_pct
+from .cache import make_cache_key, save_mapid, load_mapid, get_or_create_mapid
 from .io import save_compute_stats, ensure_outputs_dir, timestamped_base
 from .io import round_sig
+from .geodesy import measure_geometries, geodesic_area_m2, ring_areas_m2
+from .kml import parse_kml, parse_kml_string, open_kml_source
+from .geometry_prep import prepare_geometry, prepared_ee_geometry
 
 __all__ = [
 	"index_band_and_vis",
@@ -13,11 +17,28 @@ __all__ = [
 	"center_point_to_bbox",
 	"get_roi_from_request",
 	"split_feature_collection",
+	"resolve_roi",
+	"geojson_bounds",
+	"bounds_to_polygon",
+	"canonical_geometry",
+	"geometry_fingerprint",
+	"request_fingerprint",
+	"normalize_date",
+	"normalize_cloud_pct",
 	"make_cache_key",
 	"save_mapid",
 	"load_mapid",
+	"get_or_create_mapid",
 	"save_compute_stats",
 	"ensure_outputs_dir",
 	"timestamped_base",
 	"round_sig",
+	"measure_geometries",
+	"geodesic_area_m2",
+	"ring_areas_m2",
+	"parse_kml",
+	"parse_kml_string",
+	"open_kml_source",
+	"prepare_geometry",
+	"prepared_ee_geometry",
 ]
@@ -1,8 +1,23 @@
+import os
 import json
+import time
 import hashlib
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 from config import BASE_OUTPUT_DIR
 
+# Los map IDs de EE caducan: se sirven tal cual hasta REFRESH_AFTER, entre REFRESH_AFTER y
+# TTL se sirven mientras se renuevan en segundo plano, y después de TTL se recalculan.
+MAPID_TTL_S = int(os.getenv('MAPID_CACHE_TTL_S', str(4 * 3600)))
+MAPID_REFRESH_AFTER_S = int(os.getenv('MAPID_CACHE_REFRESH_AFTER_S', str(3 * 3600)))
+MAPID_MEMORY_MAX_ENTRIES = int(os.getenv('MAPID_CACHE_MEMORY_ENTRIES', '512'))
+MAPID_DISK_MAX_BYTES = int(os.getenv('MAPID_CACHE_DISK_MAX_BYTES', str(20 * 1024 * 1024)))
+
+# Pool pequeño compartido para las renovaciones en segundo plano
+_refresh_executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix='cache-refresh')
+
 
 def _cache_dir() -> Path:
     d = Path(BASE_OUTPUT_DIR) / 'cache'
@@ -16,21 +31,159 @@ def make_cache_key(obj: dict) -> str:
     return hashlib.sha1(s.encode('utf-8')).hexdigest()
 
 
+class TieredCache:
+    """Caché en dos niveles: LRU en memoria delante de ficheros JSON en disco.
+
+    Cada entrada guarda {'value', 'created_at'}. Una entrada es fresca hasta
+    `refresh_after_s`, obsoleta (se sirve y se renueva en segundo plano) hasta
+    `ttl_s`, y caducada después. El disco se mantiene bajo `disk_max_bytes`
+    eliminando primero los ficheros más antiguos.
+    """
+
+    def __init__(self, prefix, ttl_s, refresh_after_s, memory_max_entries, disk_max_bytes):
+        self.prefix = prefix
+        self.ttl_s = ttl_s
+        self.refresh_after_s = min(refresh_after_s, ttl_s)
+        self.memory_max_entries = memory_max_entries
+        self.disk_max_bytes = disk_max_bytes
+        self._memory = OrderedDict()
+        self._lock = threading.Lock()
+        self._refreshing = set()
+
+    def _path(self, key):
+        return _cache_dir() / f"{self.prefix}_{key}.json"
+
+    def _remember(self, key, entry):
+        with self._lock:
+            self._memory[key] = entry
+            self._memory.move_to_end(key)
+            while len(self._memory) > self.memory_max_entries:
+                self._memory.popitem(last=False)
+
+    def _read_entry(self, key):
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry is not None:
+                self._memory.move_to_end(key)
+                return entry
+        p = self._path(key)
+        try:
+            with open(p, 'r', encoding='utf-8') as fh:
+                data = json.load(fh)
+        except Exception:
+            return None
+        if isinstance(data, dict) and 'created_at' in data and 'value' in data:
+            entry = data
+        else:
+            # Formato antiguo (solo el valor): usar la fecha del fichero
+            entry = {'value': data, 'created_at': p.stat().st_mtime}
+        self._remember(key, entry)
+        return entry
+
+    def lookup(self, key):
+        """Retorna (value, state) con state en 'fresh', 'stale' o None (sin entrada válida)."""
+        entry = self._read_entry(key)
+        if entry is None:
+            return None, None
+        age = time.time() - float(entry.get('created_at') or 0)
+        if age >= self.ttl_s:
+            self.delete(key)
+            return None, None
+        return entry['value'], ('fresh' if age < self.refresh_after_s else 'stale')
+
+    def get(self, key):
+        value, _ = self.lookup(key)
+        return value
+
+    def set(self, key, value):
+        entry = {'value': value, 'created_at': time.time()}
+        self._remember(key, entry)
+        try:
+            with open(self._path(key), 'w', encoding='utf-8') as fh:
+                json.dump(entry, fh)
+        except Exception:
+            return
+        self._enforce_disk_budget()
+
+    def delete(self, key):
+        with self._lock:
+            self._memory.pop(key, None)
+        try:
+            self._path(key).unlink()
+        except Exception:
+            pass
+
+    def _enforce_disk_budget(self):
+        try:
+            files = []
+            total = 0
+            for entry in os.scandir(_cache_dir()):
+                if entry.is_file() and entry.name.startswith(self.prefix + '_'):
+                    st = entry.stat()
+                    files.append((st.st_mtime, st.st_size, entry.path))
+                    total += st.st_size
+            if total <= self.disk_max_bytes:
+                return
+            files.sort()
+            for _, size, path in files:
+                if total <= self.disk_max_bytes:
+                    break
+                try:
+                    os.remove(path)
+                    total -= size
+                except Exception:
+                    pass
+        except Exception:
+            pass
+
+    def _refresh_in_background(self, key, compute_fn):
+        with self._lock:
+            if key in self._refreshing:
+                return
+            self._refreshing.add(key)
+
+        def _run():
+            try:
+                self.set(key, compute_fn())
+            except Exception as e:
+                print(f"cache: background refresh failed for {self.prefix}_{key}: {e}")
+            finally:
+                with self._lock:
+                    self._refreshing.discard(key)
+
+        _refresh_executor.submit(_run)
+
+    def get_or_compute(self, key, compute_fn):
+        """Valor cacheado si existe (renovándolo en segundo plano si está obsoleto);
+        si no, lo calcula con compute_fn(), lo guarda y lo retorna."""
+        value, state = self.lookup(key)
+        if state == 'stale':
+            self._refresh_in_background(key, compute_fn)
+        if state is not None:
+            return value
+        value = compute_fn()
+        self.set(key, value)
+        return value
+
+
+mapid_cache = TieredCache(
+    'mapid',
+    ttl_s=MAPID_TTL_S,
+    refresh_after_s=MAPID_REFRESH_AFTER_S,
+    memory_max_entries=MAPID_MEMORY_MAX_ENTRIES,
+    disk_max_bytes=MAPID_DISK_MAX_BYTES,
+)
+
+
 def save_mapid(key: str, data: dict):
-    p = _cache_dir() / f"mapid_{key}.json"
-    try:
-        with open(p, 'w', encoding='utf-8') as fh:
-            json.dump(data, fh)
-    except Exception:
-        pass
+    mapid_cache.set(key, data)
 
 
 def load_mapid(key: str):
-    p = _cache_dir() / f"mapid_{key}.json"
-    if not p.exists():
-        return None
-    try:
-        with open(p, 'r', encoding='utf-8') as fh:
-            return json.load(fh)
-    except Exception:
-        return None
+    return mapid_cache.get(key)
+
+
+def get_or_create_mapid(key: str, create_fn):
+    """Map ID cacheado para `key`; `create_fn()` debe retornar un dict serializable
+    (p.ej. {'tile_url_template': ..., 'mapid': ...})."""
+    return mapid_cache.get_or_compute(key, create_fn)
@@ -0,0 +1,144 @@
+"""Huellas canónicas de ROI + parámetros para claves de caché y de BD.
+
+La misma parcela enviada con otro orden de vértices, otro sentido de giro, otro
+vértice inicial, punto de cierre repetido o más decimales produce la misma huella,
+así que el trabajo idéntico de clientes distintos comparte una sola computación EE.
+"""
+import json
+import hashlib
+import datetime
+
+# 6 decimales ~ 0.1 m, muy por debajo del píxel de Sentinel-2 (10 m)
+COORD_PRECISION = 6
+
+
+def _quantize(position):
+    # Se descarta la altitud: no afecta a ninguna computación
+    return [round(float(position[0]), COORD_PRECISION) + 0.0, round(float(position[1]), COORD_PRECISION) + 0.0]
+
+
+def _signed_area(ring):
+    area = 0.0
+    for (x1, y1), (x2, y2) in zip(ring, ring[1:] + ring[:1]):
+        area += x1 * y2 - x2 * y1
+    return area / 2.0
+
+
+def _normalize_ring(ring, counter_clockwise):
+    points = []
+    for position in ring:
+        q = _quantize(position)
+        # Eliminar vértices repetidos consecutivos (incluido el de cierre)
+        if not points or q != points[-1]:
+            points.append(q)
+    if len(points) > 1 and points[0] == points[-1]:
+        points.pop()
+    if len(points) < 3:
+        return None
+    if (_signed_area(points) > 0) != counter_clockwise:
+        points.reverse()
+    # Empezar siempre por el vértice mínimo (lon, lat)
+    start = points.index(min(points))
+    points = points[start:] + points[:start]
+    points.append(points[0])
+    return points
+
+
+def _normalize_polygon(rings):
+    # RFC 7946: anillo exterior antihorario, huecos en sentido horario
+    if not rings:
+        return None
+    exterior = _normalize_ring(rings[0], counter_clockwise=True)
+    if exterior is None:
+        return None
+    holes = [h for h in (_normalize_ring(r, counter_clockwise=False) for r in rings[1:]) if h]
+    return [exterior] + sorted(holes)
+
+
+def canonical_geometry(geom):
+    """Forma canónica de una geometría GeoJSON (también acepta Feature/FeatureCollection)."""
+    if not geom:
+        return None
+    t = geom.get('type')
+    if t == 'Feature':
+        return canonical_geometry(geom.get('geometry'))
+    if t == 'FeatureCollection':
+        parts = [canonical_geometry(f) for f in geom.get('features') or []]
+        return {'type': 'GeometryCollection', 'geometries': sorted((p for p in parts if p), key=_dumps)}
+    if t == 'GeometryCollection':
+        parts = [canonical_geometry(g) for g in geom.get('geometries') or []]
+        return {'type': 'GeometryCollection', 'geometries': sorted((p for p in parts if p), key=_dumps)}
+    coords = geom.get('coordinates')
+    if t == 'Point':
+        return {'type': t, 'coordinates': _quantize(coords)}
+    if t in ('MultiPoint', 'LineString'):
+        return {'type': t, 'coordinates': [_quantize(c) for c in coords]}
+    if t == 'MultiLineString':
+        return {'type': t, 'coordinates': sorted([_quantize(c) for c in line] for line in coords)}
+    if t == 'Polygon':
+        return {'type': t, 'coordinates': _normalize_polygon(coords)}
+    if t == 'MultiPolygon':
+        polys = sorted(p for p in (_normalize_polygon(rings) for rings in coords) if p)
+        if len(polys) == 1:
+            return {'type': 'Polygon', 'coordinates': polys[0]}
+        return {'type': t, 'coordinates': polys}
+    return geom
+
+
+def normalize_date(value):
+    """'2024-1-5', '2024-01-05T10:00:00Z', date/datetime -> '2024-01-05'."""
+    if value is None:
+        return None
+    if isinstance(value, (datetime.date, datetime.datetime)):
+        return value.strftime('%Y-%m-%d')
+    s = str(value).strip()
+    try:
+        return datetime.datetime.fromisoformat(s.replace('Z', '+00:00')).strftime('%Y-%m-%d')
+    except ValueError:
+        pass
+    try:
+        y, m, d = s.split('T')[0].split('-')
+        return datetime.date(int(y), int(m), int(d)).strftime('%Y-%m-%d')
+    except Exception:
+        return s
+
+
+def normalize_cloud_pct(value):
+    """Umbral de nubes como entero en [0, 100]."""
+    if value is None:
+        return None
+    try:
+        return int(round(min(100.0, max(0.0, float(value)))))
+    except Exception:
+        return value
+
+
+_DATE_PARAMS = ('start', 'end', 'date', 'start_date', 'end_date')
+
+
+def _normalize_param(name, value):
+    if name in _DATE_PARAMS:
+        return normalize_date(value)
+    if name == 'cloud_pct':
+        return normalize_cloud_pct(value)
+    if isinstance(value, float) and value.is_integer():
+        return int(value)
+    return value
+
+
+def _dumps(obj):
+    return json.dumps(obj, sort_keys=True, separators=(',', ':'), ensure_ascii=False)
+
+
+def geometry_fingerprint(geom, length=16):
+    """Identificador estable de una geometría (usado como geometry_id en BD)."""
+    return hashlib.sha256(_dumps(canonical_geometry(geom)).encode('utf-8')).hexdigest()[:length]
+
+
+def request_fingerprint(roi_geojson, **params):
+    """Clave de caché para una ROI y sus parámetros de consulta normalizados."""
+    canonical = {
+        'roi': canonical_geometry(roi_geojson),
+        'params': {k: _normalize_param(k, v) for k, v in params.items()},
+    }
+    return hashlib.sha1(_dumps(canonical).encode('utf-8')).hexdigest()
@@ -0,0 +1,145 @@
+"""Área, perímetro y bounds geodésicos locales (sin llamadas a EE).
+
+Todas las posiciones de todas las geometrías se concatenan en un único array y
+cada magnitud se reduce por anillo con `np.add.reduceat`, así que medir una
+FeatureCollection de miles de parcelas cuesta unos milisegundos.
+
+El área usa la fórmula de Chamberlain-Duquette sobre la esfera de igual área
+(radio auténtico WGS84): el error frente al elipsoide es < 0.5% para parcelas,
+muy por debajo de la aproximación planar en grados² que se usaba antes. El
+perímetro suma las distancias haversine de cada arista.
+"""
+import numpy as np
+
+# Radio de la esfera con la misma superficie que el elipsoide WGS84
+EARTH_AUTHALIC_RADIUS_M = 6371007.181
+
+
+def _positions(coords):
+    """Lista de posiciones GeoJSON -> array (n, 2) de lon/lat (ignora altitudes)."""
+    try:
+        arr = np.asarray(coords, dtype=float)
+        if arr.ndim == 2 and arr.shape[1] >= 2:
+            return arr[:, :2]
+    except ValueError:
+        # Mezcla de posiciones 2D y 3D
+        pass
+    return np.array([p[:2] for p in coords], dtype=float).reshape(-1, 2)
+
+
+def _geometry_parts(geom):
+    """Genera (posiciones, signo) de una geometría GeoJSON.
+
+    signo 1 = anillo exterior, -1 = hueco, 0 = posiciones sin área (puntos, líneas).
+    """
+    if not geom:
+        return
+    gtype = geom.get('type')
+    if gtype == 'Feature':
+        yield from _geometry_parts(geom.get('geometry'))
+    elif gtype == 'GeometryCollection':
+        for g in geom.get('geometries') or []:
+            yield from _geometry_parts(g)
+    elif gtype == 'Polygon':
+        for i, ring in enumerate(geom.get('coordinates') or []):
+            yield _positions(ring), (1 if i == 0 else -1)
+    elif gtype == 'MultiPolygon':
+        for polygon in geom.get('coordinates') or []:
+            for i, ring in enumerate(polygon):
+                yield _positions(ring), (1 if i == 0 else -1)
+    elif gtype in ('LineString', 'MultiPoint'):
+        yield _positions(geom.get('coordinates') or []), 0
+    elif gtype == 'MultiLineString':
+        for line in geom.get('coordinates') or []:
+            yield _positions(line), 0
+    elif gtype == 'Point':
+        yield _positions([geom.get('coordinates')]), 0
+
+
+def _ring_sums(rings):
+    """Área con signo (m², antihorario positivo) y perímetro (m) de cada anillo.
+
+    Los anillos se tratan como cerrados: la arista final vuelve al primer vértice
+    (y mide 0 si el anillo ya viene cerrado).
+    """
+    sizes = np.fromiter((len(r) for r in rings), dtype=np.intp, count=len(rings))
+    if not len(rings) or not sizes.sum():
+        return np.zeros(len(rings)), np.zeros(len(rings))
+    coords = np.radians(np.concatenate([r for r in rings if len(r)]))
+    starts = np.concatenate([[0], np.cumsum(sizes)[:-1]])
+    nonempty = sizes > 0
+    nxt = np.arange(len(coords)) + 1
+    nxt[(starts + sizes - 1)[nonempty]] = starts[nonempty]
+
+    lon, lat = coords[:, 0], coords[:, 1]
+    lon2, lat2 = lon[nxt], lat[nxt]
+    dlon = lon2 - lon
+    sin_lat, sin_lat2 = np.sin(lat), np.sin(lat2)
+    area_terms = dlon * (2 + sin_lat + sin_lat2)
+    hav = np.sin((lat2 - lat) / 2) ** 2 + np.cos(lat) * np.cos(lat2) * np.sin(dlon / 2) ** 2
+    edge_m = 2 * EARTH_AUTHALIC_RADIUS_M * np.arcsin(np.sqrt(np.clip(hav, 0, 1)))
+
+    areas = np.zeros(len(rings))
+    perimeters = np.zeros(len(rings))
+    idx = starts[nonempty]
+    areas[nonempty] = np.add.reduceat(area_terms, idx) * EARTH_AUTHALIC_RADIUS_M ** 2 / 2
+    perimeters[nonempty] = np.add.reduceat(edge_m, idx)
+    return areas, perimeters
+
+
+def ring_areas_m2(rings):
+    """Área (m², sin signo) de cada anillo de una lista de arrays (n, 2) lon/lat."""
+    areas, _ = _ring_sums(list(rings))
+    return np.abs(areas)
+
+
+def measure_geometries(geometries):
+    """Área (m²), perímetro (m) y bounds [w, s, e, n] de cada geometría GeoJSON.
+
+    Retorna (areas, perimeters, bounds) como arrays alineados con `geometries`;
+    NaN para las geometrías vacías o que no se pueden leer. El área de un
+    polígono es la de su exterior menos la de sus huecos; el perímetro incluye
+    todos sus anillos. Puntos y líneas tienen área y perímetro 0.
+    """
+    n = len(geometries)
+    rings, signs, owner = [], [], []
+    for i, geom in enumerate(geometries):
+        try:
+            parts = list(_geometry_parts(geom))
+        except Exception:
+            continue
+        for positions, sign in parts:
+            rings.append(positions)
+            signs.append(sign)
+            owner.append(i)
+
+    areas = np.full(n, np.nan)
+    perimeters = np.full(n, np.nan)
+    bounds = np.full((n, 4), np.nan)
+    if not rings:
+        return areas, perimeters, bounds
+
+    owner = np.asarray(owner, dtype=np.intp)
+    signs = np.asarray(signs, dtype=float)
+    ring_area, ring_perimeter = _ring_sums(rings)
+    measured = np.zeros(n, dtype=bool)
+    measured[owner] = True
+    areas[measured] = 0.0
+    perimeters[measured] = 0.0
+    np.add.at(areas, owner, np.abs(ring_area) * signs)
+    np.add.at(perimeters, owner, ring_perimeter * (signs != 0))
+
+    sizes = np.fromiter((len(r) for r in rings), dtype=np.intp, count=len(rings))
+    if sizes.sum():
+        positions = np.concatenate([r for r in rings if len(r)])
+        point_owner = np.repeat(owner, sizes)
+        for col, reduce_fn in ((0, np.fmin), (1, np.fmin), (2, np.fmax), (3, np.fmax)):
+            values = positions[:, col % 2]
+            reduce_fn.at(bounds[:, col], point_owner, values)
+    return areas, perimeters, bounds
+
+
+def geodesic_area_m2(geom):
+    """Área geodésica (m²) de una geometría GeoJSON, o None si no se puede medir."""
+    area = measure_geometries([geom])[0][0]
+    return None if np.isnan(area) else float(area)
@@ -0,0 +1,129 @@
+"""Preparación de geometrías antes de enviarlas a EE.
+
+Un polígono de KML con miles de vértices viaja serializado en cada petición a EE
+y encarece el clip del lado del servidor, aunque a 10 m por píxel la mayoría de
+esos vértices no cambian ningún píxel. `prepare_geometry` lo simplifica
+conservando la topología con una tolerancia ligada a la escala del píxel y
+cuantiza las coordenadas a la misma rejilla que las huellas (~0.1 m).
+
+Cada preparación devuelve un informe (vértices y bytes antes/después, área
+geodésica antes/después) para poder verificar la precisión. Si la simplificación
+cambia el área más de GEOMETRY_PREP_MAX_AREA_CHANGE_PCT (p.ej. contornos curvos,
+donde Douglas-Peucker recorta siempre hacia dentro) se reintenta con la tolerancia
+a la mitad y, si sigue sin cumplirse, solo se cuantiza. Las geometrías con menos
+de GEOMETRY_PREP_MIN_VERTICES vértices se dejan como están.
+
+Las parcelas registradas guardan su geometría preparada y su informe
+(services/plots.py), así que el coste se paga una vez por parcela.
+"""
+import os
+import json
+import ee
+import shapely
+from shapely.geometry import shape, mapping
+from utils_pkg.fingerprint import COORD_PRECISION
+from utils_pkg.geodesy import measure_geometries
+
+# Escala nativa de Sentinel-2
+PIXEL_SCALE_M = 10
+# Tolerancia de simplificación como fracción del píxel (0.2 -> 2 m a 10 m)
+GEOMETRY_PREP_PIXEL_FRACTION = float(os.getenv('GEOMETRY_PREP_PIXEL_FRACTION', '0.2'))
+GEOMETRY_PREP_MAX_AREA_CHANGE_PCT = float(os.getenv('GEOMETRY_PREP_MAX_AREA_CHANGE_PCT', '0.5'))
+# Geometrías con pocos vértices se envían tal cual: no hay nada que ganar
+GEOMETRY_PREP_MIN_VERTICES = int(os.getenv('GEOMETRY_PREP_MIN_VERTICES', '100'))
+# Reintentos con la tolerancia a la mitad antes de quedarse solo con la cuantización
+_TOLERANCE_HALVINGS = 4
+# Metros por grado de latitud
+_M_PER_DEG = 111320.0
+
+
+def _payload_bytes(geom):
+    return len(json.dumps(geom, separators=(',', ':')))
+
+
+def _rounded(coords):
+    # Las coordenadas ya están en la rejilla: round() solo limpia la representación
+    if isinstance(coords, (list, tuple)) and coords and isinstance(coords[0], (int, float)):
+        return [round(float(c), COORD_PRECISION) + 0.0 for c in coords[:2]]
+    return [_rounded(c) for c in coords]
+
+
+def _to_geojson(g):
+    out = mapping(g)
+    if 'coordinates' in out:
+        return {'type': out['type'], 'coordinates': _rounded(out['coordinates'])}
+    return {'type': out['type'], 'geometries': [_to_geojson(part) for part in g.geoms]}
+
+
+def _simplified(g, tolerance_deg):
+    if tolerance_deg > 0:
+        g = g.simplify(tolerance_deg, preserve_topology=True)
+    # Cuantizar conservando la validez (set_precision repara lo que el redondeo rompa)
+    return shapely.set_precision(g, 10 ** -COORD_PRECISION)
+
+
+def _area_change_pct(before, after):
+    if before != before or after != after or not before:
+        return 0.0
+    return abs(after - before) / before * 100.0
+
+
+def prepare_geometry(geom, scale_m=PIXEL_SCALE_M):
+    """Geometría GeoJSON lista para ee.Geometry: simplificada y cuantizada.
+
+    Retorna (geometría preparada, informe). Si no hay nada que preparar (puntos,
+    pocos vértices) o ante cualquier problema (GeoJSON no legible, resultado vacío)
+    retorna la geometría original y un informe None.
+    """
+    if not geom or geom.get('type') in (None, 'Point', 'MultiPoint'):
+        return geom, None
+    try:
+        g = shape(geom)
+        vertices = int(shapely.get_num_coordinates(g))
+        if g.is_empty or vertices < GEOMETRY_PREP_MIN_VERTICES:
+            return geom, None
+        tolerance_m = scale_m * GEOMETRY_PREP_PIXEL_FRACTION
+        area_before = measure_geometries([geom])[0][0]
+        # Tolerancia en grados de latitud: en longitud equivale a menos metros (conservador)
+        for tolerance in [tolerance_m / 2 ** i for i in range(_TOLERANCE_HALVINGS + 1)] + [0]:
+            prepared_shape = _simplified(g, tolerance / _M_PER_DEG)
+            if prepared_shape.is_empty:
+                continue
+            prepared = _to_geojson(prepared_shape)
+            area_after = measure_geometries([prepared])[0][0]
+            change = _area_change_pct(area_before, area_after)
+            if change <= GEOMETRY_PREP_MAX_AREA_CHANGE_PCT or tolerance == 0:
+                break
+        else:
+            return geom, None
+        report = {
+            'tolerance_m': tolerance,
+            'vertices_before': vertices,
+            'vertices_after': int(shapely.get_num_coordinates(prepared_shape)),
+            'bytes_before': _payload_bytes(geom),
+            'bytes_after': _payload_bytes(prepared),
+            'area_before_m2': None if area_before != area_before else float(area_before),
+            'area_after_m2': None if area_after != area_after else float(area_after),
+            'area_change_pct': round(change, 4),
+        }
+        return prepared, report
+    except Exception as e:
+        print(f"prepare_geometry: usando la geometría original ({e})")
+        return geom, None
+
+
+def describe_report(report):
+    """Resumen de una línea del informe de prepare_geometry (para logs)."""
+    if not report:
+        return 'geometría sin preparar'
+    return (f"{report['vertices_before']} -> {report['vertices_after']} vértices, "
+            f"{report['bytes_before']} -> {report['bytes_after']} bytes, "
+            f"área {report['area_change_pct']}% (tolerancia {report['tolerance_m']} m)")
+
+
+def prepared_ee_geometry(geom, scale_m=PIXEL_SCALE_M):
+    """ee.Geometry de la geometría preparada (para GeoJSON que no viene del registro de parcelas)."""
+    prepared, report = prepare_geometry(geom, scale_m)
+    if report and report['bytes_after'] < report['bytes_before']:
+        print(f"prepare_geometry: {describe_report(report)}")
+    return ee.Geometry(prepared)
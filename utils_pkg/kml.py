@@ -0,0 +1,211 @@
+"""Lectura de KML/KMZ en streaming.
+
+`iterparse` recorre el documento sin construir el árbol completo: cada elemento
+se desprende de su padre al cerrarse, así que la memoria queda acotada a la rama
+en curso aunque el archivo tenga miles de placemarks. Las coordenadas se
+convierten en bloque a arrays de NumPy; la validez y los bounds de todos los
+polígonos se calculan vectorizados con shapely y el área geodésica con
+utils_pkg.geodesy.
+"""
+import io
+import zipfile
+import xml.etree.ElementTree as ET
+import numpy as np
+import shapely
+from shapely.geometry import mapping
+from utils_pkg.geodesy import ring_areas_m2, measure_geometries
+
+_ZIP_MAGIC = b'PK\x03\x04'
+
+
+def open_kml_source(fileobj):
+    """Devuelve un stream con el KML: el propio `fileobj` o, si es un KMZ, el .kml que contiene.
+
+    Para KMZ se usa doc.kml si existe (convención de Google Earth) o el primer .kml del archivo.
+    """
+    head = fileobj.read(4)
+    fileobj.seek(0)
+    if head != _ZIP_MAGIC:
+        return fileobj
+    zf = zipfile.ZipFile(fileobj)
+    names = [n for n in zf.namelist() if n.lower().endswith('.kml')]
+    if not names:
+        raise ValueError("El archivo KMZ no contiene ningún .kml")
+    name = 'doc.kml' if 'doc.kml' in names else names[0]
+    return zf.open(name)
+
+
+def iter_kml_coordinates(source):
+    """Genera el texto de cada elemento <coordinates> (en orden de documento)."""
+    stack = []
+    for event, elem in ET.iterparse(source, events=('start', 'end')):
+        if event == 'start':
+            stack.append(elem)
+            continue
+        stack.pop()
+        if elem.tag.endswith('coordinates') and elem.text and elem.text.strip():
+            yield elem.text
+        # Desprender el elemento ya procesado para no acumular el árbol
+        if stack:
+            stack[-1].remove(elem)
+
+
+def _parse_coordinates_slow(tuples):
+    coordinates = []
+    for pair in tuples:
+        parts = pair.split(',')
+        if len(parts) >= 2:
+            try:
+                coordinates.append([float(parts[0]), float(parts[1])])
+            except ValueError:
+                continue
+    return np.array(coordinates, dtype=float).reshape(-1, 2)
+
+
+def parse_coordinates(text):
+    """Texto de <coordinates> ('lon,lat[,alt] ...') -> array (n, 2) de lon/lat.
+
+    Las tuplas homogéneas (caso habitual) se convierten de una vez; si hay
+    tuplas mal formadas se recorre una a una descartando las inválidas.
+    """
+    tuples = text.split()
+    if not tuples:
+        return np.empty((0, 2))
+    dims = tuples[0].count(',') + 1
+    if dims >= 2 and text.count(',') == len(tuples) * (dims - 1):
+        try:
+            values = np.array(text.replace(',', ' ').split(), dtype=float)
+            if values.size == len(tuples) * dims:
+                return values.reshape(-1, dims)[:, :2]
+        except ValueError:
+            pass
+    return _parse_coordinates_slow(tuples)
+
+
+def _rings(coordinate_texts):
+    for text in coordinate_texts:
+        coords = parse_coordinates(text)
+        if len(coords) < 3:
+            continue
+        if not np.array_equal(coords[0], coords[-1]):
+            coords = np.vstack([coords, coords[:1]])
+        # Un anillo necesita al menos 4 posiciones (cerrado)
+        if len(coords) < 4:
+            continue
+        yield coords
+
+
+def _polygons(rings):
+    """Todos los anillos como polígonos shapely en una sola llamada vectorizada."""
+    sizes = np.fromiter((len(r) for r in rings), dtype=np.intp, count=len(rings))
+    linear = shapely.linearrings(np.concatenate(rings), indices=np.repeat(np.arange(len(rings)), sizes))
+    return shapely.polygons(linear)
+
+
+def _exterior(geometry):
+    if geometry['type'] == 'Polygon':
+        return geometry['coordinates'][0]
+    return geometry['coordinates'][0][0]
+
+
+def parse_kml(source):
+    """Parsea un KML (stream binario o de texto) y extrae los polígonos como GeoJSON.
+
+    Retorna el mismo dict que parse_kml_to_geojson: success, message, geometry,
+    features_count, area_hectares, bounds y features.
+    """
+    rings = list(_rings(iter_kml_coordinates(source)))
+    if not rings:
+        return {
+            "success": False,
+            "message": "No se encontraron coordenadas válidas en el archivo KML",
+            "geometry": None,
+            "features_count": 0,
+            "area_hectares": 0,
+            "bounds": None
+        }
+
+    polygons = _polygons(rings)
+    valid = shapely.is_valid(polygons)
+    for i in np.flatnonzero(~valid):
+        polygons[i] = polygons[i].buffer(0)
+    keep = valid | shapely.is_valid(polygons)
+    polygons = polygons[keep]
+    rings = [r for r, k in zip(rings, keep) if k]
+    valid = valid[keep]
+    if not len(polygons):
+        return {
+            "success": False,
+            "message": "No se pudieron procesar las coordenadas del archivo KML",
+            "geometry": None,
+            "features_count": 0,
+            "area_hectares": 0,
+            "bounds": None
+        }
+
+    # Área geodésica: sobre los anillos originales, o sobre la geometría reparada si no eran válidos
+    areas_m2 = ring_areas_m2(rings)
+    repaired = np.flatnonzero(~valid)
+    if len(repaired):
+        areas_m2[repaired] = measure_geometries([mapping(polygons[i]) for i in repaired])[0]
+    areas_ha = np.nan_to_num(areas_m2) / 10000
+    geom_bounds = shapely.bounds(polygons)
+    bounds = {
+        "north": max(-90, float(np.nanmax(geom_bounds[:, 3]))),
+        "south": min(90, float(np.nanmin(geom_bounds[:, 1]))),
+        "east": max(-180, float(np.nanmax(geom_bounds[:, 2]))),
+        "west": min(180, float(np.nanmin(geom_bounds[:, 0]))),
+    }
+    features = []
+    for polygon, ring, is_valid, area_hectares in zip(polygons, rings, valid, areas_ha):
+        # Un anillo válido se serializa tal cual; los reparados con buffer(0) vía shapely
+        geojson_geom = {"type": "Polygon", "coordinates": [ring.tolist()]} if is_valid else mapping(polygon)
+        features.append({
+            "type": "Feature",
+            "properties": {
+                "name": f"Parcela {len(features) + 1}",
+                "description": "Extraído de archivo KML",
+                "area_hectares": round(float(area_hectares), 2)
+            },
+            "geometry": geojson_geom
+        })
+    total_area = float(np.sum(areas_ha))
+
+    # Si hay múltiples polígonos, la geometría principal es un MultiPolygon con el
+    # anillo exterior de cada uno (se compone directamente, sin pasar por shapely)
+    main_geometry = features[0]["geometry"]
+    if len(features) > 1:
+        try:
+            main_geometry = {"type": "MultiPolygon", "coordinates": [[_exterior(f['geometry'])] for f in features]}
+        except IndexError:
+            # Algún polígono reparado quedó vacío
+            pass
+    return {
+        "success": True,
+        "message": f"KML procesado correctamente. {len(features)} polígono(s) encontrado(s).",
+        "geometry": main_geometry,
+        "features_count": len(features),
+        "area_hectares": round(total_area, 2),
+        "bounds": bounds,
+        "features": features
+    }
+
+
+class _StringReader:
+    # read() por trozos sobre un str sin copiarlo (io.StringIO duplica el texto)
+    def __init__(self, text):
+        self._text = text
+        self._pos = 0
+
+    def read(self, size=-1):
+        end = len(self._text) if size is None or size < 0 else self._pos + size
+        chunk = self._text[self._pos:end]
+        self._pos = end
+        return chunk
+
+
+def parse_kml_string(kml_content):
+    """parse_kml para un KML ya cargado como str o bytes."""
+    if isinstance(kml_content, bytes):
+        return parse_kml(open_kml_source(io.BytesIO(kml_content)))
+    return parse_kml(_StringReader(kml_content))
@@ -1,9 +1,7 @@
 import math
-import json
-from pathlib import Path
 import ee
-from config import BASE_OUTPUT_DIR
-import json
+from utils_pkg.geodesy import measure_geometries
+from utils_pkg.geometry_prep import prepared_ee_geometry
 
 
 def meters_to_degrees(lon, lat, width_m, height_m):
@@ -18,7 +16,7 @@ def meters_to_degrees(lon, lat, width_m, height_m):
 
 
 def make_roi_from_geojson(geometry):
-    return ee.Geometry(geometry)
+    return prepared_ee_geometry(geometry)
 
 
 def make_roi(lon, lat, width_m, height_m):
@@ -51,111 +49,96 @@ def center_point_to_bbox(lon, lat, buffer_m=250):
     return [west, south, east, north]
 
 
-def get_roi_from_request(req):
-    try:
-        # 1) kml_id
-        if getattr(req, 'kml_id', None):
-            kml_id = req.kml_id
-            geojson_path = Path(BASE_OUTPUT_DIR) / 'kml_uploads' / f"{kml_id}.geojson"
-            if geojson_path.exists():
-                with open(geojson_path, 'r', encoding='utf-8') as fh:
-                    fc = json.load(fh)
-                features = fc.get('features', [])
-                if not features:
-                    raise ValueError('KML stored but contains no features')
-                geom = features[0].get('geometry')
-                roi = ee.Geometry(geom)
-                try:
-                    b = roi.bounds().getInfo()['coordinates'][0]
-                    lons = [c[0] for c in b]
-                    lats = [c[1] for c in b]
-                    roi_bounds = [min(lons), min(lats), max(lons), max(lats)]
-                except Exception:
-                    # fallback compute from coords
-                    try:
-                        geom_coords = geom.get('coordinates')
-                        if geom.get('type') == 'Polygon':
-                            coords = geom_coords[0]
-                        elif geom.get('type') == 'MultiPolygon':
-                            coords = [pt for poly in geom_coords for pt in poly[0]]
-                        else:
-                            coords = []
-                        if coords:
-                            lons = [c[0] for c in coords]
-                            lats = [c[1] for c in coords]
-                            roi_bounds = [min(lons), min(lats), max(lons), max(lats)]
-                        else:
-                            roi_bounds = None
-                    except Exception:
-                        roi_bounds = None
-                return roi, roi_bounds
-
-        # 2) geometry
-        if getattr(req, 'geometry', None):
-            geom = req.geometry
-            roi = ee.Geometry(geom)
-            try:
-                b = roi.bounds().getInfo()['coordinates'][0]
-                lons = [c[0] for c in b]
-                lats = [c[1] for c in b]
-                roi_bounds = [min(lons), min(lats), max(lons), max(lats)]
-            except Exception:
-                try:
-                    geom_coords = geom.get('coordinates')
-                    if geom.get('type') == 'Polygon':
-                        coords = geom_coords[0]
-                    elif geom.get('type') == 'MultiPolygon':
-                        coords = [pt for poly in geom_coords for pt in poly[0]]
-                    else:
-                        coords = []
-                    if coords:
-                        lons = [c[0] for c in coords]
-                        lats = [c[1] for c in coords]
-                        roi_bounds = [min(lons), min(lats), max(lons), max(lats)]
-                    else:
-                        roi_bounds = None
-                except Exception:
-                    roi_bounds = None
-            return roi, roi_bounds
-
-        # 3) lon/lat center
-        if getattr(req, 'lon', None) is not None and getattr(req, 'lat', None) is not None:
-            try:
-                lon = _parse_coord(getattr(req, 'lon'))
-                lat = _parse_coord(getattr(req, 'lat'))
-            except Exception:
-                raise ValueError('Invalid lon/lat')
-            buffer_m = getattr(req, 'buffer_m', None) or getattr(req, 'radius_m', None) or 250
-            try:
-                buffer_m = float(buffer_m)
-            except Exception:
-                buffer_m = 250.0
-            bbox = center_point_to_bbox(lon, lat, buffer_m=buffer_m)
-            roi = ee.Geometry.Rectangle(bbox)
-            roi_bounds = bbox
-            return roi, roi_bounds
-
-        # 4) lon/lat + width/height
-        if getattr(req, 'lon', None) is not None and getattr(req, 'lat', None) is not None and getattr(req, 'width_m', None) and getattr(req, 'height_m', None):
+def _iter_positions(coords):
+    """Recorre todas las posiciones [lon, lat, ...] de unas coordenadas GeoJSON anidadas."""
+    if not coords:
+        return
+    if isinstance(coords[0], (int, float)):
+        yield coords
+        return
+    for c in coords:
+        yield from _iter_positions(c)
+
+
+def geojson_bounds(geom):
+    """Bounds [west, south, east, north] calculados localmente (sin llamar a EE)."""
+    if not geom:
+        return None
+    if geom.get('type') == 'Feature':
+        return geojson_bounds(geom.get('geometry'))
+    if geom.get('type') in ('GeometryCollection', 'FeatureCollection'):
+        parts = [geojson_bounds(g) for g in geom.get('geometries') or geom.get('features') or []]
+        parts = [p for p in parts if p]
+        if not parts:
+            return None
+        return [min(p[0] for p in parts), min(p[1] for p in parts), max(p[2] for p in parts), max(p[3] for p in parts)]
+    positions = list(_iter_positions(geom.get('coordinates')))
+    if not positions:
+        return None
+    lons = [c[0] for c in positions]
+    lats = [c[1] for c in positions]
+    return [min(lons), min(lats), max(lons), max(lats)]
+
+
+def bounds_to_polygon(bounds):
+    """GeoJSON Polygon equivalente a `ee.Geometry(...).bounds().getInfo()`."""
+    if not bounds:
+        return None
+    west, south, east, north = bounds
+    return {
+        'type': 'Polygon',
+        'coordinates': [[[west, south], [east, south], [east, north], [west, north], [west, south]]]
+    }
+
+
+def resolve_roi(req):
+    """Resuelve la ROI de una petición.
+
+    Retorna (roi, roi_bounds, roi_geojson): la ee.Geometry, sus bounds
+    [west, south, east, north] y su GeoJSON, estos dos últimos calculados localmente.
+    """
+    # 1) kml_id: registro de parcelas (geometría, bounds y versión simplificada ya calculados)
+    if getattr(req, 'kml_id', None):
+        from services.plots import get_plot
+        plot = get_plot(req.kml_id)
+        if plot:
+            return ee.Geometry(plot['simplified']), list(plot['bounds']), plot['geometry']
+
+    # 2) geometry
+    if getattr(req, 'geometry', None):
+        geom = req.geometry
+        # A EE se envía la geometría simplificada/cuantizada; bounds y GeoJSON, los originales
+        return prepared_ee_geometry(geom), geojson_bounds(geom), geom
+
+    # 3) lon/lat center
+    if getattr(req, 'lon', None) is not None and getattr(req, 'lat', None) is not None:
+        try:
             lon = _parse_coord(getattr(req, 'lon'))
             lat = _parse_coord(getattr(req, 'lat'))
-            width_m = float(getattr(req, 'width_m'))
-            height_m = float(getattr(req, 'height_m'))
-            rect = meters_to_degrees(lon, lat, width_m, height_m)
-            roi = ee.Geometry.Rectangle(rect)
-            roi_bounds = rect
-            return roi, roi_bounds
-
-        raise ValueError('No ROI provided (kml_id, geometry, or lon/lat needed)')
-    except Exception:
-        raise
+        except Exception:
+            raise ValueError('Invalid lon/lat')
+        buffer_m = getattr(req, 'buffer_m', None) or getattr(req, 'radius_m', None) or 250
+        try:
+            buffer_m = float(buffer_m)
+        except Exception:
+            buffer_m = 250.0
+        bbox = center_point_to_bbox(lon, lat, buffer_m=buffer_m)
+        return ee.Geometry.Rectangle(bbox), bbox, bounds_to_polygon(bbox)
+
+    raise ValueError('No ROI provided (kml_id, geometry, or lon/lat needed)')
+
+
+def get_roi_from_request(req):
+    roi, roi_bounds, _ = resolve_roi(req)
+    return roi, roi_bounds
 
 
 def split_feature_collection(fc: dict):
     """Divide un GeoJSON FeatureCollection en una lista de features con metadatos útiles.
 
-    Retorna lista de dicts: { 'id': str, 'name': Optional[str], 'geometry': dict, 'properties': dict, 'area_m2': Optional[float] }
-    Intenta calcular el area en metros cuadrados usando Earth Engine; si falla, deja area_m2 en None.
+    Retorna lista de dicts: { 'id': str, 'name': Optional[str], 'geometry': dict, 'properties': dict, 'area_m2': Optional[float], 'perimeter_m': Optional[float] }
+    Área y perímetro geodésicos se calculan localmente para todas las features a la vez
+    (utils_pkg.geodesy), sin llamadas a Earth Engine; quedan en None si la geometría no se puede medir.
     """
     out = []
     if not fc:
@@ -163,40 +146,17 @@ def split_feature_collection(fc: dict):
     features = fc.get('features') if isinstance(fc, dict) else None
     if not features:
         return out
+    geometries = [feat.get('geometry') if isinstance(feat, dict) else None for feat in features]
+    areas, perimeters, _ = measure_geometries(geometries)
     for i, feat in enumerate(features):
         try:
             feat_id = feat.get('id') or feat.get('properties', {}).get('id') or feat.get('properties', {}).get('name') or f'feature_{i+1}'
             props = feat.get('properties', {}) or {}
             name = props.get('name') or props.get('title') or None
             geom = feat.get('geometry')
-            area_m2 = None
-            if geom:
-                try:
-                    g = ee.Geometry(geom)
-                    # usar area() geodesic
-                    area_m2 = float(g.area().getInfo())
-                except Exception:
-                    # fallback: intentar calcular area por bounds aproximado
-                    try:
-                        coords = None
-                        if geom.get('type') == 'Polygon':
-                            coords = geom.get('coordinates', [[]])[0]
-                        elif geom.get('type') == 'MultiPolygon':
-                            coords = [pt for poly in geom.get('coordinates', []) for pt in poly[0]]
-                        if coords:
-                            lons = [c[0] for c in coords]
-                            lats = [c[1] for c in coords]
-                            width_deg = max(lons) - min(lons)
-                            height_deg = max(lats) - min(lats)
-                            # aproximación: 1 deg lat ~ 111.32 km, lon depends on lat
-                            avg_lat = sum(lats) / len(lats) if lats else 0
-                            meters_per_deg_lat = 111320.0
-                            meters_per_deg_lon = 111320.0 * math.cos(math.radians(avg_lat)) if avg_lat else 111320.0
-                            approx_m2 = (width_deg * meters_per_deg_lon) * (height_deg * meters_per_deg_lat)
-                            area_m2 = float(abs(approx_m2))
-                    except Exception:
-                        area_m2 = None
-            out.append({'id': str(feat_id), 'name': name, 'geometry': geom, 'properties': props, 'area_m2': area_m2})
+            area_m2 = None if not geom or math.isnan(areas[i]) else float(areas[i])
+            perimeter_m = None if not geom or math.isnan(perimeters[i]) else float(perimeters[i])
+            out.append({'id': str(feat_id), 'name': name, 'geometry': geom, 'properties': props, 'area_m2': area_m2, 'perimeter_m': perimeter_m})
         except Exception:
             # skip malformed feature but keep iteration
             continue
@@ -0,0 +1,66 @@
+"""Single-flight: peticiones idénticas concurrentes comparten una sola computación.
+
+Mientras una computación con cierta clave está en curso, las llamadas con la misma
+clave esperan a que termine y reciben su resultado (o su excepción) en lugar de
+lanzar otra igual contra Earth Engine.
+"""
+import copy
+import threading
+
+
+class _Flight:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+        self.waiters = 0
+
+
+class SingleFlight:
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._flights = {}
+
+    def do(self, key, fn):
+        """Ejecuta fn() una sola vez por clave entre llamadas concurrentes.
+
+        Los que esperan reciben una copia profunda del resultado para que ninguna
+        petición pueda modificar lo que devuelve otra.
+        """
+        with self._lock:
+            flight = self._flights.get(key)
+            leader = flight is None
+            if leader:
+                flight = _Flight()
+                self._flights[key] = flight
+            else:
+                flight.waiters += 1
+
+        if not leader:
+            flight.done.wait()
+            if flight.error is not None:
+                raise flight.error
+            return copy.deepcopy(flight.result)
+
+        try:
+            flight.result = fn()
+        except BaseException as e:
+            flight.error = e
+            raise
+        finally:
+            with self._lock:
+                self._flights.pop(key, None)
+                shared = flight.waiters > 0
+            if shared:
+                print(f"singleflight: {flight.waiters} petición(es) compartieron la computación {key[:12]}")
+            flight.done.set()
+        return copy.deepcopy(flight.result) if shared else flight.result
+
+    def in_flight(self):
+        with self._lock:
+            return len(self._flights)
+
+
+# Instancia compartida para las operaciones costosas de EE de las rutas
+ee_flights = SingleFlight()
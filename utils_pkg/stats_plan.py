@@ -0,0 +1,50 @@
+"""Escala de las estadísticas zonales según el área de la ROI y un presupuesto de píxeles.
+
+Reducir siempre a 10 m hace lentas (o fallidas) las estadísticas de fincas
+grandes, y una escala fija más gruesa (las series usaban 60 m) deja las parcelas
+pequeñas con unos pocos píxeles. `plan_stats` elige la escala más fina que
+mantiene la reducción dentro del presupuesto: múltiplos enteros de la escala
+nativa de Sentinel-2, a partir del área geodésica de la ROI.
+
+La calidad (`fast`, `balanced`, `accurate`) fija el presupuesto y la elige cada
+petición. maxPixels deja margen sobre el presupuesto (la caja de la ROI cubre
+más píxeles que el polígono) y bestEffort queda activo como red de seguridad.
+"""
+import os
+import math
+from utils_pkg.geodesy import geodesic_area_m2
+
+NATIVE_SCALE_M = 10
+STATS_QUALITIES = ('fast', 'balanced', 'accurate')
+DEFAULT_STATS_QUALITY = os.getenv('DEFAULT_STATS_QUALITY', 'balanced')
+# Píxeles por reducción de la ROI completa (heatmap, /compute)
+REGION_PIXEL_BUDGETS = {'fast': 1e5, 'balanced': 1e6, 'accurate': 1e7}
+# Píxeles por pasada en las series (una reducción por imagen, todas en la misma llamada)
+SERIES_PIXEL_BUDGETS = {'fast': 1e3, 'balanced': 1e4, 'accurate': 1e5}
+MAX_PIXELS_MARGIN = 4
+
+
+def plan_stats(roi_geojson, quality=None, series=False, native_scale_m=NATIVE_SCALE_M):
+    """Plan de reducción para la ROI: dict con quality, scale_m, pixel_budget,
+    max_pixels, area_m2 y estimated_pixels (píxeles de la ROI a esa escala)."""
+    if quality not in STATS_QUALITIES:
+        quality = DEFAULT_STATS_QUALITY if DEFAULT_STATS_QUALITY in STATS_QUALITIES else 'balanced'
+    budget = (SERIES_PIXEL_BUDGETS if series else REGION_PIXEL_BUDGETS)[quality]
+    area_m2 = (geodesic_area_m2(roi_geojson) if roi_geojson else None) or 0.0
+    native_pixels = area_m2 / native_scale_m ** 2
+    # Agregar un número entero de píxeles nativos por lado hasta entrar en el presupuesto
+    factor = max(1, math.ceil(math.sqrt(native_pixels / budget)))
+    scale_m = native_scale_m * factor
+    return {
+        'quality': quality,
+        'scale_m': scale_m,
+        'pixel_budget': int(budget),
+        'max_pixels': int(budget * MAX_PIXELS_MARGIN),
+        'area_m2': round(area_m2, 1),
+        'estimated_pixels': int(round(area_m2 / scale_m ** 2)),
+    }
+
+
+def reduce_region_args(plan):
+    """Argumentos scale/maxPixels/bestEffort de reduceRegion para un plan."""
+    return {'scale': plan['scale_m'], 'maxPixels': plan['max_pixels'], 'bestEffort': True}